@@ -0,0 +1,350 @@
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageFilter
+
+# ベンチマーク対象のモジュールをインポート
+SRC_DIR = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+from blur_scan import PoolScanner
+from config import AppConfig
+from decode import register_heif
+from main import PhotoSelectorApp
+from metrics import Metrics
+from prefetch import PrefetchEngine
+from render import Renderer
+from sharpness import SharpnessEngine
+from similarity import hash_files
+
+# 画素数(MP)ごとの画像サイズ（それ以外は3:2で計算）
+SIZES = {12: (4000, 3000), 24: (6000, 4000), 48: (8000, 6000)}
+FORMATS = {'jpeg': '.jpg', 'png': '.png', 'heic': '.heic'}
+# 1セットの画像に順に掛けるぼかしの半径（0はシャープ）
+BLUR_RADII = (0, 2, 6)
+# 1枚の表示の各段階（load_image・blur_scoreはアプリの計測区間、totalはキーを押してから表示用の画素ができるまで）
+STAGES = ('load_image', 'blur_score', 'hash', 'render', 'present', 'total')
+DISPLAY_SIZE = (1024, 708)
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+CONFIG_PATH = os.path.join(SRC_DIR, 'setting.ini')
+
+
+def image_size(mp):
+    if mp in SIZES:
+        return SIZES[mp]
+    w = math.sqrt(mp * 1e6 * 3 / 2)
+    return max(1, round(w)), max(1, round(w * 2 / 3))
+
+
+def synthetic_photo(size, seed, blur=0, shift=(0, 0)):
+    # 写真に近い合成画像（なめらかな濃淡に細かい模様を重ねる）。shiftで連写のような少しずれた画像にする
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    w, h = size
+    base = Image.fromarray(rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)).resize((w + 64, h + 64), Image.BICUBIC)
+    texture = rng.integers(-24, 25, (256, 256, 1), dtype=np.int16)
+    arr = np.asarray(base, dtype=np.int16)[32 + shift[1]:32 + shift[1] + h, 32 + shift[0]:32 + shift[0] + w]
+    reps = (h + 255) // 256, (w + 255) // 256, 1
+    arr = arr + np.tile(texture, reps)[:h, :w]
+    img = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+    if blur:
+        # 大きな画像は縮小してからぼかして戻す（生成を速くするため）
+        img = img.reduce(4).filter(ImageFilter.GaussianBlur(blur / 4 + 0.5)).resize(size, Image.BICUBIC)
+    return img
+
+
+def save_image(img, path, fmt):
+    if fmt == 'heic':
+        register_heif()
+        img.save(path, 'HEIF', quality=90)
+    elif fmt == 'jpeg':
+        img.save(path, 'JPEG', quality=92)
+    else:
+        img.save(path, 'PNG', compress_level=1)
+
+
+def build_corpus(root, fmt, mp, count, burst=0):
+    # 合成画像のセットを作る（作成済みのファイルは使い回す）。戻り値はファイルパスのリスト
+    os.makedirs(root, exist_ok=True)
+    size = image_size(mp)
+    paths = []
+    for i in range(count):
+        blur = BLUR_RADII[i % len(BLUR_RADII)]
+        paths.append((os.path.join(root, f'{fmt}_{mp}mp_{i:03d}_b{blur}{FORMATS[fmt]}'), i, blur, (0, 0)))
+    for i in range(burst):
+        paths.append((os.path.join(root, f'{fmt}_{mp}mp_burst{i:03d}{FORMATS[fmt]}'), 1000, 0, (i * 3, i)))
+    for path, seed, blur, shift in paths:
+        if not os.path.exists(path):
+            save_image(synthetic_photo(size, seed, blur, shift), path + '.tmp', fmt)
+            os.replace(path + '.tmp', path)
+    return [p[0] for p in paths]
+
+
+class StageTimer:
+    # 段階ごとの所要時間(ms)を記録する
+    def __init__(self):
+        self.samples = {}
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - start) * 1000)
+
+    def add(self, stage, ms):
+        self.samples.setdefault(stage, []).append(ms)
+
+
+def percentile(values, q):
+    # 最近傍順位法によるパーセンタイル
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    return {
+        'n': len(values),
+        'p50': round(percentile(values, 50), 3),
+        'p99': round(percentile(values, 99), 3),
+        'mean': round(sum(values) / len(values), 3),
+    }
+
+
+def peak_rss_mb():
+    # プロセス開始からの最大常駐メモリ(MB)。取得できない環境ではNone
+    # プロセス全体の最大値なので、コーパスごとの値はmeasure_corpusを別プロセスで実行して測る
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 2 ** 20, 1)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト
+    return round(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+class BenchApp:
+    # ウィンドウを作らずに、アプリの表示用の読み込み（PhotoSelectorApp.load_display_image）と描画（Renderer）を呼ぶ
+    # Tkに触れないメソッドだけをアプリから借りる。解析キャッシュは使わず、毎回元ファイルをデコードする
+    load_display_image = PhotoSelectorApp.load_display_image
+    load_cached_display_image = PhotoSelectorApp.load_cached_display_image
+    store_analysis = PhotoSelectorApp.store_analysis
+    blur_score = PhotoSelectorApp.blur_score
+    zoom_box = PhotoSelectorApp.zoom_box
+
+    def __init__(self, config, display=DISPLAY_SIZE, workers=2):
+        self.config = config
+        self.metrics = Metrics()
+        self.decode_size = display
+        self.analysis_cache = None
+        self.sharpness = SharpnessEngine(config.blur_metric, config.blur_analysis_size, config.blur_tiles)
+        self.renderer = Renderer(config.zoom_range, config.zoom_scale, config.render_filter,
+                                 config.render_fast_filter, config.render_cache)
+        self.prefetcher = PrefetchEngine(self.load_display_image, 2 ** 31, workers, metrics=self.metrics)
+
+    def render(self, path, frame):
+        # render_frameと同じ描画（拡大図・ぼやけラベル付き）
+        blur = frame.blur_score < self.config.blur_threshold
+        return self.renderer.render(path, frame, self.decode_size, self.zoom_box(frame.original_size), blur)
+
+    def span_samples(self, name):
+        # アプリの計測区間の所要時間(ms)を記録順に返す
+        return [duration / 1e6 for kind, span, _, duration, _ in self.metrics.events
+                if kind == 'span' and span == name]
+
+
+def bench_pipeline(paths, config, display=DISPLAY_SIZE):
+    # 先読み無しで1枚ずつ「キーを押してから表示用の画素ができるまで」を計測する
+    timer = StageTimer()
+    app = BenchApp(config, display)
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            frame = app.load_display_image(path)
+            with timer('render'):
+                img = app.render(path, frame)
+            with timer('present'):
+                # ImageTk.PhotoImageへの変換と同じく画素をすべてコピーする
+                img.tobytes()
+            timer.add('total', (time.perf_counter() - start) * 1000)
+            with timer('hash'):
+                # 連写のグループ分けのワーカーと同じ処理
+                hash_files([path], config.group_method)
+    finally:
+        app.prefetcher.shutdown()
+    for stage in ('load_image', 'blur_score'):
+        timer.samples[stage] = app.span_samples(stage)
+    return timer.samples
+
+
+def bench_navigation(paths, config, dwell=0.05, ahead=3, workers=2, display=DISPLAY_SIZE):
+    # 先読みありで順に送ったときの1枚ごとの表示までの時間。dwellは1枚を見ている時間（秒）
+    timer = StageTimer()
+    app = BenchApp(config, display, workers)
+    start_all = time.perf_counter()
+    try:
+        for i, path in enumerate(paths):
+            start = time.perf_counter()
+            frame = app.prefetcher.get(path)
+            app.render(path, frame).tobytes()
+            timer.add('navigate', (time.perf_counter() - start) * 1000)
+            app.prefetcher.schedule(paths[i + 1:i + 1 + ahead])
+            time.sleep(dwell)
+    finally:
+        app.prefetcher.shutdown()
+    elapsed = time.perf_counter() - start_all - dwell * len(paths)
+    return timer.samples['navigate'], len(paths) / max(elapsed, 1e-9)
+
+
+def bench_scan(paths, engine, jobs=0):
+    # フォルダ全体のぼやけ判定（プロセスプール）の処理速度（枚/秒）
+    scanner = PoolScanner(engine, jobs)
+    start = time.perf_counter()
+    scanner.start(paths)
+    done = 0
+    try:
+        while done < len(paths):
+            time.sleep(0.01)
+            done += len(scanner.poll())
+    finally:
+        scanner.shutdown()
+    return len(paths) / (time.perf_counter() - start)
+
+
+def measure_corpus(paths, jobs=0, dwell=0.05, config_path=CONFIG_PATH):
+    # 1つのコーパスを計測する（runから新しいプロセスで呼ばれ、最大メモリはこのコーパスだけの値になる）
+    config = AppConfig(config_path)
+    engine = SharpnessEngine(config.blur_metric, config.blur_analysis_size, config.blur_tiles)
+    samples = bench_pipeline(paths, config)
+    navigate, nav_rate = bench_navigation(paths, config, dwell)
+    result = {stage: summarize(samples[stage]) for stage in STAGES}
+    result['navigate'] = summarize(navigate)
+    result['throughput'] = {
+        'pipeline': round(len(paths) * 1000 / sum(samples['total']), 2),
+        'navigate': round(nav_rate, 2),
+        'scan': round(bench_scan(paths, engine, jobs), 2),
+    }
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run(corpus_dir, formats, sizes, count, burst, jobs=0, dwell=0.05, log=lambda msg: None, config_path=CONFIG_PATH):
+    # 形式×画素数ごとにコーパスを作って計測し、結果の辞書を返す（設定はアプリと同じsetting.ini）
+    # 計測はコーパスごとにspawnした新しいプロセスで行う（前のコーパスやコーパス作成の最大メモリを引き継がない）
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for fmt in formats:
+        for mp in sizes:
+            name = f'{fmt}_{mp}mp'
+            log(f'{name}: コーパス作成')
+            paths = build_corpus(corpus_dir, fmt, mp, count, burst)
+            log(f'{name}: 計測 {len(paths)}枚')
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                results[name] = pool.submit(measure_corpus, paths, jobs, dwell, config_path).result()
+    return results
+
+
+def compare(results, baseline, tolerance=0.25, min_ms=2.0, min_mb=16.0):
+    # 基準値よりp50・p99が(1+tolerance)倍かつmin_ms以上遅くなった段階、処理速度が落ちた項目、
+    # 最大メモリが(1+tolerance)倍かつmin_mb以上増えたコーパスを返す
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for stage, stats in result.items():
+            if stage in ('throughput', 'peak_rss_mb') or stage not in base:
+                continue
+            for key in ('p50', 'p99'):
+                old, new = base[stage][key], stats[key]
+                if new > old * (1 + tolerance) and new - old >= min_ms:
+                    regressions.append(f'{name} {stage} {key}: {old:.1f}ms -> {new:.1f}ms')
+        for kind, rate in result['throughput'].items():
+            old = base.get('throughput', {}).get(kind)
+            if old and rate < old / (1 + tolerance):
+                regressions.append(f'{name} throughput {kind}: {old:.2f}/s -> {rate:.2f}/s')
+        old, new = base.get('peak_rss_mb'), result.get('peak_rss_mb')
+        if old and new and new > old * (1 + tolerance) and new - old >= min_mb:
+            regressions.append(f'{name} peak_rss_mb: {old:.1f}MB -> {new:.1f}MB')
+    return regressions
+
+
+def format_table(results):
+    lines = [f'{"":12} {"stage":9} {"p50 ms":>9} {"p99 ms":>9}']
+    for name, result in results.items():
+        for stage in STAGES + ('navigate',):
+            stats = result[stage]
+            lines.append(f'{name:12} {stage:9} {stats["p50"]:9.1f} {stats["p99"]:9.1f}')
+        rates = ', '.join(f'{k} {v:.1f}枚/秒' for k, v in result['throughput'].items())
+        lines.append(f'{name:12} {rates}, 最大メモリ {result["peak_rss_mb"]}MB')
+    return '\n'.join(lines)
+
+
+def parse_list(text, cast=str):
+    return [cast(v.strip()) for v in text.split(',') if v.strip()]
+
+
+def number(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='合成した写真で表示・解析の各段階の速度を計測する')
+    parser.add_argument('--formats', default='jpeg,png,heic', help='画像形式（jpeg, png, heic）')
+    parser.add_argument('--sizes', default='12,24,48', help='画素数(MP)')
+    parser.add_argument('--count', type=int, default=6, help='形式×画素数ごとの枚数（ぼかしの強さを順に変える）')
+    parser.add_argument('--burst', type=int, default=4, help='連写（少しずつずらした画像）の枚数')
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'picsel_bench'),
+                        help='合成画像の保存先（作成済みの画像は使い回す）')
+    parser.add_argument('--jobs', type=int, default=0, help='ぼやけ判定のプロセス数（0でCPU数）')
+    parser.add_argument('--dwell', type=float, default=0.05, help='先読みありの計測で1枚を見ている時間（秒）')
+    parser.add_argument('--config', default=CONFIG_PATH, help='アプリの設定ファイル（ぼやけ判定・拡大表示・描画の設定）')
+    parser.add_argument('--output', help='結果をJSONで保存するパス')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='比較する基準値のJSON')
+    parser.add_argument('--save-baseline', action='store_true', help='今回の結果を基準値として保存する')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='遅くなった・メモリが増えたとみなす割合')
+    args = parser.parse_args(argv)
+    formats = parse_list(args.formats)
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        parser.error(f'unknown format: {", ".join(sorted(unknown))}')
+
+    results = run(args.corpus, formats, parse_list(args.sizes, number), args.count, args.burst,
+                  args.jobs, args.dwell, log=lambda msg: print(msg, file=sys.stderr), config_path=args.config)
+    print(format_table(results))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        return 0
+    if not os.path.exists(args.baseline):
+        # 比較できないまま成功扱いにしない
+        print(f'基準値がありません: {args.baseline}（--save-baselineで作成してください）', file=sys.stderr)
+        return 2
+    with open(args.baseline, encoding='utf-8') as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for line in regressions:
+        print(f'悪化した: {line}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1 @@
-pytest test/test_photo_selector.py -v
\ No newline at end of file
+pytest test -v
\ No newline at end of file
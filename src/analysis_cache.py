@@ -0,0 +1,325 @@
+import hashlib
+import io
+import os
+import queue
+import sqlite3
+import threading
+import time
+from PIL import Image
+
+# スキーマや保存内容の意味が変わったら上げる（古いキャッシュは破棄される）
+SCHEMA_VERSION = 5
+# 内容ハッシュに使う先頭・末尾の読み込みサイズ
+HASH_CHUNK = 64 * 1024
+# 容量の計算で画像以外の項目・索引に見込む1件あたりのバイト数
+ROW_BYTES = 256
+
+COLUMNS = ('size', 'mtime_ns', 'hash', 'blur', 'blur_metric', 'orientation', 'width', 'height',
+           'preview', 'zoom', 'zoom_range', 'phash')
+# 画像（BLOB）以外の項目。フォルダ全体をまとめて読むときはこれだけ読む
+SCALAR_COLUMNS = tuple(c for c in COLUMNS if c not in ('preview', 'zoom'))
+# 1回のクエリで問い合わせるパスの数（SQLiteの変数の上限より小さくする）
+QUERY_CHUNK = 500
+
+
+def default_cache_dir():
+    # ユーザーごとのキャッシュフォルダ（WindowsはLOCALAPPDATA配下）
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'picsel')
+
+
+def file_hash(path, size=None):
+    # ファイルサイズと先頭・末尾のチャンクから計算する軽量な内容ハッシュ
+    if size is None:
+        size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(HASH_CHUNK))
+        if size > HASH_CHUNK * 2:
+            f.seek(-HASH_CHUNK, os.SEEK_END)
+            h.update(f.read(HASH_CHUNK))
+    return h.hexdigest()
+
+
+def encode_image(img, fmt='JPEG'):
+    # キャッシュ保存用に画像をバイト列へ変換
+    buf = io.BytesIO()
+    if fmt == 'JPEG':
+        img.save(buf, fmt, quality=90)
+    else:
+        img.save(buf, fmt)
+    return buf.getvalue()
+
+
+def decode_image(data):
+    img = Image.open(io.BytesIO(data))
+    return img.convert('RGB')
+
+
+class AnalysisCache:
+    # ファイルごとの解析結果（ぼやけ値・向き・寸法・表示用プレビュー）をSQLiteに永続化する
+    # キーはパス＋サイズ＋更新時刻。変更されたファイルのエントリは自動的に無効になる
+    # max_bytes（0で無制限）を超えた分は、pruneで最後に使った時刻の古いものからプレビューを捨てる
+    # （ぼやけ値・ハッシュなどの小さな項目は残すので、フォルダを開き直しても計算し直さない）
+    def __init__(self, path, use_hash=False, max_bytes=0):
+        self.path = path
+        self.use_hash = use_hash
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # 読み出したエントリの最後に使った時刻（書き込みを減らすため保存・prune・closeでまとめて反映する）
+        self._used = {}
+        self._clock = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._conn.execute('DROP TABLE IF EXISTS entries')
+            # 削除した分のファイル容量をprune後に返せるようにする（設定はVACUUMで反映される）
+            self._conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            self._conn.execute('VACUUM')
+            self._conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT, '
+            'blur REAL, blur_metric TEXT, orientation INTEGER, width INTEGER, height INTEGER, '
+            'preview BLOB, zoom BLOB, zoom_range INTEGER, phash TEXT, used INTEGER)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+        self._conn.commit()
+
+    def _key(self, path):
+        return os.path.abspath(path)
+
+    def lookup(self, path):
+        # 有効なエントリを辞書で返す。ファイルが変更されていれば破棄してNone
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = self._key(path)
+        with self._lock:
+            if self.closed:
+                return None
+            row = self._conn.execute(
+                f'SELECT {", ".join(COLUMNS)} FROM entries WHERE path=?', (key,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(COLUMNS, row))
+        if entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            with self._lock:
+                self._used[key] = self._tick()
+            return entry
+        if self.use_hash and entry['hash'] and entry['size'] == st.st_size \
+                and entry['hash'] == file_hash(path, st.st_size):
+            # 更新時刻だけ変わった（コピー・同期など）場合はエントリを引き継ぐ
+            with self._lock:
+                if not self.closed:
+                    self._conn.execute('UPDATE entries SET mtime_ns=? WHERE path=?', (st.st_mtime_ns, key))
+                    self._conn.commit()
+            entry['mtime_ns'] = st.st_mtime_ns
+            with self._lock:
+                self._used[key] = self._tick()
+            return entry
+        self.invalidate(path)
+        return None
+
+    def lookup_many(self, paths):
+        # 複数ファイルの有効なエントリをまとめて取得する {path: entry}
+        result = {}
+        for path in paths:
+            entry = self.lookup(path)
+            if entry is not None:
+                result[path] = entry
+        return result
+
+    def lookup_scalars(self, paths, stats=None):
+        # 複数ファイルの有効なエントリの画像以外の項目を、まとめたクエリで取得する {path: entry}
+        # statsは{path: (サイズ, 更新日時ns)}（フォルダの一覧で分かっていればファイルごとのstatを省く）
+        paths = list(paths)
+        rows = {}
+        for i in range(0, len(paths), QUERY_CHUNK):
+            chunk = {self._key(path): path for path in paths[i:i + QUERY_CHUNK]}
+            marks = ', '.join('?' for _ in chunk)
+            with self._lock:
+                if self.closed:
+                    return {}
+                found = self._conn.execute(
+                    f'SELECT path, {", ".join(SCALAR_COLUMNS)} FROM entries WHERE path IN ({marks})',
+                    list(chunk)).fetchall()
+            for row in found:
+                rows[chunk[row[0]]] = dict(zip(SCALAR_COLUMNS, row[1:]))
+        result = {}
+        used = []
+        for path, entry in rows.items():
+            if stats is not None and path in stats:
+                size, mtime_ns = stats[path]
+            else:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                size, mtime_ns = st.st_size, st.st_mtime_ns
+            if (entry['size'], entry['mtime_ns']) == (size, mtime_ns):
+                result[path] = entry
+                used.append(self._key(path))
+            elif self.use_hash and entry['hash'] and entry['size'] == size:
+                # 更新日時だけ変わったファイルは1件ずつ内容ハッシュで確かめる（lookupと同じ扱い）
+                entry = self.lookup(path)
+                if entry is not None:
+                    result[path] = {c: entry[c] for c in SCALAR_COLUMNS}
+        with self._lock:
+            for key in used:
+                self._used[key] = self._tick()
+        return result
+
+    def store(self, path, **fields):
+        # 指定した項目を保存する（他の項目は既存の値を保持）
+        self.store_many([(path, fields)])
+
+    def store_many(self, items):
+        # [(path, fields), ...]を1回のトランザクションで保存する
+        rows = []
+        for path, fields in items:
+            unknown = set(fields) - set(COLUMNS)
+            if unknown:
+                raise ValueError(f'unknown fields: {sorted(unknown)}')
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            fields = dict(fields, size=st.st_size, mtime_ns=st.st_mtime_ns)
+            if self.use_hash and 'hash' not in fields:
+                fields['hash'] = file_hash(path, st.st_size)
+            rows.append((self._key(path), fields))
+        with self._lock:
+            if self.closed:
+                return
+            self._flush_used()
+            for key, fields in rows:
+                fields['used'] = self._tick()
+                self._upsert(key, fields)
+            self._conn.commit()
+
+    def _tick(self):
+        # 最後に使った時刻（時計の分解能が粗くても同じ値にならないようにする。ロックを持って呼ぶ）
+        self._clock = max(time.time_ns(), self._clock + 1)
+        return self._clock
+
+    def _flush_used(self):
+        # 読み出したエントリの最後に使った時刻を書き込む（ロックを持って呼ぶ。commitは呼び出し側）
+        if self._used:
+            self._conn.executemany('UPDATE entries SET used=? WHERE path=?',
+                                   [(used, key) for key, used in self._used.items()])
+            self._used.clear()
+
+    def _upsert(self, key, fields):
+        row = self._conn.execute(
+            'SELECT size, mtime_ns FROM entries WHERE path=?', (key,)).fetchone()
+        if row is not None and tuple(row) != (fields['size'], fields['mtime_ns']):
+            # 古いファイルの値は引き継がない
+            self._conn.execute('DELETE FROM entries WHERE path=?', (key,))
+        names = ', '.join(fields)
+        marks = ', '.join('?' for _ in fields)
+        updates = ', '.join(f'{name}=excluded.{name}' for name in fields)
+        self._conn.execute(
+            f'INSERT INTO entries (path, {names}) VALUES (?, {marks}) '
+            f'ON CONFLICT(path) DO UPDATE SET {updates}',
+            (key, *fields.values()))
+
+    def invalidate(self, path):
+        with self._lock:
+            if self.closed:
+                return
+            self._conn.execute('DELETE FROM entries WHERE path=?', (self._key(path),))
+            self._conn.commit()
+
+    def prune(self):
+        # 消えたファイルのエントリを削除し、max_bytesを超えた分は最近使っていないエントリのプレビュー・拡大図だけを捨てる
+        # 削除・プレビューを捨てたエントリの数を返す
+        # フォルダごと見つからないファイル（カードを抜いた・NASにつながっていない）は消えたとはみなさない
+        with self._lock:
+            if self.closed:
+                return 0
+            self._flush_used()
+            self._conn.commit()
+            rows = self._conn.execute(
+                'SELECT path, used, COALESCE(LENGTH(preview), 0) + COALESCE(LENGTH(zoom), 0) '
+                'FROM entries ORDER BY used DESC').fetchall()
+        folders = {}
+        removed, evicted, total = [], [], 0
+        for key, used, nbytes in rows:
+            folder = os.path.dirname(key)
+            if folder not in folders:
+                folders[folder] = os.path.isdir(folder)
+            if folders[folder] and not os.path.exists(key):
+                removed.append((key, used))
+                continue
+            total += ROW_BYTES
+            if not nbytes:
+                continue
+            if self.max_bytes and total + nbytes > self.max_bytes:
+                evicted.append((key, used))
+            else:
+                total += nbytes
+        if not removed and not evicted:
+            return 0
+        with self._lock:
+            if self.closed:
+                return 0
+            # 調べている間に使われた・保存し直されたエントリはそのままにする
+            self._flush_used()
+            self._conn.executemany('DELETE FROM entries WHERE path=? AND used IS ?', removed)
+            self._conn.executemany('UPDATE entries SET preview=NULL, zoom=NULL WHERE path=? AND used IS ?', evicted)
+            self._conn.commit()
+            # 1ステップで1ページずつ返すので最後まで読み進める
+            self._conn.execute('PRAGMA incremental_vacuum').fetchall()
+        return len(removed) + len(evicted)
+
+    def start_lookup(self, paths, stats=None):
+        # lookup_scalarsをバックグラウンドのスレッドで実行する（結果はCachedLookup.pollで受け取る）
+        return CachedLookup(self, paths, stats)
+
+    def start_prune(self):
+        # pruneをバックグラウンドのスレッドで実行する（起動直後の表示を待たせない）
+        thread = threading.Thread(target=self.prune, name='cache-prune', daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def closed(self):
+        return self._conn is None
+
+    def close(self):
+        # 終了後もワーカースレッドから呼ばれることがあるため、以降の操作は何もしない
+        with self._lock:
+            if self._conn is not None:
+                self._flush_used()
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+
+class CachedLookup:
+    # フォルダを開いたときのキャッシュの読み込みをTkのスレッドの外で行う
+    def __init__(self, cache, paths, stats=None):
+        self._result = queue.Queue()
+        self._thread = threading.Thread(target=self._run, args=(cache, list(paths), stats),
+                                        name='cache-lookup', daemon=True)
+        self._thread.start()
+
+    def _run(self, cache, paths, stats):
+        try:
+            self._result.put(cache.lookup_scalars(paths, stats))
+        except (OSError, sqlite3.Error) as e:
+            print(f'キャッシュ読み込み失敗: {e}')
+            self._result.put({})
+
+    def poll(self):
+        # 終わっていれば{path: entry}、まだならNone
+        try:
+            return self._result.get_nowait()
+        except queue.Empty:
+            return None
@@ -0,0 +1,104 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from decode import load_scaled
+
+# 1回のタスクでまとめて評価する枚数
+CHUNK_SIZE = 8
+
+
+def score_files(paths, engine):
+    # プロセスプールのワーカーで実行される。解析サイズまで縮小デコードした画像をまとめて評価する
+    # 戻り値は[(path, score), ...]（読み込めなかったファイルはNone）
+    imgs = []
+    loaded = []
+    for path in paths:
+        try:
+            img, _ = load_scaled(path, None, long_edge=engine.size)
+        except Exception:
+            continue
+        imgs.append(img)
+        loaded.append(path)
+    scores = dict(zip(loaded, engine.score_batch(imgs))) if imgs else {}
+    return [(path, scores.get(path)) for path in paths]
+
+
+class PoolScanner:
+    # フォルダ全体のファイルをCHUNK_SIZE枚ずつtask(paths, arg) -> [(path, 値), ...]でプロセスプールで解析し、
+    # 終わったものから順にキューで返す（デフォルトのtaskはぼやけ値。argはSharpnessEngine）
+    def __init__(self, arg, jobs=0, task=score_files):
+        self.arg = arg
+        self.task = task
+        self.jobs = jobs or os.cpu_count() or 1
+        self.total = 0
+        self.done = 0
+        self._executor = None
+        self._futures = []
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def start(self, paths):
+        # 前回のスキャンは取り消して新しく開始する
+        self.cancel()
+        self.add(paths)
+
+    def add(self, paths):
+        # 実行中のスキャンを取り消さずにファイルを追加する
+        if not paths:
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.jobs)
+        with self._lock:
+            generation = self._generation
+            self.total += len(paths)
+        for i in range(0, len(paths), CHUNK_SIZE):
+            chunk = paths[i:i + CHUNK_SIZE]
+            future = self._executor.submit(self.task, chunk, self.arg)
+            future.add_done_callback(lambda f, c=chunk: self._on_done(generation, c, f))
+            self._futures.append(future)
+
+    def _on_done(self, generation, chunk, future):
+        if future.cancelled():
+            return
+        try:
+            results = future.result()
+        except Exception:
+            results = [(path, None) for path in chunk]
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.done += len(results)
+        for result in results:
+            self._results.put(result)
+
+    def poll(self):
+        # 前回の呼び出し以降に終わった結果を[(path, 値), ...]で返す（値は失敗時None）
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    @property
+    def running(self):
+        return self.done < self.total
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+            self.total = 0
+            self.done = 0
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+        self.poll()
+
+    def shutdown(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,235 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+from analysis_cache import AnalysisCache, default_cache_dir
+from blur_scan import PoolScanner
+from config import AppConfig, SETTINGS_PATH
+from duplicates import exact_duplicates
+from indexer import FolderIndex
+from routing import destination_folders, parse_destinations
+from session import SessionStore, KEEP, DELETE, UNRATED, file_stamp
+from sharpness import SharpnessEngine
+from similarity import hash_files, group_bursts
+
+FORMATS = ('json', 'csv')
+CSV_FIELDS = ('name', 'decision', 'reason', 'blur', 'duplicate_of')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='picsel', description='ウィンドウを開かずにフォルダを解析し、保存・削除の候補を書き出す')
+    parser.add_argument('folder', help='写真フォルダ')
+    parser.add_argument('-o', '--output', default='-', help='結果の出力先（省略時は標準出力）')
+    parser.add_argument('-f', '--format', choices=FORMATS,
+                        help='出力形式（省略時は出力先の拡張子で判断し、標準出力はjson）')
+    parser.add_argument('-j', '--jobs', type=int, help='解析に使うプロセス数（0でCPU数。省略時はsetting.iniの値）')
+    parser.add_argument('-c', '--config', default=SETTINGS_PATH, help='設定ファイル')
+    parser.add_argument('-t', '--threshold', type=float, help='ぼやけ閾値（省略時はsetting.iniの値）')
+    parser.add_argument('--near-delete', action='store_true',
+                        help='連写のグループ（[group]の設定）で最もシャープな1枚以外を削除候補にする')
+    parser.add_argument('-n', '--near-threshold', type=int,
+                        help='--near-deleteで同じグループとみなすハッシュの距離（省略時は[group] thresholdの値）')
+    parser.add_argument('-w', '--where', help='撮影情報の絞り込み条件（例："shutter > 1/60"。省略時はsetting.iniの値）')
+    parser.add_argument('-r', '--recursive', action='store_true', help='サブフォルダも対象にする')
+    parser.add_argument('--mark-session', action='store_true', help='削除候補をフォルダのセッションに書き込む')
+    parser.add_argument('-q', '--quiet', action='store_true', help='進捗を表示しない')
+    return parser.parse_args(argv)
+
+
+def output_format(args):
+    if args.format:
+        return args.format
+    return 'csv' if args.output.lower().endswith('.csv') else 'json'
+
+
+def open_cache(config):
+    # GUIと同じ解析キャッシュを開く（無効・開けない場合はNone）
+    if not config.cache_enabled:
+        return None
+    cache_dir = config.cache_dir or default_cache_dir()
+    try:
+        return AnalysisCache(os.path.join(cache_dir, 'analysis.sqlite'), use_hash=config.cache_content_hash,
+                             max_bytes=config.cache_max_mb * 1024 * 1024)
+    except (OSError, sqlite3.Error) as e:
+        print(f'キャッシュを開けません: {e}', file=sys.stderr)
+        return None
+
+
+def run_scanner(scanner, paths, label, log):
+    # プロセスプールで解析し、全件終わるまで待って{path: 値}を返す（失敗したファイルはNone）
+    results = {}
+    scanner.start(paths)
+    try:
+        while len(results) < len(paths):
+            time.sleep(0.1)
+            polled = scanner.poll()
+            for path, value in polled:
+                results[path] = value
+            if polled:
+                log(f'{label} {len(results)}/{len(paths)}')
+    finally:
+        scanner.shutdown()
+    return results
+
+
+def decide(names, scores, threshold, exact_groups=(), near_groups=()):
+    # 画像ごとの判定を並び順のリストで返す
+    # 完全一致・連写のグループはグループで最もシャープな1枚（同じなら先頭）を残し、残りはぼやけ値で判定する
+    order = {name: i for i, name in enumerate(names)}
+    duplicate_of = {}
+    for reason, groups in (('duplicate', exact_groups), ('near_duplicate', near_groups)):
+        for group in groups:
+            ranked = sorted(group, key=lambda n: (-(scores.get(n) or 0.0), order[n]))
+            for name in ranked[1:]:
+                duplicate_of.setdefault(name, (reason, ranked[0]))
+    records = []
+    for name in names:
+        score = scores.get(name)
+        record = {'name': name, 'decision': KEEP, 'reason': '', 'blur': score, 'duplicate_of': ''}
+        if name in duplicate_of:
+            record['decision'] = DELETE
+            record['reason'], record['duplicate_of'] = duplicate_of[name]
+        elif score is None:
+            record['decision'], record['reason'] = UNRATED, 'unreadable'
+        elif score < threshold:
+            record['decision'], record['reason'] = DELETE, 'blur'
+        records.append(record)
+    return records
+
+
+def write_report(records, out, fmt, folder, threshold):
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(records)
+        return
+    report = {
+        'folder': os.path.abspath(folder),
+        'threshold': threshold,
+        'keep': [r['name'] for r in records if r['decision'] == KEEP],
+        'delete': [r['name'] for r in records if r['decision'] == DELETE],
+        'images': records,
+    }
+    json.dump(report, out, ensure_ascii=False, indent=2)
+    out.write('\n')
+
+
+def mark_session(folder, records):
+    # 削除候補をフォルダのセッションに書き込む（GUIで開くと削除リストに入った状態で始まる）
+    # GUIで既に判定した画像はそのままにする。書き込んだ件数を返す
+    session = SessionStore.for_folder(folder)
+    count = 0
+    try:
+        for record in records:
+            if record['decision'] == DELETE and session.decision(record['name']) == UNRATED:
+                session.set_decision(record['name'], DELETE, file_stamp(os.path.join(folder, record['name'])))
+                count += 1
+    finally:
+        session.close()
+    return count
+
+
+def excluded_folders(config):
+    # GUIと同じく、保存先フォルダ（[destinations]を含む）は解析の対象にしない
+    try:
+        destinations = parse_destinations(config.destinations)
+    except ValueError:
+        destinations = {}
+    return destination_folders(config.last_save_dir, destinations)
+
+
+def analyze(folder, config, jobs, threshold, near_threshold=None, recursive=False, log=lambda msg: None, where=None):
+    # フォルダを走査し、ぼやけ値・知覚ハッシュ（キャッシュに無いもののみ）を並列に計算して判定を返す
+    # near_thresholdを指定した場合だけ、GUIと同じ連写のグループ（並び順でwindow枚以内）の2枚目以降も削除候補にする
+    # whereを指定すると、撮影情報の絞り込み条件（省略時はsetting.iniの値）を満たす画像だけを対象にする
+    index = FolderIndex(folder, recursive or config.index_recursive, config.index_extensions, config.index_order,
+                        config.index_filter if where is None else where, excluded_folders(config))
+    index.scan()
+    if index.needs_metadata:
+        index.load_metadata()
+    names = index.names()
+    paths = {os.path.join(folder, name): name for name in names}
+    log(f'{len(names)}枚')
+
+    engine = SharpnessEngine(config.blur_metric, config.blur_analysis_size, config.blur_tiles)
+    prefix = config.group_method + ':'
+    scores, hashes = {}, {}
+    cache = open_cache(config)
+    if cache is not None:
+        stats = {path: (index.entries[name].size, index.entries[name].mtime_ns) for path, name in paths.items()}
+        for path, entry in cache.lookup_scalars(paths, stats).items():
+            if entry['blur'] is not None and entry['blur_metric'] == engine.signature:
+                scores[paths[path]] = entry['blur']
+            if near_threshold is not None and entry['phash'] and entry['phash'].startswith(prefix):
+                hashes[paths[path]] = int(entry['phash'][len(prefix):], 16)
+
+    todo = [path for path, name in paths.items() if name not in scores]
+    stored = []
+    for path, score in run_scanner(PoolScanner(engine, jobs), todo, 'ぼやけ判定', log).items():
+        scores[paths[path]] = score
+        if score is not None:
+            stored.append((path, {'blur': score, 'blur_metric': engine.signature}))
+    if near_threshold is not None:
+        todo = [path for path, name in paths.items() if name not in hashes and scores[name] is not None]
+        scanner = PoolScanner(config.group_method, jobs, task=hash_files)
+        for path, value in run_scanner(scanner, todo, 'ハッシュ計算', log).items():
+            hashes[paths[path]] = value
+            if value is not None:
+                stored.append((path, {'phash': f'{prefix}{value:016x}'}))
+    if cache is not None:
+        try:
+            cache.store_many(stored)
+            cache.prune()
+        except (OSError, sqlite3.Error) as e:
+            print(f'キャッシュ保存失敗: {e}', file=sys.stderr)
+        cache.close()
+
+    sizes = {name: index.entries[name].size for name in names}
+    exact = exact_duplicates({os.path.join(folder, n): size for n, size in sizes.items()}, config.duplicates_workers)
+    exact = [[paths[path] for path in group] for group in exact]
+    near = []
+    if near_threshold is not None:
+        groups = group_bursts(names, hashes, near_threshold, config.group_window)
+        near = [group for group in groups if len(group) > 1]
+    return decide(names, scores, threshold, exact, near)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if not os.path.isdir(args.folder):
+        print(f'フォルダがありません: {args.folder}', file=sys.stderr)
+        return 2
+    config = AppConfig(args.config)
+    jobs = config.blur_jobs if args.jobs is None else args.jobs
+    threshold = config.blur_threshold if args.threshold is None else args.threshold
+    near_threshold = None
+    if args.near_delete:
+        near_threshold = config.group_threshold if args.near_threshold is None else args.near_threshold
+    log = (lambda msg: None) if args.quiet else (lambda msg: print(msg, file=sys.stderr))
+
+    try:
+        records = analyze(args.folder, config, jobs, threshold, near_threshold, args.recursive, log, args.where)
+    except ValueError as e:
+        print(f'絞り込み条件が正しくありません: {e}', file=sys.stderr)
+        return 2
+    fmt = output_format(args)
+    if args.output == '-':
+        write_report(records, sys.stdout, fmt, args.folder, threshold)
+    else:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            write_report(records, f, fmt, args.folder, threshold)
+    if args.mark_session:
+        n = mark_session(args.folder, records)
+        log(f'削除候補 {n}枚をセッションに追加')
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()  # exe化時にプロセスプールを使うため
+    sys.exit(main())
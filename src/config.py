@@ -0,0 +1,99 @@
+import os
+import sys
+import configparser
+
+from sharpness import DEFAULT_ANALYSIS_SIZE
+
+SETTINGS_PATH = os.path.join(os.path.dirname(sys.argv[0]), 'setting.ini')
+
+
+class AppConfig:
+    def __init__(self, path=SETTINGS_PATH):
+        self.config = configparser.ConfigParser()
+        self.path = path
+        self.load()
+
+    def load(self):
+        self.config.read(self.path, encoding='utf-8')
+        self.width = self.config.getint('window', 'width', fallback=1024)
+        self.height = self.config.getint('window', 'height', fallback=768)
+        self.key_copy = self.config.get('keys', 'copy', fallback='K')
+        self.key_next = self.config.get('keys', 'next', fallback='Right')
+        self.key_prev = self.config.get('keys', 'prev', fallback='Left')
+        self.key_delete = self.config.get('keys', 'delete', fallback='D')
+        self.key_next_blur = self.config.get('keys', 'next_blur', fallback='B')
+        self.key_next_sharp = self.config.get('keys', 'next_sharp', fallback='S')
+        self.key_sort_blur = self.config.get('keys', 'sort_blur', fallback='O')
+        self.key_undo = self.config.get('keys', 'undo', fallback='U')
+        self.key_loupe = self.config.get('keys', 'loupe', fallback='L')
+        self.key_keep_best = self.config.get('keys', 'keep_best', fallback='G')
+        self.key_compare = self.config.get('keys', 'compare', fallback='C')
+        self.key_hud = self.config.get('keys', 'hud', fallback='H')
+        self.key_grid = self.config.get('keys', 'grid', fallback='T')
+        self.key_route = self.config.get('keys', 'route', fallback='R')
+        self.zoom_range = self.config.getint('zoom', 'range', fallback=10)
+        self.zoom_scale = self.config.getint('zoom', 'scale', fallback=10)
+        self.blur_threshold = self.config.getfloat('blur', 'threshold', fallback=2000.0)
+        self.blur_metric = self.config.get('blur', 'metric', fallback='laplacian')
+        self.blur_analysis_size = self.config.getint('blur', 'analysis_size', fallback=DEFAULT_ANALYSIS_SIZE)
+        self.blur_tiles = self.config.getint('blur', 'tiles', fallback=1)
+        self.blur_scan = self.config.getboolean('blur', 'scan', fallback=True)
+        self.blur_jobs = self.config.getint('blur', 'jobs', fallback=0)
+        self.prefetch_ahead = self.config.getint('prefetch', 'ahead', fallback=3)
+        self.prefetch_behind = self.config.getint('prefetch', 'behind', fallback=1)
+        self.prefetch_cache_mb = self.config.getint('prefetch', 'cache_mb', fallback=512)
+        self.prefetch_workers = self.config.getint('prefetch', 'workers', fallback=2)
+        self.keep_strategy = self.config.get('keep', 'strategy', fallback='auto')
+        self.keep_sidecars = self.config.get('keep', 'sidecars', fallback='xmp')
+        # 解析はmain側で行う（書式の誤りを起動時にエラー表示するため）
+        self.destinations = self.config.items('destinations') if self.config.has_section('destinations') else []
+        self.routes = self.config.items('routes') if self.config.has_section('routes') else []
+        self.duplicates_scan = self.config.getboolean('duplicates', 'scan', fallback=True)
+        self.duplicates_mark = self.config.getboolean('duplicates', 'mark', fallback=True)
+        self.duplicates_workers = self.config.getint('duplicates', 'workers', fallback=4)
+        self.fileops_workers = self.config.getint('fileops', 'workers', fallback=2)
+        self.fileops_undo_seconds = self.config.getfloat('fileops', 'undo_seconds', fallback=3.0)
+        self.fileops_retries = self.config.getint('fileops', 'retries', fallback=2)
+        self.cache_enabled = self.config.getboolean('cache', 'enabled', fallback=True)
+        self.cache_dir = self.config.get('cache', 'dir', fallback='')
+        self.cache_content_hash = self.config.getboolean('cache', 'content_hash', fallback=False)
+        self.cache_max_mb = self.config.getint('cache', 'max_mb', fallback=1024)
+        self.index_recursive = self.config.getboolean('index', 'recursive', fallback=False)
+        self.index_order = self.config.get('index', 'order', fallback='name')
+        exts = self.config.get('index', 'extensions', fallback='')
+        self.index_extensions = ['.' + e.strip().lstrip('.').lower() for e in exts.split(',') if e.strip()]
+        self.index_rescan_seconds = self.config.getfloat('index', 'rescan_seconds', fallback=5.0)
+        self.index_filter = self.config.get('index', 'filter', fallback='')
+        self.render_filter = self.config.get('render', 'filter', fallback='lanczos')
+        self.render_fast_filter = self.config.get('render', 'fast_filter', fallback='bilinear')
+        self.render_settle_ms = self.config.getint('render', 'settle_ms', fallback=150)
+        self.render_cache = self.config.getint('render', 'cache', fallback=8)
+        self.render_resize_ms = self.config.getint('render', 'resize_ms', fallback=100)
+        self.loupe_size = self.config.getint('loupe', 'size', fallback=320)
+        zooms = self.config.get('loupe', 'zooms', fallback='1, 2, 4')
+        self.loupe_zooms = [int(z) for z in zooms.split(',') if z.strip()] or [1]
+        self.loupe_tile_size = self.config.getint('loupe', 'tile_size', fallback=256)
+        self.loupe_cache_mb = self.config.getint('loupe', 'cache_mb', fallback=256)
+        self.grid_cell = self.config.getint('grid', 'cell', fallback=160)
+        self.grid_cache_mb = self.config.getint('grid', 'cache_mb', fallback=64)
+        self.grid_workers = self.config.getint('grid', 'workers', fallback=2)
+        self.group_enabled = self.config.getboolean('group', 'enabled', fallback=True)
+        self.group_method = self.config.get('group', 'method', fallback='dhash')
+        self.group_threshold = self.config.getint('group', 'threshold', fallback=10)
+        self.group_window = self.config.getint('group', 'window', fallback=3)
+        self.metrics_enabled = self.config.getboolean('metrics', 'enabled', fallback=True)
+        self.metrics_trace = self.config.get('metrics', 'trace', fallback='')
+        self.last_open_dir = self.config.get('history', 'last_open_dir', fallback='')
+        self.last_save_dir = self.config.get('history', 'last_save_dir', fallback='')
+
+    def save_window_size(self, width, height):
+        self.config.set('window', 'width', str(width))
+        self.config.set('window', 'height', str(height))
+        with open(self.path, 'w', encoding='utf-8') as f:
+            self.config.write(f)
+
+    def save_history(self, open_dir, save_dir):
+        self.config.set('history', 'last_open_dir', open_dir)
+        self.config.set('history', 'last_save_dir', save_dir)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            self.config.write(f)
@@ -0,0 +1,308 @@
+import io
+import math
+import mmap
+import os
+import struct
+import threading
+from PIL import Image
+
+from prefetch import image_nbytes
+
+# RAWは埋め込みJPEGプレビューで表示する
+RAW_EXTS = ('.dng', '.cr2', '.cr3', '.nef', '.nrw', '.arw', '.orf', '.rw2', '.raf', '.pef', '.srw')
+
+
+# プレビューピラミッドの段数（デコードした解像度, 1/2, 1/4, 1/8）と最小の短辺
+PYRAMID_LEVELS = 4
+PYRAMID_MIN_SIDE = 64
+
+
+def build_pyramid(img, levels=PYRAMID_LEVELS):
+    # imgを1/2ずつ縮小した画像のリスト（先頭がimg）
+    pyramid = [img]
+    while len(pyramid) < levels and min(pyramid[-1].size) // 2 >= PYRAMID_MIN_SIDE:
+        pyramid.append(pyramid[-1].reduce(2))
+    return pyramid
+
+
+class DisplayImage:
+    # 表示・解析用に縮小デコードした画像と、拡大表示用の等倍切り出し
+    # 表示倍率に応じて使い分けるプレビューピラミッドもデコード時に作っておく
+    def __init__(self, image, original_size, zoom=None, blur_score=None, orientation=1):
+        self.image = image
+        self.original_size = original_size
+        self.zoom = zoom
+        self.blur_score = blur_score
+        self.orientation = orientation
+        self.pyramid = build_pyramid(image)
+
+    @property
+    def nbytes(self):
+        return sum(image_nbytes(level) for level in self.pyramid) + image_nbytes(self.zoom)
+
+    def fitted(self, size):
+        # 元画像をアスペクト比を保ってsizeの枠に収めた大きさ（元画像より大きくはしない）
+        ow, oh = self.original_size
+        scale = min(1.0, size[0] / ow, size[1] / oh)
+        return max(1, round(ow * scale)), max(1, round(oh * scale))
+
+    def covers(self, size):
+        # sizeの枠に収めて表示するのに足りる解像度を持っているか
+        w, h = self.fitted(size)
+        return self.image.width >= w and self.image.height >= h
+
+
+def is_raw(path):
+    return os.path.splitext(path)[1].lower() in RAW_EXTS
+
+
+def _tiff_ifds(data):
+    # TIFF形式（DNG・CR2・NEF・ARWなど）のIFDを順にたどり、タグ{tag: 値}の辞書を返す
+    # 値は先頭の1つだけ（SubIFDsは全オフセットのタプル）
+    if data[:2] == b'II':
+        endian = '<'
+    elif data[:2] == b'MM':
+        endian = '>'
+    else:
+        return
+    offsets = [struct.unpack(endian + 'I', data[4:8])[0]]
+    seen = set()
+    while offsets:
+        offset = offsets.pop()
+        if offset in seen or not 8 <= offset < len(data) - 2:
+            continue
+        seen.add(offset)
+        count = struct.unpack(endian + 'H', data[offset:offset + 2])[0]
+        tags = {}
+        for i in range(count):
+            pos = offset + 2 + i * 12
+            if pos + 12 > len(data):
+                break
+            tag, typ, n = struct.unpack(endian + 'HHI', data[pos:pos + 8])
+            if typ == 3:
+                fmt, size = 'H', 2
+            elif typ in (4, 13):
+                fmt, size = 'I', 4
+            else:
+                continue
+            where = pos + 8 if n * size <= 4 else struct.unpack(endian + 'I', data[pos + 8:pos + 12])[0]
+            values = struct.unpack(endian + fmt * min(n, 64), data[where:where + size * min(n, 64)]) \
+                if where + size * min(n, 64) <= len(data) else ()
+            if values:
+                tags[tag] = values if tag == 0x014A else values[0]
+        yield tags
+        offsets.extend(tags.get(0x014A, ()))
+        pos = offset + 2 + count * 12
+        if pos + 4 <= len(data):
+            offsets.append(struct.unpack(endian + 'I', data[pos:pos + 4])[0])
+
+
+def raw_preview(data):
+    # RAWファイルに埋め込まれた最大のJPEGプレビューを返す（見つからなければNone）
+    best = None
+    for tags in _tiff_ifds(data):
+        start, length = tags.get(0x0201), tags.get(0x0202)
+        if start and length and data[start:start + 2] == b'\xff\xd8':
+            if best is None or length > len(best):
+                best = data[start:start + length]
+    if best is not None:
+        return bytes(best)
+    # TIFF形式でない場合（CR3・RAFなど）はSOI〜EOIを走査して最大のJPEGを探す
+    start = data.find(b'\xff\xd8\xff')
+    while start >= 0:
+        end = data.find(b'\xff\xd9', start)
+        if end < 0:
+            break
+        if best is None or end + 2 - start > len(best):
+            best = data[start:end + 2]
+        start = data.find(b'\xff\xd8\xff', end)
+    return bytes(best) if best is not None else None
+
+
+def read_source(path):
+    # デコード対象のバイト列（RAWは埋め込みプレビュー）
+    with open(path, 'rb') as f:
+        data = f.read()
+    if is_raw(path):
+        data = raw_preview(data)
+        if data is None:
+            raise OSError(f'no embedded preview: {path}')
+    return data
+
+
+def map_source(path):
+    # ファイルをコピーオンライトでメモリマップする（必要なページだけを読み、ファイル全体のコピーは作らない）
+    # 書き換えはこのマップの該当ページにだけ反映され、ファイルは変わらない
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+_heif_lock = threading.Lock()
+_heif_registered = False
+
+
+def register_heif():
+    # pillow-heifは最初にHEIF画像を開くときに1回だけ読み込んで登録する（起動時には読み込まない）
+    global _heif_registered
+    if _heif_registered:
+        return
+    with _heif_lock:
+        if not _heif_registered:
+            import pillow_heif
+            pillow_heif.register_heif_opener()
+            _heif_registered = True
+
+
+def open_image(path):
+    # 画像ファイルを開く（この時点ではピクセルはデコードされない）
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.heic', '.heif'):
+        register_heif()
+    if ext in RAW_EXTS:
+        return Image.open(io.BytesIO(read_source(path)))
+    return Image.open(path)
+
+
+def read_orientation(path):
+    # EXIFの向き(1〜8)をヘッダーだけから読み取る（RAWは本体のIFD0の値）
+    from metadata import read_metadata
+    return read_metadata(path).orientation
+
+
+# Image.reduceがそのまま扱える形式（パレットなどはRGBにしてから縮める）
+REDUCE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'I', 'F')
+
+
+def _loaded(img):
+    # デコード済みの画像（convertと違い、RGBの画像の画素をコピーしない）
+    img.load()
+    return img
+
+
+def _draft(img, size, long_edge=None):
+    # load_scaledの縮小方法を決める。imgにdraftを適用し、残りの整数倍の間引き率を返す
+    if long_edge:
+        scale = min(1.0, long_edge / max(img.size))
+        need = (math.ceil(img.width * scale), math.ceil(img.height * scale))
+        size = (max(size[0], need[0]), max(size[1], need[1])) if size else need
+    if not size:
+        return 1
+    img.draft('RGB', size)
+    return min(img.width // max(size[0], 1), img.height // max(size[1], 1))
+
+
+def scaled_size(path, size, long_edge=None):
+    # load_scaled(path, size, long_edge)でデコードされる画像の大きさ（ヘッダーだけ読み、デコードはしない）
+    with open_image(path) as img:
+        factor = _draft(img, size, long_edge)
+        if factor < 2:
+            return img.size
+        return math.ceil(img.width / factor), math.ceil(img.height / factor)
+
+
+def analysis_image(path, img, long_edge):
+    # ぼやけ判定に使う画像を、フォルダ全体のスキャン（load_scaled(path, None, long_edge)）と同じ解像度にそろえる
+    # 表示用に大きくデコードした画像（DCTの縮小率がウィンドウの大きさで変わる）は整数倍の間引きで縮め、
+    # 縮められない大きさならデコードし直す（どちらで計算しても同じぼやけ値になるようにする）
+    target = scaled_size(path, None, long_edge)
+    if img.size == target:
+        return img
+    factor = img.width // target[0]
+    if factor >= 2 and (math.ceil(img.width / factor), math.ceil(img.height / factor)) == target:
+        return img.reduce(factor)
+    return load_scaled(path, None, long_edge)[0]
+
+
+def load_scaled(path, size, long_edge=None):
+    # sizeを下回らない範囲で最小の解像度でデコードする（long_edge指定時は長辺もその値以上にする）
+    # JPEGはDCTスケーリング(1/2〜1/8)、HEICは埋め込みサムネイルをdraftで選択させる
+    img = open_image(path)
+    original_size = img.size
+    factor = _draft(img, size, long_edge)
+    if factor >= 2 and img.mode in REDUCE_MODES:
+        # draftで縮小しきれなかった分（PNGなど）は元の形式のまま整数倍の間引きで縮めてからRGBにする
+        # （元解像度のRGBのコピーを作らないので、ピークのメモリはデコードした1枚分で済む）
+        img = img.reduce(factor)
+        factor = 1
+    img = img.convert('RGB') if img.mode != 'RGB' else _loaded(img)
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img, original_size
+
+
+# JPEGのMCU1行分の高さ（4:2:0で16px）。最終行は色差の補間で隣の行を参照するため余分に読む
+MCU_MARGIN = 16
+# 高さを書き換えられるSOFマーカー（DHT・JPG・DACは除く）
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _find_sof_height(data):
+    # SOFマーカーの高さフィールドの位置を返す（見つからなければNone）
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            return None
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker in SOF_MARKERS:
+            return i + 5
+        i += 2 + length
+    return None
+
+
+def _decode_top_rows(path, img, rows):
+    # 上端からrows行だけをデコードした画像を返す。対応できない形式はNone
+    if img.format == 'JPEG':
+        # SOFの画像高さを書き換えると、libjpegは指定行までで復号を打ち切る
+        # （RAW以外はファイルをメモリマップして書き換えるので、圧縮データのコピーを作らない）
+        data = bytearray(read_source(path)) if is_raw(path) else map_source(path)
+        pos = _find_sof_height(data)
+        if pos is None or struct.unpack('>H', data[pos:pos + 2])[0] == 0:
+            return None
+        data[pos:pos + 2] = struct.pack('>H', rows)
+        top = Image.open(data if isinstance(data, mmap.mmap) else io.BytesIO(data))
+        top.load()
+        return top
+    if img.format == 'PNG' and not img.info.get('interlace') and len(img.tile) == 1:
+        # 非インターレースPNGは行順に展開されるため、タイルを縮めれば途中で止まる
+        tile = img.tile[0]
+        img.tile = [tile._replace(extents=(0, 0, img.width, rows))]
+        img._size = (img.width, rows)
+        img.load()
+        return img
+    return None
+
+
+def load_regions(path, boxes):
+    # 元解像度のまま複数の範囲(left, upper, right, lower)を1回のデコードで切り出す
+    # JPEG・PNGは範囲の下端を含む行までしか復号しない
+    img = open_image(path)
+    bottom = max(box[3] for box in boxes)
+    rows = min(bottom + MCU_MARGIN, img.height)
+    src = None
+    if rows < img.height:
+        try:
+            src = _decode_top_rows(path, img, rows)
+        except Exception:
+            # 途中で失敗した場合は開き直して全体をデコードする
+            img = open_image(path)
+    if src is None:
+        src = img
+    try:
+        return [src.crop(box).convert('RGB') for box in boxes]
+    finally:
+        # メモリマップ・ファイルはすぐに閉じる（Windowsでは開いている間ファイルを移動・削除できない）
+        src.close()
+
+
+def load_region(path, box):
+    # 元解像度のまま指定範囲(left, upper, right, lower)を切り出す
+    return load_regions(path, [box])[0]
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ファイル全体を読むときのチャンクサイズ
+READ_CHUNK = 1024 * 1024
+# 2段目の判定で読む先頭と末尾のサイズ
+EDGE_BYTES = 64 * 1024
+
+
+def file_digest(path, chunk=READ_CHUNK):
+    # ファイル全体の内容ハッシュ（同じバッファに繰り返し読み込むのでメモリは増えない）
+    h = hashlib.blake2b(digest_size=16)
+    buf = bytearray(chunk)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def edge_digest(path, size, edge=EDGE_BYTES):
+    # 先頭と末尾edgeバイトのハッシュ（2 * edge以下のファイルは全体のハッシュになる）
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= 2 * edge:
+            h.update(f.read())
+        else:
+            h.update(f.read(edge))
+            f.seek(-edge, os.SEEK_END)
+            h.update(f.read(edge))
+    return h.hexdigest()
+
+
+def _split(groups, key, pool, stop=None):
+    # 各グループをkey(path)の値で分け直し、2つ以上残ったものを返す（読めないファイルは除く）
+    # stop（threading.Event）がセットされたら残りのファイルは読まない
+    def safe(path):
+        if stop is not None and stop.is_set():
+            return None
+        try:
+            return key(path)
+        except OSError:
+            return None
+
+    paths = [path for group in groups for path in group]
+    values = dict(zip(paths, pool.map(safe, paths)))
+    result = []
+    for group in groups:
+        split = {}
+        for path in group:
+            if values[path] is not None:
+                split.setdefault(values[path], []).append(path)
+        result += [same for same in split.values() if len(same) > 1]
+    return result
+
+
+def exact_duplicates(sizes, workers=4, edge=EDGE_BYTES, stop=None):
+    # 内容が完全に一致するファイルをまとめる。sizesは{path: サイズ}
+    # サイズ → 先頭と末尾のハッシュ → 全体のハッシュの順に絞り込み、最後まで候補に残ったファイルだけ全体を読む
+    # 読み込みはworkers個のスレッドで並列に行う。戻り値は[[path, ...], ...]（2つ以上のグループのみ、sizesの順）
+    by_size = {}
+    for path, size in sizes.items():
+        by_size.setdefault(size, []).append(path)
+    groups = [same for same in by_size.values() if len(same) > 1]
+    if not groups:
+        return []
+    with ThreadPoolExecutor(max(1, workers), thread_name_prefix='duplicates') as pool:
+        groups = _split(groups, lambda path: edge_digest(path, sizes[path], edge), pool, stop)
+        # 小さいファイルは先頭と末尾のハッシュが全体のハッシュなので読み直さない
+        small = [group for group in groups if sizes[group[0]] <= 2 * edge]
+        large = [group for group in groups if sizes[group[0]] > 2 * edge]
+        groups = small + _split(large, file_digest, pool, stop)
+    order = {path: i for i, path in enumerate(sizes)}
+    return sorted(groups, key=lambda group: order[group[0]])
+
+
+def same_content(a, b, edge=EDGE_BYTES):
+    # 2つのファイルの内容が同じか（サイズ → 先頭と末尾 → 全体の順に比べ、違いが分かった時点で止める）
+    try:
+        sa, sb = os.stat(a), os.stat(b)
+        if sa.st_size != sb.st_size:
+            return False
+        if os.path.samestat(sa, sb):
+            return True
+        if edge_digest(a, sa.st_size, edge) != edge_digest(b, sb.st_size, edge):
+            return False
+        return sa.st_size <= 2 * edge or file_digest(a) == file_digest(b)
+    except OSError:
+        return False
+
+
+def folder_sizes(folder):
+    # フォルダ以下（サブフォルダを含む）の全ファイルの{path: サイズ}
+    sizes = {}
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                sizes[path] = os.stat(path).st_size
+            except OSError:
+                continue
+    return sizes
+
+
+class DuplicateResult:
+    # duplicates: 写真フォルダ内で内容が同じ画像のグループ（相対パス。groups先頭以外が重複）
+    # saved: 保存先フォルダに同じ内容のファイルが既にある画像（相対パス）
+    def __init__(self, duplicates, saved):
+        self.duplicates = duplicates
+        self.saved = saved
+
+
+def is_inside(path, folders):
+    # pathがfoldersのどれかの中（同じフォルダを含む）にあるか
+    path = os.path.normcase(os.path.abspath(path))
+    for folder in folders:
+        folder = os.path.normcase(os.path.abspath(folder))
+        if path == folder or path.startswith(folder.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+def find_duplicates(folder, sizes, save_dirs=(), workers=4, stop=None):
+    # 写真フォルダの画像（sizesは{相対パス: サイズ}）と保存先のフォルダ（save_dirs）のファイルをまとめて完全一致で調べる
+    # 保存先のファイルはサイズが一致したものだけ内容を読む
+    # 写真フォルダの中に保存先がある場合も、保存先の中のファイルは保存済みのものとして扱い、重複には含めない
+    save_dirs = [d for d in save_dirs if d and os.path.isdir(d)]
+    # 別の保存先の中にある保存先は、外側を調べるときに一緒に読まれる
+    walk = []
+    for save_dir in sorted(save_dirs, key=lambda d: len(os.path.abspath(d))):
+        if not is_inside(save_dir, walk):
+            walk.append(save_dir)
+    names = {os.path.join(folder, name): name for name in sizes}
+    names = {path: name for path, name in names.items() if not is_inside(path, save_dirs)}
+    paths = {path: sizes[name] for path, name in names.items()}
+    wanted = set(paths.values())
+    for save_dir in walk:
+        for path, size in folder_sizes(save_dir).items():
+            if size in wanted:
+                paths.setdefault(path, size)
+    duplicates, saved = [], set()
+    for group in exact_duplicates(paths, workers, stop=stop):
+        source = [names[path] for path in group if path in names]
+        if len(source) < len(group):
+            saved.update(source)
+        if len(source) > 1:
+            duplicates.append(source)
+    return DuplicateResult(duplicates, saved)
+
+
+class DuplicateScan:
+    # find_duplicatesをバックグラウンドのスレッドで実行する（結果はpollで受け取る）
+    def __init__(self, folder, sizes, save_dirs=(), workers=4):
+        self._result = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(folder, sizes, save_dirs, workers),
+                                        name='duplicate-scan', daemon=True)
+        self._thread.start()
+
+    def _run(self, folder, sizes, save_dirs, workers):
+        try:
+            self._result.put(find_duplicates(folder, sizes, save_dirs, workers, self._stop))
+        except OSError:
+            self._result.put(DuplicateResult([], set()))
+
+    def poll(self):
+        # 終わっていれば結果（DuplicateResult）、まだならNone
+        try:
+            return self._result.get_nowait()
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        # 読み込み中のファイルが終わったら残りは読まずに終わる
+        self._stop.set()
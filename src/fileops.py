@@ -0,0 +1,371 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+
+from decode import RAW_EXTS
+from duplicates import same_content
+from metrics import Metrics
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+KEEP_STRATEGIES = ('auto', 'copy', 'hardlink', 'reflink', 'move', 'symlink')
+# 同じ保存先フォルダへの操作を1つのワーカーでまとめて実行する最大件数
+BATCH_SIZE = 64
+
+
+def same_device(src, dst):
+    # srcとdstの保存先フォルダが同じファイルシステム上にあるか
+    try:
+        return os.stat(src).st_dev == os.stat(os.path.dirname(os.path.abspath(dst))).st_dev
+    except OSError:
+        return False
+
+
+def reflink(src, dst):
+    # ファイルシステムのブロック共有によるコピー（Btrfs・XFS・APFSなど）。非対応ならOSError
+    if sys.platform.startswith('linux'):
+        import fcntl
+        FICLONE = 0x40049409
+        with open(src, 'rb') as fs, open(dst, 'wb') as fd:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+    elif sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), dst)
+    else:
+        raise OSError(errno.EOPNOTSUPP, 'reflink is not supported on this platform', dst)
+    shutil.copystat(src, dst)
+
+
+def _link_via_temp(func, src, dst):
+    # 一時ファイル名で作成してから置き換える（既存ファイルの上書きと作成途中のファイル防止）
+    tmp = f'{dst}.picsel-tmp'
+    try:
+        func(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def keep_methods(strategy, src, dst, same=None):
+    # 試す方法を優先順に返す。失敗したら次の方法にフォールバックする
+    # sameは同じファイルシステムかの判定済みの結果（Noneならここで調べる）
+    if strategy == 'auto':
+        if same is None:
+            same = same_device(src, dst)
+        return ['reflink', 'hardlink', 'copy'] if same else ['copy']
+    if strategy in ('hardlink', 'reflink', 'symlink'):
+        return [strategy, 'copy']
+    if strategy in ('copy', 'move'):
+        return [strategy]
+    raise ValueError(f'unknown keep strategy: {strategy}')
+
+
+def keep_file(src, dst, strategy='copy', same=None):
+    # srcをdstに保存し、実際に使った方法を返す
+    error = None
+    for method in keep_methods(strategy, src, dst, same):
+        try:
+            if method == 'copy':
+                shutil.copy2(src, dst)
+            elif method == 'move':
+                shutil.move(src, dst)
+            elif method == 'hardlink':
+                _link_via_temp(os.link, src, dst)
+            elif method == 'reflink':
+                _link_via_temp(reflink, src, dst)
+            elif method == 'symlink':
+                _link_via_temp(lambda s, d: os.symlink(os.path.abspath(s), d), src, dst)
+            return method
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            error = e
+    raise error
+
+
+class KeepContext:
+    # 同じ保存先へ続けて保存するときに、フォルダの作成と同じファイルシステムかの判定をフォルダごとに1回で済ませる
+    def __init__(self):
+        self.dirs = set()
+        self.devices = {}
+
+    def makedirs(self, path):
+        folder = os.path.dirname(os.path.abspath(path))
+        if folder not in self.dirs:
+            os.makedirs(folder, exist_ok=True)
+            self.dirs.add(folder)
+
+    def same_device(self, src, dst):
+        key = (os.path.dirname(os.path.abspath(src)), os.path.dirname(os.path.abspath(dst)))
+        if key not in self.devices:
+            self.devices[key] = same_device(src, dst)
+        return self.devices[key]
+
+
+def keep_group(files, strategy='copy', context=None):
+    # 画像と付随ファイル（[(src, dst), ...]。先頭が画像）を1組として保存し、画像に使った方法を返す
+    # 保存先に同じ内容のファイルが既にあれば書き込まない（方法は'exists'）
+    # 途中で失敗したら、この組で新しく作ったファイルを消し（移動は元に戻し）てから例外を送出する
+    # 付随ファイルが保存までに無くなっていた場合は飛ばす
+    context = context or KeepContext()
+    done = []
+    method = None
+    try:
+        for i, (src, dst) in enumerate(files):
+            if i > 0 and not os.path.lexists(src):
+                continue
+            existed = os.path.lexists(dst)
+            if existed and same_content(src, dst):
+                method = method or 'exists'
+                continue
+            context.makedirs(dst)
+            same = context.same_device(src, dst) if strategy == 'auto' else None
+            done.append((src, dst, keep_file(src, dst, strategy, same), existed))
+            method = method or done[-1][2]
+    except BaseException:
+        for src, dst, method, existed in reversed(done):
+            try:
+                if method == 'move':
+                    shutil.move(dst, src)
+                elif not existed:
+                    os.remove(dst)
+            except OSError:
+                pass
+        raise
+    return method
+
+
+def sidecar_extensions(spec):
+    # 設定の付随ファイルの指定（例：「xmp, raw」。rawはRAW形式の拡張子すべて）を拡張子のタプルにする
+    exts = []
+    for token in (spec or '').split(','):
+        token = token.strip().lower().lstrip('.')
+        if token == 'raw':
+            exts.extend(RAW_EXTS)
+        elif token:
+            exts.append('.' + token)
+    return tuple(dict.fromkeys(exts))
+
+
+class SidecarFinder:
+    # 画像と同じ名前で拡張子が違う付随ファイル（IMG_1.xmp・IMG_1.CR2・IMG_1.JPG.xmpなど）を探す
+    # フォルダの一覧はmax_age秒ごとに取り直す（Noneならclearするまで最初の一覧を使う）
+    def __init__(self, extensions, max_age=None):
+        self.extensions = tuple(e.lower() for e in extensions)
+        self.max_age = max_age
+        self._folders = {}
+
+    def _listing(self, folder):
+        now = time.monotonic()
+        listed, listing = self._folders.get(folder, (None, None))
+        if listing is None or (self.max_age is not None and now - listed > self.max_age):
+            listing = {}
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        stem, ext = os.path.splitext(entry.name)
+                        if ext.lower() in self.extensions:
+                            listing.setdefault(stem.lower(), []).append(entry.name)
+            except OSError:
+                pass
+            self._folders[folder] = (now, listing)
+        return listing
+
+    def find(self, path):
+        # pathの付随ファイルのパス（path自身は除く）
+        if not self.extensions:
+            return []
+        folder, name = os.path.split(path)
+        listing = self._listing(folder)
+        stem = os.path.splitext(name)[0].lower()
+        names = listing.get(stem, []) + listing.get(name.lower(), [])
+        return [os.path.join(folder, n) for n in sorted(set(names)) if n != name]
+
+    def clear(self):
+        self._folders.clear()
+
+
+class FileOperation:
+    # キューに積まれた1件のファイル操作（kind: 'keep' / 'delete'）
+    # keepはstrategyに従ってコピー・リンク・移動し、実際に使った方法をmethodに記録する
+    # sidecarsは画像と一緒に保存する付随ファイル[(src, dst), ...]（全部そろって保存されるか、何も残らない）
+    def __init__(self, kind, src, dst=None, due=0.0, strategy='copy', sidecars=()):
+        self.kind = kind
+        self.src = src
+        self.dst = dst
+        self.due = due
+        self.strategy = strategy
+        self.sidecars = list(sidecars)
+        # 同じgroup（保存先フォルダ）の操作は1つのワーカーがまとめて実行する
+        self.group = os.path.dirname(os.path.abspath(dst)) if dst else None
+        self.method = None
+        self.state = PENDING
+        self.attempts = 0
+        self.error = None
+
+    def run(self, context=None):
+        if self.kind == 'keep':
+            # サブフォルダの画像は保存先にも同じフォルダ構成で保存する
+            self.method = keep_group([(self.src, self.dst)] + self.sidecars, self.strategy, context)
+        elif self.kind == 'delete':
+            os.remove(self.src)
+        else:
+            raise ValueError(f'unknown file operation: {self.kind}')
+
+    def describe(self):
+        label = {'keep': '保存', 'delete': '削除'}.get(self.kind, self.kind)
+        return f'{label} {os.path.basename(self.src)}: {self.error}'
+
+
+class FileOperationQueue:
+    # コピー・削除をワーカースレッドで実行するキュー
+    # 積まれた操作はundo_seconds秒間は取り消し可能で、その後に実行される
+    # 失敗した操作はretries回まで再試行し、最終的な失敗はtake_errorsでまとめて取り出す
+    # 実行時刻を過ぎた同じ保存先フォルダへの操作は、1つのワーカーがbatch件までまとめて続けて実行する
+    # metricsを渡すと操作ごとの所要時間（fileop.<kind>）と待ちの件数を記録する
+    def __init__(self, workers=2, undo_seconds=3.0, retries=2, retry_delay=0.5, metrics=None, batch=BATCH_SIZE):
+        self.metrics = metrics or Metrics(enabled=False)
+        self.undo_seconds = undo_seconds
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.batch = max(1, batch)
+        self._pending = deque()
+        self._running = 0
+        self._errors = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = [threading.Thread(target=self._worker, name=f'fileops-{i}', daemon=True)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, kind, src, dst=None, delay=None, strategy='copy', sidecars=()):
+        # 操作を積む。delayを省略するとundo_seconds後に実行
+        delay = self.undo_seconds if delay is None else delay
+        op = FileOperation(kind, src, dst, time.monotonic() + delay, strategy, sidecars)
+        with self._cond:
+            self._pending.append(op)
+            self.metrics.gauge('fileops.pending', len(self._pending))
+            self._cond.notify_all()
+        return op
+
+    def cancel(self, op):
+        # まだ実行されていない操作を取り消す。取り消せたらTrue
+        with self._cond:
+            if op.state != PENDING:
+                return False
+            self._pending.remove(op)
+            op.state = CANCELLED
+            self._cond.notify_all()
+            return True
+
+    def flush(self):
+        # 取り消し待ちの操作をすぐに実行させる
+        with self._cond:
+            for op in self._pending:
+                op.due = 0.0
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        # 積まれた操作がすべて終わるまで待つ。時間切れならFalse
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def take_errors(self):
+        # 前回の呼び出し以降に失敗した操作を返す
+        with self._cond:
+            errors, self._errors = self._errors, []
+            return errors
+
+    @property
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    @property
+    def running(self):
+        with self._cond:
+            return self._running
+
+    def _next(self):
+        # 実行時刻を過ぎた操作を積んだ順に取り出す（同じ種類・保存先フォルダの操作もbatch件までまとめて）
+        with self._cond:
+            while not self._stopped:
+                now = time.monotonic()
+                op = next((op for op in self._pending if op.due <= now), None)
+                if op is not None:
+                    batch = [op]
+                    for other in self._pending:
+                        if len(batch) >= self.batch:
+                            break
+                        if other is not op and other.due <= now and (other.kind, other.group) == (op.kind, op.group):
+                            batch.append(other)
+                    for o in batch:
+                        self._pending.remove(o)
+                        o.state = RUNNING
+                    self.metrics.gauge('fileops.pending', len(self._pending))
+                    self._running += len(batch)
+                    return batch
+                if self._pending:
+                    self._cond.wait(min(op.due for op in self._pending) - now)
+                else:
+                    self._cond.wait()
+            return None
+
+    def _worker(self):
+        while True:
+            batch = self._next()
+            if batch is None:
+                return
+            # まとめて取り出した操作はフォルダの作成・ファイルシステムの判定を共有する
+            context = KeepContext()
+            for op in batch:
+                self._run(op, context)
+                with self._cond:
+                    self._running -= 1
+                    if op.state == FAILED:
+                        self._errors.append(op)
+                    self._cond.notify_all()
+
+    def _run(self, op, context):
+        while True:
+            op.attempts += 1
+            try:
+                with self.metrics.span(f'fileop.{op.kind}'):
+                    op.run(context)
+                op.state = DONE
+                op.error = None
+                return
+            except FileNotFoundError as e:
+                op.state, op.error = FAILED, e
+                return
+            except Exception as e:
+                op.error = e
+                if op.attempts > self.retries:
+                    op.state = FAILED
+                    return
+                time.sleep(self.retry_delay * op.attempts)
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
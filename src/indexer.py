@@ -0,0 +1,211 @@
+import os
+import queue
+import threading
+from collections import namedtuple
+
+from decode import RAW_EXTS
+from metadata import matches, parse_filter, read_metadata
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.heic', '.heif', '.webp', '.tif', '.tiff')
+ORDERS = ('name', 'mtime', 'capture', 'shutter', 'iso', 'camera')
+# EXIFの読み取りが必要な並び順
+METADATA_ORDERS = ('capture', 'shutter', 'iso', 'camera')
+
+IndexChanges = namedtuple('IndexChanges', 'added changed removed reordered')
+
+
+class FileEntry:
+    # インデックス内の1ファイル（nameはフォルダからの相対パス）
+    # metaはヘッダーから読み取ったImageMetadata（未取得ならNone）
+    __slots__ = ('name', 'size', 'mtime_ns', 'meta')
+
+    def __init__(self, name, size, mtime_ns, meta=None):
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.meta = meta
+
+    @property
+    def capture_time(self):
+        # 撮影日時（EXIFに無ければ更新日時で代用。未取得ならNone）
+        if self.meta is None:
+            return None
+        return self.meta.capture_time or self.mtime_ns / 1e9
+
+
+class FolderIndex:
+    # os.scandirでフォルダ内の画像を列挙し、stat結果を保持するインデックス
+    # scanを繰り返し呼ぶと、前回との差分（追加・変更・削除）を返す
+    # whereは撮影情報の絞り込み条件（例：shutter > 1/60）。書式が正しくなければValueError
+    # excludeのフォルダ（保存先など）はサブフォルダとして含まれていても走査しない
+    def __init__(self, root, recursive=False, extensions=(), order='name', where='', exclude=()):
+        self.root = root
+        self.recursive = recursive
+        self.exclude = exclude
+        self.extensions = tuple(e.lower() for e in IMAGE_EXTS + RAW_EXTS + tuple(extensions))
+        self.order = order if order in ORDERS else 'name'
+        self.conditions = parse_filter(where)
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def exclude(self):
+        return self._exclude
+
+    @exclude.setter
+    def exclude(self, folders):
+        self._exclude = {os.path.normcase(os.path.abspath(f)) for f in folders if f}
+
+    def _walk(self):
+        # 画像ファイルを(相対パス, DirEntry)で列挙する（隠しフォルダ・除外するフォルダは除く）
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            try:
+                it = os.scandir(os.path.join(self.root, rel) if rel else self.root)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    name = os.path.join(rel, entry.name) if rel else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive and not entry.name.startswith('.') and \
+                                    os.path.normcase(os.path.abspath(entry.path)) not in self._exclude:
+                                stack.append(name)
+                        elif entry.name.lower().endswith(self.extensions):
+                            yield name, entry
+                    except OSError:
+                        continue
+
+    def scan(self):
+        # フォルダを走査してインデックスを更新し、差分をIndexChangesで返す
+        old = self.entries
+        new = {}
+        added, changed = [], []
+        for name, entry in self._walk():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            prev = old.get(name)
+            if prev is None:
+                added.append(name)
+                new[name] = FileEntry(name, st.st_size, st.st_mtime_ns)
+            elif (prev.size, prev.mtime_ns) != (st.st_size, st.st_mtime_ns):
+                changed.append(name)
+                new[name] = FileEntry(name, st.st_size, st.st_mtime_ns)
+            else:
+                new[name] = prev
+        removed = [name for name in old if name not in new]
+        with self._lock:
+            self.entries = new
+        return IndexChanges(added, changed, removed, bool(added or changed or removed))
+
+    @property
+    def needs_metadata(self):
+        # 並び順・絞り込みにEXIFの撮影情報を使うか
+        return self.order in METADATA_ORDERS or bool(self.conditions)
+
+    def load_metadata(self, limit=None):
+        # 撮影情報が未取得のファイルについてヘッダーから読み取る。読み取った件数を返す
+        count = 0
+        for entry in list(self.entries.values()):
+            if entry.meta is not None:
+                continue
+            if limit is not None and count >= limit:
+                break
+            entry.meta = read_metadata(os.path.join(self.root, entry.name))
+            count += 1
+        return count
+
+    def metadata(self, name):
+        # 1ファイルの撮影情報（未取得ならその場で読み取る。一覧に無ければNone）
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        if entry.meta is None:
+            entry.meta = read_metadata(os.path.join(self.root, name))
+        return entry.meta
+
+    def names(self):
+        # 表示順に並べた相対パスのリスト
+        # 絞り込み条件があれば、撮影情報を読み取り済みで条件を満たすものだけ
+        with self._lock:
+            entries = list(self.entries.values())
+        if self.conditions:
+            entries = [e for e in entries if e.meta is not None and matches(e.meta, self.conditions)]
+        if self.order == 'mtime':
+            entries.sort(key=lambda e: (e.mtime_ns, e.name))
+        elif self.order == 'capture':
+            # 撮影日時が未取得のものは末尾
+            entries.sort(key=lambda e: (e.capture_time is None, e.capture_time or 0, e.name))
+        elif self.order == 'shutter':
+            # シャッター速度の遅い順（手ぶれしやすいものが先頭。値が無いものは末尾）
+            entries.sort(key=lambda e: (not (e.meta and e.meta.exposure_time), -(e.meta and e.meta.exposure_time or 0),
+                                        e.name))
+        elif self.order == 'iso':
+            # ISO感度の高い順
+            entries.sort(key=lambda e: (not (e.meta and e.meta.iso), -(e.meta and e.meta.iso or 0), e.name))
+        elif self.order == 'camera':
+            # カメラごと（機種名順）に撮影日時順
+            entries.sort(key=lambda e: (not (e.meta and e.meta.camera), e.meta and e.meta.camera or '',
+                                        e.capture_time or 0, e.name))
+        else:
+            entries.sort(key=lambda e: e.name)
+        return [e.name for e in entries]
+
+
+class IndexWatcher:
+    # 一定間隔でフォルダを再走査し、変更があればキューで通知するスレッド
+    # 撮影情報で並べる・絞り込むときは、EXIFの読み取りも少しずつバックグラウンドで行う
+    # initial=Trueなら最初の走査（絞り込み条件があれば撮影情報の読み取りも）をこのスレッドで行い、終わるとreadyをセットする
+    def __init__(self, index, interval=5.0, batch=200, initial=False):
+        self.index = index
+        self.interval = interval
+        self.batch = batch
+        self.initial = initial
+        self.ready = threading.Event()
+        if not initial:
+            self.ready.set()
+        self._changes = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='index-watcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        if self.initial:
+            self.index.scan()
+            # 途中でフォルダを切り替えられたら読み取りをやめる
+            while self.index.conditions and not self._stop.is_set() and self.index.load_metadata(self.batch):
+                pass
+            self.ready.set()
+        while not self._stop.is_set():
+            if self.index.needs_metadata and self.index.load_metadata(self.batch):
+                self._changes.put(IndexChanges([], [], [], True))
+                continue
+            # interval<=0なら再走査はしない
+            if self.interval <= 0 or self._stop.wait(self.interval):
+                return
+            changes = self.index.scan()
+            if changes.reordered:
+                self._changes.put(changes)
+
+    def poll(self):
+        # 前回の呼び出し以降の変更をまとめて返す（変更が無ければNone）
+        added, changed, removed, reordered = [], [], [], False
+        while True:
+            try:
+                c = self._changes.get_nowait()
+            except queue.Empty:
+                break
+            added += c.added
+            changed += c.changed
+            removed += c.removed
+            reordered = reordered or c.reordered
+        if not reordered:
+            return None
+        return IndexChanges(added, changed, removed, reordered)
+
+    def stop(self):
+        self._stop.set()
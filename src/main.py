@@ -3,45 +3,31 @@ import sys
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from PIL import Image, ImageTk
-import numpy as np
-import cv2
-import pillow_heif
 import json
-import configparser
-
-SETTINGS_PATH = os.path.join(os.path.dirname(sys.argv[0]), 'setting.ini')
-
-class AppConfig:
-    def __init__(self, path=SETTINGS_PATH):
-        self.config = configparser.ConfigParser()
-        self.path = path
-        self.load()
-
-    def load(self):
-        self.config.read(self.path, encoding='utf-8')
-        self.width = self.config.getint('window', 'width', fallback=1024)
-        self.height = self.config.getint('window', 'height', fallback=768)
-        self.key_copy = self.config.get('keys', 'copy', fallback='K')
-        self.key_next = self.config.get('keys', 'next', fallback='Right')
-        self.key_prev = self.config.get('keys', 'prev', fallback='Left')
-        self.key_delete = self.config.get('keys', 'delete', fallback='D')
-        self.zoom_range = self.config.getint('zoom', 'range', fallback=10)
-        self.zoom_scale = self.config.getint('zoom', 'scale', fallback=10)
-        self.blur_threshold = self.config.getfloat('blur', 'threshold', fallback=100.0)
-        self.last_open_dir = self.config.get('history', 'last_open_dir', fallback='')
-        self.last_save_dir = self.config.get('history', 'last_save_dir', fallback='')
-
-    def save_window_size(self, width, height):
-        self.config.set('window', 'width', str(width))
-        self.config.set('window', 'height', str(height))
-        with open(self.path, 'w', encoding='utf-8') as f:
-            self.config.write(f)
-
-    def save_history(self, open_dir, save_dir):
-        self.config.set('history', 'last_open_dir', open_dir)
-        self.config.set('history', 'last_save_dir', save_dir)
-        with open(self.path, 'w', encoding='utf-8') as f:
-            self.config.write(f)
+import sqlite3
+import multiprocessing
+from prefetch import PrefetchEngine
+from decode import DisplayImage, open_image, load_scaled, load_region, read_orientation, analysis_image
+from metadata import apply_orientation, oriented_size, read_thumbnail, source_box
+from analysis_cache import AnalysisCache, default_cache_dir, encode_image, decode_image
+from blur_scan import PoolScanner
+from sharpness import SharpnessEngine
+from fileops import FileOperationQueue, SidecarFinder, sidecar_extensions, DONE
+from duplicates import DuplicateScan, is_inside
+from indexer import FolderIndex, IndexWatcher
+from session import SessionStore, KEEP, DELETE, UNRATED, file_stamp
+from render import Renderer, fit_size, pick_level, CELL_BACKGROUND, KEEP_COLOR, DELETE_COLOR
+from tiles import TileCache
+from similarity import hash_files, group_bursts
+from config import AppConfig
+from metrics import Metrics, timed
+from navigation import Navigator
+from thumbnails import GridLayout, load_thumbnail
+from routing import ImageFacts, destination_folders, parse_destinations, parse_routes, route_images
+
+# 比較表示で並べる最大枚数
+COMPARE_MAX = 4
+
 
 class PhotoSelectorApp(tk.Tk):
     def __init__(self, config: AppConfig):
@@ -57,17 +43,172 @@ class PhotoSelectorApp(tk.Tk):
         self.image_frame.pack_propagate(False)
         self.create_buttons()
         self.bind_keys()
+        self.image_frame.bind('<Configure>', self.on_frame_resize)
+        self.image_panel.bind('<Motion>', self.on_loupe_move)
+        self.image_panel.bind('<Button-1>', self.on_loupe_move)
+        self.image_panel.bind('<MouseWheel>', self.on_loupe_wheel)
+        self.image_panel.bind('<Button-4>', self.on_loupe_wheel)
+        self.image_panel.bind('<Button-5>', self.on_loupe_wheel)
+        self.create_compare_panels()
+        self.create_grid_view()
+        self.hud_label = tk.Label(self.image_frame, justify=tk.LEFT, anchor='nw', font=('Courier', 9),
+                                  bg='black', fg='white')
+        self.hud_on = False
+        self.hud_id = None
+        self.metrics = Metrics(self.config.metrics_enabled)
         self.image_list = []
         self.current_index = 0
-        self.delete_list = []
+        self.session = SessionStore()
+        self.renderer = Renderer(self.config.zoom_range, self.config.zoom_scale, self.config.render_filter,
+                                 self.config.render_fast_filter, self.config.render_cache)
+        self.current_frame = None
+        self.tk_img = None
+        self.navigator = Navigator(self.config.render_settle_ms / 1000)
+        self.nav_id = None
+        self.refine_id = None
+        self.frame_dims = None
+        self.resize_id = None
+        self.tile_cache = TileCache(self.config.loupe_cache_mb * 1024 * 1024, self.config.loupe_tile_size)
+        self.loupe_on = False
+        self.loupe_point = (0.5, 0.5)
+        self.loupe_zoom_index = 0
+        self.loupe_id = None
+        self.load_id = None
+        self.compare_on = False
+        self.compare_names = []
+        self.compare_frames = []
+        # 比較表示の枠ごとのPhotoImage（{枠の番号: PhotoImage}。同じ大きさなら次の描画で使い回す）
+        self.compare_imgs = {}
+        # 比較表示で読み込みを待っている画像（読み込みに失敗した場合に依頼を繰り返さないため）
+        self.compare_waiting = set()
+        self.compare_id = None
         self.open_dir = ''
         self.save_dir = ''
-        self.prefetch_cache = {}
+        self.decode_size = (self.config.width, self.config.height - 60)
+        self.analysis_cache = self.open_analysis_cache()
+        self.prefetcher = PrefetchEngine(self.load_display_image, self.config.prefetch_cache_mb * 1024 * 1024,
+                                         workers=self.config.prefetch_workers, metrics=self.metrics)
+        self.prefetch_cache = self.prefetcher.cache
+        # 一覧表示のサムネイル（見えているセルの分だけをワーカースレッドで読み込む）
+        self.thumbnails = PrefetchEngine(self.load_grid_thumbnail, self.config.grid_cache_mb * 1024 * 1024,
+                                         workers=self.config.grid_workers)
+        self.grid_on = False
+        self.grid_offset = 0
+        self.grid_cells = {}
+        self.grid_draw_id = None
+        self.grid_poll_id = None
+        self.blur_scores = {}
+        self.sort_by_blur = False
+        self.sharpness = SharpnessEngine(self.config.blur_metric, self.config.blur_analysis_size,
+                                         self.config.blur_tiles)
+        self.blur_scanner = PoolScanner(self.sharpness, self.config.blur_jobs)
+        self.blur_poll_id = None
+        self.hashes = {}
+        self.group_of = {}
+        self.hash_scanner = PoolScanner(self.config.group_method, self.config.blur_jobs, task=hash_files)
+        self.hash_poll_id = None
+        # フォルダを開いたときのキャッシュ済みのぼやけ値・ハッシュの読み込み（別スレッド）
+        self.cached_lookup = None
+        self.cached_poll_id = None
+        self.file_queue = FileOperationQueue(self.config.fileops_workers, self.config.fileops_undo_seconds,
+                                             self.config.fileops_retries, metrics=self.metrics)
+        # 付随ファイルを探すフォルダの一覧はフォルダの再走査と同じ間隔で取り直す
+        self.sidecar_finder = SidecarFinder(sidecar_extensions(self.config.keep_sidecars),
+                                            self.config.index_rescan_seconds or None)
+        self.duplicate_scan = None
+        self.duplicate_poll_id = None
+        self.saved_names = set()
+        self.undo_stack = []
+        self.fileop_errors = []
+        self.fileop_poll_id = None
+        self.folder_index = None
+        self.index_watcher = None
+        self.index_poll_id = None
+        # 最初の走査が終わって一覧ができたか（走査中は「フォルダを読み込み中」を表示する）
+        self.index_ready = False
         self.json_delete_path = ''
+        # ウィンドウを先に表示し、フォルダの読み込みと最初の画像のデコードはその後で行う
+        self.after(0, self.open_first_folder)
+
+    def open_first_folder(self):
+        self.update_idletasks()
         self.load_dirs()
         self.load_images()
+
+    def show_when_loaded(self, path=None):
+        # 表示中の画像をバックグラウンドで読み込み、終わるまでは低解像度のプレビューか「読み込み中」を表示する
+        # pathは前回読み込みを依頼した画像（読み込みに失敗した場合に依頼を繰り返さないため）
+        self.load_id = None
+        if self.image_list:
+            fname = self.image_list[self.current_index]
+            current = os.path.join(self.open_dir, fname)
+            if self.prefetcher.loading(current) or (current != path and current not in self.prefetcher.cache):
+                if current != path:
+                    self.prefetch_next()
+                    self.show_preview(current, fname)
+                self.load_id = self.after(20, lambda: self.show_when_loaded(current))
+                return
         self.show_image()
 
+    def navigate(self, index):
+        # キー送りの移動。表示はアイドル時に1回だけ行い、キーリピートで溜まった移動はまとめて最後の移動先だけ表示する
+        self.current_index = index
+        if self.grid_on:
+            # 一覧表示では選択を移動し、選択したセルが見える位置までスクロールする
+            self.grid_offset = self.grid_layout().scroll_to(index, self.grid_offset)
+            self.session.set_position(self.image_list[index])
+            self.update_title(self.image_list[index])
+            self.schedule_grid_draw()
+            return
+        if self.navigator.move(index):
+            self.nav_id = self.after_idle(self.show_target)
+
+    def show_target(self):
+        # 先読み済みならすぐ描画し（スクロール中は軽いフィルタ）、まだなら待たずにプレビューを出して読み込みを待つ
+        self.nav_id = None
+        self.navigator.take()
+        if self.load_id is not None:
+            self.after_cancel(self.load_id)
+            self.load_id = None
+        if not self.image_list:
+            self.show_image()
+            return
+        current = os.path.join(self.open_dir, self.image_list[self.current_index])
+        frame = self.prefetcher.cache.get(current)
+        if frame is not None and frame.covers(self.frame_size()):
+            self.show_image()
+        else:
+            self.show_when_loaded()
+
+    @timed('preview')
+    def show_preview(self, path, fname):
+        # デコードを待つ間の低解像度プレビュー（EXIFの埋め込みサムネイル、無ければ永続キャッシュのプレビュー）
+        self.session.set_position(fname)
+        self.update_title(fname)
+        if self.compare_on:
+            # 比較表示は表示中の写真が読み込めてから描画する（他の写真はそれぞれ読み込みを待つ）
+            return
+        img = self.preview_image(path, fname)
+        if img is None:
+            self.image_panel.config(image='', text='読み込み中…')
+            return
+        self.current_frame = None
+        self.tk_img = self.photo_image(self.renderer.resize(img.convert('RGB'), self.frame_size(), fast=True),
+                                       self.tk_img)
+        self.image_panel.config(image=self.tk_img, text='')
+
+    def preview_image(self, path, fname):
+        # EXIFの埋め込みサムネイル、無ければ永続キャッシュのプレビュー（どちらも無ければNone）
+        img = None
+        meta = self.folder_index.metadata(fname) if self.folder_index is not None else None
+        if meta is not None:
+            img = read_thumbnail(path, meta)
+        if img is None and self.analysis_cache is not None:
+            entry = self.analysis_cache.lookup(path)
+            if entry and entry['preview']:
+                img = decode_image(entry['preview'])
+        return img
+
     def create_buttons(self):
         self.button_frame = tk.Frame(self, height=60)
         self.button_frame.pack(side=tk.BOTTOM, fill=tk.X)
@@ -80,12 +221,73 @@ class PhotoSelectorApp(tk.Tk):
         self.btn_exit.pack(side=tk.RIGHT, padx=5, pady=5)
         self.btn_exit2 = tk.Button(self.button_frame, text='削除せず終了', command=self.exit_without_delete)
         self.btn_exit2.pack(side=tk.RIGHT, padx=5, pady=5)
+        self.status_label = tk.Label(self.button_frame, text='')
+        self.status_label.pack(side=tk.LEFT, padx=5, pady=5)
+        self.fileop_label = tk.Label(self.button_frame, text='')
+        self.fileop_label.pack(side=tk.LEFT, padx=5, pady=5)
+
+    def create_compare_panels(self):
+        # 比較表示用の最大4枚分の表示領域（2列のグリッド）
+        self.compare_frame = tk.Frame(self.image_frame)
+        self.compare_panels = []
+        for i in range(COMPARE_MAX):
+            panel = tk.Label(self.compare_frame)
+            panel.bind('<Motion>', lambda event, i=i: self.on_loupe_move(event, i))
+            panel.bind('<Button-1>', lambda event, i=i: self.select_pane(event, i))
+            panel.bind('<MouseWheel>', self.on_loupe_wheel)
+            panel.bind('<Button-4>', self.on_loupe_wheel)
+            panel.bind('<Button-5>', self.on_loupe_wheel)
+            self.compare_panels.append(panel)
+        self.compare_frame.columnconfigure(0, weight=1, uniform='pane')
+
+    def create_grid_view(self):
+        # 一覧表示用のキャンバスとスクロールバー（キャンバスには見えているセルだけを置く）
+        self.grid_frame = tk.Frame(self.image_frame)
+        self.grid_canvas = tk.Canvas(self.grid_frame, bg='black', highlightthickness=0)
+        self.grid_scrollbar = tk.Scrollbar(self.grid_frame, orient=tk.VERTICAL, command=self.on_grid_scroll)
+        self.grid_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.grid_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.grid_canvas.bind('<Configure>', lambda event: self.schedule_grid_draw())
+        self.grid_canvas.bind('<Button-1>', self.on_grid_click)
+        self.grid_canvas.bind('<Double-Button-1>', self.on_grid_open)
+        self.grid_canvas.bind('<MouseWheel>', self.on_grid_wheel)
+        self.grid_canvas.bind('<Button-4>', self.on_grid_wheel)
+        self.grid_canvas.bind('<Button-5>', self.on_grid_wheel)
 
     def bind_keys(self):
         self.bind(f'<{self.config.key_copy}>', self.copy_and_next)
         self.bind(f'<{self.config.key_next}>', self.next_image)
         self.bind(f'<{self.config.key_prev}>', self.prev_image)
         self.bind(f'<{self.config.key_delete}>', self.mark_delete)
+        self.bind(f'<{self.config.key_next_blur}>', self.next_blur_image)
+        self.bind(f'<{self.config.key_next_sharp}>', self.next_sharp_image)
+        self.bind(f'<{self.config.key_sort_blur}>', self.toggle_sort_blur)
+        self.bind(f'<{self.config.key_undo}>', self.undo_last)
+        self.bind(f'<{self.config.key_loupe}>', self.toggle_loupe)
+        self.bind(f'<{self.config.key_keep_best}>', self.keep_best)
+        self.bind(f'<{self.config.key_compare}>', self.toggle_compare)
+        self.bind(f'<{self.config.key_hud}>', self.toggle_hud)
+        self.bind(f'<{self.config.key_grid}>', self.toggle_grid)
+        self.bind(f'<{self.config.key_route}>', self.route_kept)
+        self.load_destinations()
+        for destination in self.destinations.values():
+            self.bind(f'<{destination.key}>', lambda event, d=destination: self.copy_and_next(event, d))
+        for key in ('Up', 'Down', 'Prior', 'Next', 'Home', 'End', 'Return'):
+            self.bind(f'<{key}>', self.on_grid_key)
+        for n in range(6):
+            self.bind(f'<Key-{n}>', lambda event, n=n: self.rate_image(n))
+
+    def load_destinations(self):
+        # [destinations]・[routes]を解析する（正しくなければウィンドウを表示してからエラーを表示し、使わない）
+        self.destinations, self.routes = {}, []
+        try:
+            self.destinations = parse_destinations(self.config.destinations)
+            self.routes = parse_routes(self.config.routes, self.destinations)
+        except ValueError as e:
+            self.destinations, self.routes = {}, []
+            # eはexceptを抜けると消えるので、メッセージはここで作っておく
+            msg = f'setting.iniの[destinations]・[routes]が正しくありません: {e}'
+            self.after(0, lambda: messagebox.showerror('保存先の設定エラー', msg))
 
     def load_dirs(self):
         self.open_dir = self.config.last_open_dir or filedialog.askdirectory(title='写真フォルダを選択')
@@ -98,172 +300,1157 @@ class PhotoSelectorApp(tk.Tk):
         if d:
             self.open_dir = d
             self.config.save_history(self.open_dir, self.save_dir)
-            self.load_images()
             self.current_index = 0
-            self.show_image()
+            self.load_images()
 
     def select_save_dir(self):
         d = filedialog.askdirectory(initialdir=self.save_dir, title='保存先フォルダを選択')
         if d:
             self.save_dir = d
             self.config.save_history(self.open_dir, self.save_dir)
+            if self.folder_index is not None:
+                # 次の再走査から新しい保存先を一覧に含めない
+                self.folder_index.exclude = self.excluded_folders()
+
+    def excluded_folders(self):
+        # 写真フォルダの中にあっても一覧・解析の対象にしない保存先のフォルダ
+        return destination_folders(self.save_dir, self.destinations)
 
     def load_images(self):
-        exts = ('.jpg', '.jpeg', '.png', '.heic')
-        self.image_list = [f for f in os.listdir(self.open_dir) if f.lower().endswith(exts)]
-        self.image_list.sort()
-        self.prefetch_cache = {}
+        # 監視スレッドでフォルダを走査して一覧を作る（Tkのスレッドは待たない）。以降の追加・変更・削除も監視スレッドが検出する
+        self.stop_index_watcher()
+        if self.load_id is not None:
+            self.after_cancel(self.load_id)
+            self.load_id = None
+        try:
+            self.folder_index = FolderIndex(self.open_dir, self.config.index_recursive, self.config.index_extensions,
+                                            self.config.index_order, self.config.index_filter, self.excluded_folders())
+        except ValueError as e:
+            messagebox.showerror('絞り込み条件エラー', f'setting.iniの[index] filterが正しくありません: {e}')
+            self.folder_index = FolderIndex(self.open_dir, self.config.index_recursive,
+                                            self.config.index_extensions, self.config.index_order,
+                                            exclude=self.excluded_folders())
+        self.index_ready = False
+        # 走査中に前のフォルダの判定を新しいフォルダのファイルに使わないよう、セッションは先に閉じる
+        self.session.close()
+        self.session = SessionStore()
+        # 取り消しの履歴は前のフォルダの判定を指すので持ち越さない（実行前の保存はそのまま行う）
+        self.undo_stack = []
+        self.stop_analysis()
+        self.stop_duplicate_scan()
+        self.saved_names = set()
+        self.blur_scores = {}
+        self.hashes = {}
+        self.image_list = []
+        self.group_of = {}
+        self.prefetcher.clear()
+        self.renderer.clear()
+        self.tile_cache.clear()
+        self.thumbnails.clear()
+        self.sidecar_finder.clear()
+        self.grid_cells = {}
+        self.grid_offset = 0
+        self.show_image()
+        # 絞り込み条件があれば、最初の一覧を作る前に撮影情報も読む（画素はデコードしない）
+        self.index_watcher = IndexWatcher(self.folder_index, self.config.index_rescan_seconds, initial=True)
+        self.index_poll_id = self.after(20, self.poll_first_scan)
+
+    def poll_first_scan(self):
+        # 最初の走査が終わったら一覧を作り、セッションを開いて解析と表示を始める
+        self.index_poll_id = None
+        if not self.index_watcher.ready.is_set():
+            self.index_poll_id = self.after(20, self.poll_first_scan)
+            return
+        self.index_ready = True
+        self.image_list = self.ordered_names()
+        self.open_session()
+        self.start_analysis()
+        self.start_duplicate_scan()
+        self.index_poll_id = self.after(500, self.poll_index)
+        self.show_when_loaded()
+
+    def open_session(self):
+        # フォルダごとのセッション（判定・評価・表示位置）を開き、前回の表示位置から再開する
+        self.session.close()
+        try:
+            self.session = SessionStore.for_folder(self.open_dir)
+        except OSError as e:
+            print(f'セッションを保存できません: {e}')
+            self.session = SessionStore()
+        if self.session.position in self.image_list:
+            self.current_index = self.image_list.index(self.session.position)
+
+    @property
+    def delete_list(self):
+        # 削除マークされた画像（マークした順）
+        return self.session.names_with(DELETE)
+
+    @delete_list.setter
+    def delete_list(self, names):
+        for fname in self.delete_list:
+            self.set_decision(fname, UNRATED)
+        for fname in names:
+            self.set_decision(fname, DELETE)
+
+    def set_decision(self, fname, decision):
+        # 削除マークにはその時点のファイルのサイズと更新日時を残す（delete_filesで同じファイルか確かめる）
+        stamp = file_stamp(os.path.join(self.open_dir, fname)) if decision == DELETE else None
+        self.session.set_decision(fname, decision, stamp)
+
+    def update_title(self, fname):
+        # タイトルに表示中の画像の判定・評価を表示する
+        decision = {KEEP: ' [保存]', DELETE: ' [削除]'}.get(self.session.decision(fname), '')
+        stars = ' ' + '★' * self.session.rating(fname) if self.session.rating(fname) else ''
+        group = self.group_of.get(fname)
+        burst = f' [連写 {group.index(fname) + 1}/{len(group)}]' if group and len(group) > 1 else ''
+        saved = ' [保存先にあり]' if fname in self.saved_names else ''
+        meta = self.folder_index.metadata(fname) if self.folder_index is not None else None
+        shot = f' ({meta.summary()})' if meta is not None and meta.summary() else ''
+        self.title(f'写真選定アプリ picsel - {fname}{decision}{stars}{burst}{saved}{shot}')
+
+    def rate_image(self, rating):
+        # 表示中の画像に0〜5の評価を付ける（0で解除）
+        if not self.image_list:
+            return
+        fname = self.image_list[self.current_index]
+        self.session.set_rating(fname, rating)
+        self.update_title(fname)
+
+    def ordered_names(self):
+        # インデックスの並び順の一覧（ぼやけ値順のときはぼやけている順）
+        # 連写のグループ分けが有効なら、グループ内は最もシャープなものが先頭になるように並べる
+        names = self.folder_index.names() if self.folder_index is not None else []
+        groups = group_bursts(names, self.hashes, self.config.group_threshold, self.config.group_window) \
+            if self.hashes else [[f] for f in names]
+        self.group_of = {}
+        for group in groups:
+            group.sort(key=lambda f: (f not in self.blur_scores, -self.blur_scores.get(f, 0.0)))
+            for f in group:
+                self.group_of[f] = group
+        if self.sort_by_blur:
+            names.sort(key=lambda f: (f not in self.blur_scores, self.blur_scores.get(f, 0.0)))
+            return names
+        return [f for group in groups for f in group]
+
+    def refresh_order(self):
+        # 並び順を作り直す（表示中の画像の位置は維持）
+        current = self.image_list[self.current_index] if self.image_list else None
+        self.image_list = self.ordered_names()
+        if current in self.image_list:
+            self.current_index = self.image_list.index(current)
+        else:
+            self.current_index = min(self.current_index, max(len(self.image_list) - 1, 0))
+        if current is not None and self.image_list:
+            self.update_title(self.image_list[self.current_index])
+        self.schedule_grid_draw()
+        return current
+
+    def poll_index(self):
+        # 監視スレッドが検出したフォルダの変更を取り込む
+        self.index_poll_id = None
+        if self.index_watcher is None:
+            return
+        changes = self.index_watcher.poll()
+        if changes is not None:
+            self.apply_index_changes(changes)
+        self.index_poll_id = self.after(500, self.poll_index)
+
+    def apply_index_changes(self, changes):
+        # 一覧を更新する。表示中の画像の位置は維持し、変更・削除されたファイルの結果は破棄する
+        current = self.image_list[self.current_index] if self.image_list else None
+        for fname in changes.changed + changes.removed:
+            self.prefetcher.cache.pop(os.path.join(self.open_dir, fname))
+            self.renderer.discard(os.path.join(self.open_dir, fname))
+            self.tile_cache.discard(os.path.join(self.open_dir, fname))
+            self.thumbnails.cache.pop(os.path.join(self.open_dir, fname))
+            self.blur_scores.pop(fname, None)
+            self.hashes.pop(fname, None)
+        self.refresh_order()
+        todo = changes.added + changes.changed
+        if todo and self.config.blur_scan:
+            self.blur_scanner.add([os.path.join(self.open_dir, f) for f in todo])
+            if self.blur_poll_id is None:
+                self.blur_poll_id = self.after(200, self.poll_blur_scan)
+        if todo and self.config.group_enabled:
+            self.hash_scanner.add([os.path.join(self.open_dir, f) for f in todo])
+            if self.hash_poll_id is None:
+                self.hash_poll_id = self.after(200, self.poll_hash_scan)
+        if current is None or current in changes.changed or current in changes.removed:
+            self.show_image()
+        elif self.image_list:
+            self.prefetch_next()
+
+    def stop_index_watcher(self):
+        if self.index_poll_id is not None:
+            self.after_cancel(self.index_poll_id)
+            self.index_poll_id = None
+        if self.index_watcher is not None:
+            self.index_watcher.stop()
+            self.index_watcher = None
 
+    def stop_analysis(self):
+        # 前のフォルダのキャッシュ読み込み・ぼやけ判定・ハッシュ計算をやめる
+        self.blur_scanner.cancel()
+        self.hash_scanner.cancel()
+        if self.cached_poll_id is not None:
+            self.after_cancel(self.cached_poll_id)
+            self.cached_poll_id = None
+        self.cached_lookup = None
+
+    def start_analysis(self):
+        # キャッシュ済みのぼやけ値・ハッシュを別スレッドで1回のまとめたクエリで読み、読み終わったら足りない分の計算を始める
+        self.blur_scores = {}
+        self.hashes = {}
+        self.stop_analysis()
+        if not self.config.blur_scan and not self.config.group_enabled:
+            return
+        if self.analysis_cache is None:
+            self.start_blur_scan({})
+            self.start_hash_scan({})
+            return
+        entries = self.folder_index.entries
+        stats = {os.path.join(self.open_dir, f): (entries[f].size, entries[f].mtime_ns)
+                 for f in self.image_list if f in entries}
+        self.cached_lookup = self.analysis_cache.start_lookup(stats, stats)
+        self.cached_poll_id = self.after(20, self.poll_cached_lookup)
+
+    def poll_cached_lookup(self):
+        self.cached_poll_id = None
+        if self.cached_lookup is None:
+            return
+        cached = self.cached_lookup.poll()
+        if cached is None:
+            self.cached_poll_id = self.after(20, self.poll_cached_lookup)
+            return
+        self.cached_lookup = None
+        # 読んでいる間に変更されたファイルの値は使わない
+        entries = self.folder_index.entries
+        for path, entry in list(cached.items()):
+            current = entries.get(os.path.relpath(path, self.open_dir))
+            if current is None or (current.size, current.mtime_ns) != (entry['size'], entry['mtime_ns']):
+                del cached[path]
+        self.start_blur_scan(cached)
+        self.start_hash_scan(cached)
+
+    def start_blur_scan(self, cached):
+        # フォルダ内の全画像のぼやけ値をバックグラウンドで計算する（cachedはキャッシュ済みの{path: entry}）
+        if not self.config.blur_scan:
+            return
+        names = {os.path.join(self.open_dir, f): f for f in self.image_list}
+        for path, entry in cached.items():
+            if path in names and entry['blur'] is not None and entry['blur_metric'] == self.sharpness.signature:
+                self.blur_scores[names[path]] = entry['blur']
+        todo = [path for path, f in names.items() if f not in self.blur_scores]
+        self.blur_scanner.start(todo)
+        if self.blur_poll_id is not None:
+            self.after_cancel(self.blur_poll_id)
+        self.blur_poll_id = self.after(200, self.poll_blur_scan)
+
+    def poll_blur_scan(self):
+        # 計算済みの結果を取り込み、進捗を表示する
+        self.blur_poll_id = None
+        scored = []
+        for path, score in self.blur_scanner.poll():
+            if score is None:
+                continue
+            self.blur_scores[os.path.relpath(path, self.open_dir)] = score
+            scored.append((path, {'blur': score, 'blur_metric': self.sharpness.signature}))
+        if scored and self.analysis_cache is not None:
+            try:
+                self.analysis_cache.store_many(scored)
+            except (OSError, sqlite3.Error) as e:
+                print(f'キャッシュ保存失敗: {e}')
+        if self.blur_scanner.running:
+            self.status_label.config(text=f'ぼやけ判定中 {self.blur_scanner.done}/{self.blur_scanner.total}')
+            self.blur_poll_id = self.after(200, self.poll_blur_scan)
+        else:
+            n = sum(1 for score in self.blur_scores.values() if score < self.config.blur_threshold)
+            self.status_label.config(text=f'ぼやけ {n}/{len(self.image_list)}枚')
+            if self.hashes:
+                # グループ内の並び（シャープな順）を確定したぼやけ値で作り直す
+                self.refresh_order()
+
+    def stop_duplicate_scan(self):
+        if self.duplicate_poll_id is not None:
+            self.after_cancel(self.duplicate_poll_id)
+            self.duplicate_poll_id = None
+        if self.duplicate_scan is not None:
+            self.duplicate_scan.stop()
+            self.duplicate_scan = None
+
+    def start_duplicate_scan(self):
+        # 写真フォルダ内と保存先フォルダにある内容が完全に同じファイルをバックグラウンドで探す
+        # サイズが同じファイルだけ先頭と末尾を読み、それも同じものだけ全体を読む
+        self.stop_duplicate_scan()
+        self.saved_names = set()
+        if not self.config.duplicates_scan or self.folder_index is None:
+            return
+        sizes = {f: self.folder_index.entries[f].size for f in self.image_list if f in self.folder_index.entries}
+        self.duplicate_scan = DuplicateScan(self.open_dir, sizes, self.excluded_folders(), self.config.duplicates_workers)
+        self.duplicate_poll_id = self.after(500, self.poll_duplicate_scan)
+
+    def poll_duplicate_scan(self):
+        self.duplicate_poll_id = None
+        result = self.duplicate_scan.poll() if self.duplicate_scan is not None else None
+        if result is None:
+            if self.duplicate_scan is not None:
+                self.duplicate_poll_id = self.after(500, self.poll_duplicate_scan)
+            return
+        self.duplicate_scan = None
+        self.apply_duplicates(result)
+
+    def apply_duplicates(self, result):
+        # 同じ内容の画像は1枚（保存済みのもの、無ければ並び順で先頭）を残し、未判定の残りを削除マークする
+        # マークはUキーでまとめて取り消せる。保存先に既にある画像はタイトルに表示する
+        self.saved_names = set(result.saved)
+        # 保存先の中のファイルは保存したものなので、一覧に入っていても削除マークしない
+        protected = self.excluded_folders()
+        order = {f: i for i, f in enumerate(self.image_list)
+                 if not is_inside(os.path.join(self.open_dir, f), protected)}
+        marked = []
+        for group in result.duplicates:
+            group = sorted((f for f in group if f in order),
+                           key=lambda f: (self.session.decision(f) != KEEP, order[f]))
+            for fname in group[1:]:
+                if self.config.duplicates_mark and self.session.decision(fname) == UNRATED:
+                    self.set_decision(fname, DELETE)
+                    marked.append((fname, UNRATED))
+        if marked:
+            self.undo_stack.append(('marks', None, marked, None))
+            self.fileop_label.config(text=f'重複 {len(marked)}枚を削除マーク')
+        elif result.duplicates or result.saved:
+            n = sum(len(group) - 1 for group in result.duplicates)
+            self.fileop_label.config(text=f'重複 {n}枚 保存先にあり {len(result.saved)}枚')
+        if self.image_list:
+            self.update_title(self.image_list[self.current_index])
+        if self.grid_on:
+            self.schedule_grid_draw()
+
+    def start_hash_scan(self, cached):
+        # 連写のグループ分けに使う知覚ハッシュをバックグラウンドで計算する（cachedはキャッシュ済みの{path: entry}）
+        if not self.config.group_enabled:
+            return
+        prefix = self.config.group_method + ':'
+        names = {os.path.join(self.open_dir, f): f for f in self.image_list}
+        for path, entry in cached.items():
+            if path in names and entry['phash'] and entry['phash'].startswith(prefix):
+                self.hashes[names[path]] = int(entry['phash'][len(prefix):], 16)
+        todo = [path for path, f in names.items() if f not in self.hashes]
+        self.hash_scanner.start(todo)
+        if self.hash_poll_id is not None:
+            self.after_cancel(self.hash_poll_id)
+            self.hash_poll_id = None
+        if todo:
+            self.hash_poll_id = self.after(200, self.poll_hash_scan)
+        elif self.hashes:
+            self.refresh_order()
+
+    def poll_hash_scan(self):
+        # 計算済みのハッシュを取り込み、すべて終わったらグループ分けして並べ直す
+        self.hash_poll_id = None
+        hashed = []
+        for path, value in self.hash_scanner.poll():
+            if value is None:
+                continue
+            self.hashes[os.path.relpath(path, self.open_dir)] = value
+            hashed.append((path, {'phash': f'{self.config.group_method}:{value:016x}'}))
+        if hashed and self.analysis_cache is not None:
+            try:
+                self.analysis_cache.store_many(hashed)
+            except (OSError, sqlite3.Error) as e:
+                print(f'キャッシュ保存失敗: {e}')
+        if self.hash_scanner.running:
+            self.hash_poll_id = self.after(200, self.poll_hash_scan)
+        else:
+            self.refresh_order()
+
+    @timed('show_image')
     def show_image(self):
+        if self.grid_on:
+            self.schedule_grid_draw()
+            return
         if not self.image_list:
-            self.image_panel.config(image='', text='画像がありません')
+            self.image_panel.config(image='', text='画像がありません' if self.index_ready else 'フォルダを読み込み中…')
             return
         fname = self.image_list[self.current_index]
         path = os.path.join(self.open_dir, fname)
-        img = self.load_image(path)
-        if img is None:
+        self.session.set_position(fname)
+        self.update_title(fname)
+        self.decode_size = self.frame_size()
+        # プリフェッチ済みならキャッシュから、読み込み中なら完了を待って取得
+        frame = self.prefetcher.get(path)
+        if frame is not None and not frame.covers(self.decode_size):
+            # ウィンドウが拡大された場合は表示サイズに合わせて読み直す
+            self.prefetcher.cache.pop(path)
+            frame = self.prefetcher.get(path)
+        if frame is None:
             self.image_panel.config(image='', text='画像を開けません')
             return
-        img_disp = self.resize_image(img)
-        blur = self.is_blur(img)
-        img_disp = self.overlay_zoom(img_disp, img)
-        if blur:
-            img_disp = self.overlay_blur_label(img_disp)
-        self.tk_img = ImageTk.PhotoImage(img_disp)
-        self.image_panel.config(image=self.tk_img)
+        self.blur_scores[fname] = frame.blur_score
+        # 続けて送っている間は軽いフィルタで描画し、止まったらきれいなフィルタで描き直す
+        fast = self.navigator.scrolling()
+        self.current_frame = (path, frame)
+        self.render_frame(path, frame, fast)
+        if self.refine_id is not None:
+            self.after_cancel(self.refine_id)
+            self.refine_id = None
+        if fast:
+            self.refine_id = self.after(max(1, int(self.navigator.settle_delay() * 1000)), self.refine_image)
         self.prefetch_next()
 
+    @timed('render_frame')
+    def render_frame(self, path, frame, fast=False):
+        if self.compare_on:
+            self.render_compare(fast)
+            return
+        blur = frame.blur_score < self.config.blur_threshold
+        if self.loupe_on:
+            box = self.loupe_box(frame.original_size)
+            loupe = self.loupe_image(path, frame, box)
+            img_disp = self.renderer.render_loupe(path, frame, self.frame_size(), blur, box, loupe, fast)
+        else:
+            img_disp = self.renderer.render(path, frame, self.frame_size(), self.zoom_box(frame.original_size),
+                                            blur, fast)
+        with self.metrics.span('photoimage'):
+            self.tk_img = self.photo_image(img_disp, self.tk_img)
+        self.image_panel.config(image=self.tk_img)
+
+    def photo_image(self, img, reuse=None):
+        # 表示中のPhotoImage（reuse）と同じ大きさなら画素だけを書き換えて使い回す（Tkの画像を作り直さない）
+        if reuse is not None and (reuse.width(), reuse.height()) == img.size:
+            reuse.paste(img)
+            return reuse
+        return ImageTk.PhotoImage(img)
+
+    def compare_candidates(self):
+        # 比較する画像：連写グループがあればその先頭から最大4枚、無ければ前の画像と並べる（表示中の画像は必ず含む）
+        current = self.image_list[self.current_index]
+        group = self.group_of.get(current, [current])
+        if len(group) > 1:
+            names = group[:COMPARE_MAX]
+            if current not in names:
+                names = names[:-1] + [current]
+            return names
+        if self.current_index > 0:
+            return [self.image_list[self.current_index - 1], current]
+        return self.image_list[:2]
+
+    def pane_grid(self, n):
+        # n枚を並べるときの(列数, 行数, 1枚の大きさ)
+        cols = 1 if n == 1 else 2
+        rows = (n + cols - 1) // cols
+        fw, fh = self.frame_size()
+        return cols, rows, (max(fw // cols, 1), max(fh // rows, 1))
+
+    def render_compare(self, fast=False):
+        # 比較表示：候補を並べ、ルーペの位置と倍率は全ての画像で揃える
+        current = self.image_list[self.current_index]
+        names = self.compare_candidates()
+        cols, rows, pane = self.pane_grid(len(names))
+        # 使わない行・列は幅0にする
+        self.compare_frame.columnconfigure(1, weight=int(cols > 1), uniform='pane' if cols > 1 else '')
+        for i in range(2):
+            self.compare_frame.rowconfigure(i, weight=int(i < rows), uniform='pane' if i < rows else '')
+        self.compare_names = names
+        self.compare_frames = []
+        previous, self.compare_imgs = self.compare_imgs, {}
+        # 表示中以外の写真は読み込みを待たない（読み込み中はプレビューを出し、読み込めたら描き直す）
+        paths = {os.path.join(self.open_dir, f) for f in names}
+        self.compare_waiting &= paths
+        waiting = False
+        for i, panel in enumerate(self.compare_panels):
+            if i >= len(names):
+                panel.grid_forget()
+                continue
+            path = os.path.join(self.open_dir, names[i])
+            frame = self.current_frame[1] if names[i] == current else self.prefetcher.cache.get(path)
+            self.compare_frames.append(frame)
+            panel.grid(row=i // cols, column=i % cols, sticky='nsew')
+            if frame is None and (path not in self.compare_waiting or self.prefetcher.loading(path)):
+                if path not in self.compare_waiting:
+                    self.compare_waiting.add(path)
+                    self.prefetch_next()
+                waiting = True
+                self.show_pane_preview(i, panel, path, names[i], pane, previous.get(i))
+                continue
+            if frame is None:
+                panel.config(image='', text='画像を開けません')
+                continue
+            self.blur_scores[names[i]] = frame.blur_score
+            blur = frame.blur_score < self.config.blur_threshold
+            if self.loupe_on:
+                box = self.loupe_box(frame.original_size)
+                loupe = self.loupe_image(path, frame, box)
+            else:
+                box, loupe = self.zoom_box(frame.original_size), None
+            img = self.renderer.render_pane(path, frame, pane, blur, box, loupe, f'Sharp {frame.blur_score:.0f}',
+                                            selected=names[i] == current, fast=fast)
+            with self.metrics.span('photoimage'):
+                tk_img = self.photo_image(img, previous.get(i))
+            self.compare_imgs[i] = tk_img
+            panel.config(image=tk_img)
+        if self.compare_id is not None:
+            self.after_cancel(self.compare_id)
+            self.compare_id = None
+        if waiting:
+            self.compare_id = self.after(20, self.poll_compare)
+
+    def show_pane_preview(self, i, panel, path, fname, pane, reuse):
+        # 比較表示の枠に、読み込みを待つ間の低解像度プレビュー（無ければ「読み込み中」）を出す
+        img = self.preview_image(path, fname)
+        if img is None:
+            panel.config(image='', text='読み込み中…')
+            return
+        self.compare_imgs[i] = self.photo_image(self.renderer.resize(img.convert('RGB'), pane, fast=True), reuse)
+        panel.config(image=self.compare_imgs[i], text='')
+
+    def poll_compare(self):
+        # 比較表示で待っている写真のどれかが読み込み終わったら描き直す
+        self.compare_id = None
+        if not self.compare_on or self.current_frame is None:
+            return
+        pending = [path for path in self.compare_waiting if path not in self.prefetcher.cache]
+        if pending and all(self.prefetcher.loading(path) for path in pending):
+            self.compare_id = self.after(20, self.poll_compare)
+            return
+        self.render_compare()
+
+    def toggle_compare(self, event=None):
+        # 1枚表示⇔比較表示を切り替える
+        self.compare_on = not self.compare_on
+        if self.compare_on:
+            self.image_panel.pack_forget()
+            self.compare_frame.pack(fill=tk.BOTH, expand=True)
+        else:
+            self.compare_frame.pack_forget()
+            self.image_panel.pack(fill=tk.BOTH, expand=True)
+        self.show_image()
+
+    def toggle_grid(self, event=None):
+        # 1枚表示⇔一覧表示を切り替える（一覧表示で選択した写真から1枚表示に戻る）
+        if not self.image_list and not self.grid_on:
+            return
+        self.grid_on = not self.grid_on
+        panel = self.compare_frame if self.compare_on else self.image_panel
+        if self.grid_on:
+            panel.pack_forget()
+            self.grid_frame.pack(fill=tk.BOTH, expand=True)
+            self.grid_offset = self.grid_layout().centered(self.current_index)
+            self.draw_grid()
+            return
+        # 見えていたセルの画像を解放し、未着手のサムネイルの読み込みを取り消す
+        self.grid_frame.pack_forget()
+        self.grid_canvas.delete('all')
+        self.grid_cells = {}
+        self.thumbnails.schedule([])
+        panel.pack(fill=tk.BOTH, expand=True)
+        self.show_when_loaded()
+
+    def grid_size(self):
+        # 一覧表示のキャンバスの大きさ（まだ表示されていなければ画像表示用Frameの大きさ）
+        w, h = self.grid_canvas.winfo_width(), self.grid_canvas.winfo_height()
+        if w < 10 or h < 10:
+            return self.frame_size()
+        return w, h
+
+    def grid_layout(self):
+        return GridLayout(len(self.image_list), self.grid_size(), self.config.grid_cell)
+
+    def schedule_grid_draw(self):
+        # 一覧表示の描き直しはアイドル時にまとめて1回行う
+        if self.grid_on and self.grid_draw_id is None:
+            self.grid_draw_id = self.after_idle(self.draw_grid)
+
+    @timed('draw_grid')
+    def draw_grid(self):
+        # 見えているセルだけを描画する。セルの画像は前回から変わったものだけ作り直し、見えなくなったものは解放する
+        # サムネイルが無いセルは枠だけ描き、バックグラウンドで読み込んで届いたら描き直す
+        self.grid_draw_id = None
+        if not self.grid_on:
+            return
+        layout = self.grid_layout()
+        self.grid_offset = layout.clamp(self.grid_offset)
+        visible = layout.visible(self.grid_offset)
+        cells, missing = {}, []
+        for i in visible:
+            fname = self.image_list[i]
+            path = os.path.join(self.open_dir, fname)
+            thumb = self.thumbnails.cache.get(path)
+            if thumb is None:
+                missing.append(path)
+            decision = self.session.decision(fname)
+            score = self.blur_scores.get(fname)
+            blur = score is not None and score < self.config.blur_threshold
+            signature = (fname, thumb is not None, decision, blur, i == self.current_index, layout.cell)
+            cell = self.grid_cells.get(i)
+            if cell is None or cell[0] != signature:
+                color = {KEEP: KEEP_COLOR, DELETE: DELETE_COLOR}.get(decision)
+                img = self.renderer.render_cell(thumb, layout.cell, color, blur, i == self.current_index)
+                cell = (signature, ImageTk.PhotoImage(img))
+            cells[i] = cell
+        self.grid_cells = cells
+        self.grid_canvas.delete('all')
+        # ファイル名は収まる文字数まで末尾（拡張子側）を残して詰める
+        chars = max(4, (layout.cell - 12) // 7)
+        for i, (signature, tk_img) in cells.items():
+            x, y = layout.position(i, self.grid_offset)
+            self.grid_canvas.create_image(x, y, image=tk_img, anchor='nw')
+            name = os.path.basename(signature[0])
+            if len(name) > chars:
+                name = '…' + name[-(chars - 1):]
+            self.grid_canvas.create_text(x + layout.cell // 2, y + layout.cell - 8, text=name, fill='white',
+                                         anchor='s', font=('', 8))
+        total = max(layout.rows * layout.cell, 1)
+        self.grid_scrollbar.set(self.grid_offset / total, min(1.0, (self.grid_offset + layout.height) / total))
+        # 見えているセルを優先し、次の1画面分も先に読み込む（範囲外になった未着手の読み込みは取り消される）
+        ahead = range(visible.stop, min(visible.stop + len(visible), layout.count))
+        self.thumbnails.schedule(missing + [os.path.join(self.open_dir, self.image_list[i]) for i in ahead])
+        if missing and self.grid_poll_id is None:
+            self.grid_poll_id = self.after(50, self.poll_grid)
+
+    def poll_grid(self):
+        self.grid_poll_id = None
+        self.draw_grid()
+
+    def load_grid_thumbnail(self, path):
+        # 一覧表示のサムネイル（ワーカースレッドから呼ばれるためTkには触れない）
+        try:
+            with self.metrics.span('thumbnail'):
+                return load_thumbnail(path, self.config.grid_cell - 12, self.analysis_cache)
+        except Exception as e:
+            print(f'サムネイル読み込み失敗: {e}')
+            # 読めない画像は空のサムネイルにして、描き直すたびに読み直さないようにする
+            return Image.new('RGB', (1, 1), CELL_BACKGROUND)
+
+    def on_grid_key(self, event):
+        # 一覧表示での↑↓（1行）・PageUp/PageDown（1画面）・Home/End・Enter（1枚表示で開く）
+        if not self.grid_on or not self.image_list:
+            return
+        if event.keysym == 'Return':
+            self.toggle_grid()
+            return
+        layout = self.grid_layout()
+        page = max(1, layout.height // layout.cell) * layout.columns
+        step = {'Up': -layout.columns, 'Down': layout.columns, 'Prior': -page, 'Next': page,
+                'Home': -layout.count, 'End': layout.count}[event.keysym]
+        self.navigate(min(max(self.current_index + step, 0), layout.count - 1))
+
+    def on_grid_click(self, event):
+        index = self.grid_layout().index_at(event.x, event.y, self.grid_offset)
+        if index is not None:
+            self.navigate(index)
+
+    def on_grid_open(self, event):
+        # ダブルクリックしたセルを1枚表示で開く
+        index = self.grid_layout().index_at(event.x, event.y, self.grid_offset)
+        if index is not None:
+            self.current_index = index
+            self.toggle_grid()
+
+    def on_grid_wheel(self, event):
+        # ホイールで半セルずつスクロールする（選択は動かさない）
+        up = getattr(event, 'delta', 0) > 0 or getattr(event, 'num', None) == 4
+        self.grid_offset += -self.config.grid_cell // 2 if up else self.config.grid_cell // 2
+        self.schedule_grid_draw()
+
+    def on_grid_scroll(self, *args):
+        # スクロールバーの操作（つまみのドラッグ・矢印・つまみの外側のクリック）
+        layout = self.grid_layout()
+        if args[0] == 'moveto':
+            self.grid_offset = int(float(args[1]) * layout.rows * layout.cell)
+        elif args[0] == 'scroll':
+            unit = layout.height if args[2] == 'pages' else layout.cell // 2
+            self.grid_offset += int(args[1]) * unit
+        self.schedule_grid_draw()
+
+    def toggle_hud(self, event=None):
+        # 処理時間・キャッシュのヒット率・キューの長さを画像の左上に重ねて表示する
+        self.hud_on = not self.hud_on
+        if self.hud_on:
+            self.hud_label.place(x=0, y=0)
+            self.update_hud()
+        else:
+            self.hud_label.place_forget()
+            if self.hud_id is not None:
+                self.after_cancel(self.hud_id)
+                self.hud_id = None
+
+    def update_hud(self):
+        self.hud_id = None
+        if not self.hud_on:
+            return
+        if not self.metrics.enabled:
+            text = '計測は無効です（setting.iniの[metrics] enabled）'
+        else:
+            hit = self.metrics.hit_rate('prefetch')
+            text = '\n'.join([
+                self.metrics.format_table(),
+                f'{"cache hit":22}{"-" if hit is None else f"{hit:.0%}":>22}',
+                f'{"cache MB":22}{self.prefetcher.cache.nbytes / 2 ** 20:22.0f}',
+                f'{"fileops running":22}{self.file_queue.running:22d}',
+            ])
+        self.hud_label.config(text=text)
+        self.hud_label.lift()
+        self.hud_id = self.after(500, self.update_hud)
+
+    def export_trace(self):
+        # 設定されていれば、記録した処理時間をトレースとして書き出す
+        if not self.config.metrics_trace or not self.metrics.enabled:
+            return
+        try:
+            self.metrics.export(self.config.metrics_trace)
+        except OSError as e:
+            print(f'トレース保存失敗: {e}')
+
+    def select_pane(self, event, pane):
+        # クリックした画像を表示中の画像にする（保存・削除などの操作の対象になる）
+        if pane >= len(self.compare_names):
+            return
+        self.on_loupe_move(event, pane)
+        self.current_index = self.image_list.index(self.compare_names[pane])
+        self.show_image()
+
+    def refine_image(self):
+        # 操作が止まったら表示中の画像をきれいなフィルタで描き直す（まだ送りが続いていれば待ち直す）
+        self.refine_id = None
+        if self.navigator.scrolling():
+            self.refine_id = self.after(max(1, int(self.navigator.settle_delay() * 1000)), self.refine_image)
+        elif self.current_frame is not None:
+            self.render_frame(*self.current_frame)
+
     def load_image(self, path):
-        ext = os.path.splitext(path)[1].lower()
         try:
-            if ext == '.heic':
-                pillow_heif.register_heif_opener()
-            img = Image.open(path)
+            img = open_image(path)
             return img.convert('RGB')
         except Exception as e:
             print(f'画像読み込み失敗: {e}')
             return None
 
-    def resize_image(self, img):
-        # 画像表示用Frameのサイズに合わせてリサイズ
+    def open_analysis_cache(self):
+        # 解析結果の永続キャッシュ（無効化されている・開けない場合はNone）
+        if not self.config.cache_enabled:
+            return None
+        cache_dir = self.config.cache_dir or default_cache_dir()
+        try:
+            cache = AnalysisCache(os.path.join(cache_dir, 'analysis.sqlite'),
+                                  use_hash=self.config.cache_content_hash,
+                                  max_bytes=self.config.cache_max_mb * 1024 * 1024)
+        except (OSError, sqlite3.Error) as e:
+            print(f'キャッシュを開けません: {e}')
+            return None
+        # 容量の上限を超えた分と消えたファイルのエントリを削除する
+        cache.start_prune()
+        return cache
+
+    @timed('load_image')
+    def load_display_image(self, path):
+        # 表示サイズを下回らない最小解像度でデコードし、拡大表示部分だけ元解像度で切り出す
+        # EXIFの向きは縮小後の画像と切り出した部分にだけ適用する（original_sizeは向きを直した後の大きさ）
+        # 永続キャッシュに有効なプレビューがあれば元ファイルはデコードしない
+        # （プリフェッチのワーカースレッドから呼ばれるためTkには触れない）
+        try:
+            frame = self.load_cached_display_image(path)
+            if frame is not None:
+                return frame
+            # ぼやけ判定の解析サイズも満たす解像度でデコードする
+            orientation = read_orientation(path)
+            img, source_size = load_scaled(path, self.decode_size, long_edge=self.sharpness.size)
+            if self.prefetcher.stale():
+                # 読み込み中に送り過ぎて対象外になった画像は、切り出し・ぼやけ判定をせずにやめる
+                return None
+            # ぼやけ値はフォルダ全体のスキャンと同じ解像度の画像で計算する（ウィンドウの大きさで値が変わらない）
+            score = self.blur_score(analysis_image(path, img, self.sharpness.size))
+            original_size = oriented_size(source_size, orientation)
+            box = source_box(self.zoom_box(original_size), source_size, orientation)
+            img = apply_orientation(img, orientation)
+            zoom = apply_orientation(load_region(path, box), orientation)
+            frame = DisplayImage(img, original_size, zoom, blur_score=score, orientation=orientation)
+        except Exception as e:
+            print(f'画像読み込み失敗: {e}')
+            return None
+        self.store_analysis(path, frame)
+        return frame
+
+    def load_cached_display_image(self, path):
+        if self.analysis_cache is None:
+            return None
+        entry = self.analysis_cache.lookup(path)
+        if not entry or not entry['preview'] or entry['zoom_range'] != self.config.zoom_range \
+                or entry['blur_metric'] != self.sharpness.signature:
+            return None
+        frame = DisplayImage(decode_image(entry['preview']), (entry['width'], entry['height']),
+                             decode_image(entry['zoom']), blur_score=entry['blur'],
+                             orientation=entry['orientation'])
+        return frame if frame.covers(self.decode_size) else None
+
+    def store_analysis(self, path, frame):
+        if self.analysis_cache is None:
+            return
+        # プレビューは表示枠に収まる大きさにして保存する（縮小デコードの画像は枠より大きいことが多い）
+        size = frame.fitted(self.decode_size)
+        preview = frame.image
+        if preview.width > size[0] or preview.height > size[1]:
+            preview = pick_level(frame.pyramid, size).resize(size, Image.LANCZOS)
+        try:
+            self.analysis_cache.store(
+                path, blur=frame.blur_score, blur_metric=self.sharpness.signature, orientation=frame.orientation,
+                width=frame.original_size[0], height=frame.original_size[1],
+                preview=encode_image(preview), zoom=encode_image(frame.zoom, 'PNG'),
+                zoom_range=self.config.zoom_range)
+        except (OSError, sqlite3.Error) as e:
+            print(f'キャッシュ保存失敗: {e}')
+
+    def frame_size(self):
+        # 画像表示用Frameのサイズ（リサイズイベントで受け取った値を使う）
+        if self.frame_dims is not None:
+            return self.frame_dims
         w = self.image_frame.winfo_width()
         h = self.image_frame.winfo_height()
         if w < 10 or h < 10:
             w, h = self.config.width, self.config.height - 60
-        return img.resize((w, h), Image.LANCZOS)
+        return w, h
+
+    def resize_image(self, img, fast=False):
+        # 画像表示用Frameに収まるよう、アスペクト比を保ってリサイズ
+        return self.renderer.resize(img, self.frame_size(), fast)
+
+    def loupe_box(self, size):
+        # ルーペで拡大する元画像の範囲（倍率が上がるほど狭くなる）
+        zoom = self.config.loupe_zooms[self.loupe_zoom_index]
+        side = max(1, min(self.config.loupe_size // zoom, size[0], size[1]))
+        cx, cy = self.loupe_point[0] * size[0], self.loupe_point[1] * size[1]
+        left = int(min(max(cx - side / 2, 0), size[0] - side))
+        upper = int(min(max(cy - side / 2, 0), size[1] - side))
+        return (left, upper, left + side, upper + side)
+
+    @timed('loupe_image')
+    def loupe_image(self, path, frame, box):
+        # 元解像度のタイルから範囲を組み立て、画素が見えるように最近傍で拡大する
+        # タイルは元ファイルの向きのまま保持し、切り出した範囲だけ向きを直す
+        zoom = self.config.loupe_zooms[self.loupe_zoom_index]
+        source_size = oriented_size(frame.original_size, frame.orientation)
+        region = self.tile_cache.region(path, source_box(box, source_size, frame.orientation), source_size)
+        region = apply_orientation(region, frame.orientation)
+        return region.resize((region.width * zoom, region.height * zoom), Image.NEAREST)
+
+    def toggle_loupe(self, event=None):
+        # ルーペモードの切り替え（中央の固定拡大表示⇔マウス位置のルーペ）
+        self.loupe_on = not self.loupe_on
+        if self.current_frame is not None:
+            self.render_frame(*self.current_frame)
+
+    def on_loupe_move(self, event, pane=None):
+        # マウスの位置（元画像に対する割合）にルーペを移動する。描画はまとめて行う
+        # 比較表示ではpaneがマウスのある画像の番号
+        if not self.loupe_on or self.current_frame is None:
+            return
+        if pane is None:
+            frame = self.current_frame[1]
+            fw, fh = self.frame_size()
+        else:
+            if pane >= len(self.compare_frames) or self.compare_frames[pane] is None:
+                return
+            frame = self.compare_frames[pane]
+            fw, fh = self.pane_grid(len(self.compare_names))[2]
+        dw, dh = fit_size(frame.image.size, (fw, fh))
+        # 表示画像はフレームの中央に置かれている
+        x = (event.x - (fw - dw) / 2) / dw
+        y = (event.y - (fh - dh) / 2) / dh
+        self.loupe_point = (min(max(x, 0.0), 1.0), min(max(y, 0.0), 1.0))
+        self.schedule_loupe_update()
+
+    def on_loupe_wheel(self, event):
+        # ホイールで倍率を切り替える（100%→200%→400%）
+        if not self.loupe_on:
+            return
+        up = getattr(event, 'delta', 0) > 0 or getattr(event, 'num', None) == 4
+        step = 1 if up else -1
+        self.loupe_zoom_index = min(max(self.loupe_zoom_index + step, 0), len(self.config.loupe_zooms) - 1)
+        self.schedule_loupe_update()
+
+    def schedule_loupe_update(self):
+        if self.loupe_id is None:
+            self.loupe_id = self.after(15, self.update_loupe)
+
+    def update_loupe(self):
+        self.loupe_id = None
+        if self.current_frame is not None:
+            self.render_frame(*self.current_frame)
 
-    def overlay_zoom(self, base_img, orig_img):
-        from PIL import ImageDraw
-        base_img = base_img.copy()  # 画像の重なり防止
-        cx, cy = orig_img.width // 2, orig_img.height // 2
+    def on_frame_resize(self, event):
+        # ウィンドウのリサイズ中は描き直さず、止まってからまとめて1回描き直す
+        if event.width < 10 or event.height < 10 or (event.width, event.height) == self.frame_dims:
+            return
+        self.frame_dims = (event.width, event.height)
+        if self.resize_id is not None:
+            self.after_cancel(self.resize_id)
+        self.resize_id = self.after(self.config.render_resize_ms, self.apply_resize)
+
+    def apply_resize(self):
+        # 表示中の画像をデコードし直さず、ピラミッドから新しいサイズで描き直す
+        # （解像度が足りない場合は次に表示するときに読み直す）
+        self.resize_id = None
+        self.decode_size = self.frame_size()
+        if self.current_frame is not None:
+            self.render_frame(*self.current_frame)
+
+    def zoom_box(self, size):
+        # 元画像中央の拡大範囲(left, upper, right, lower)
+        cx, cy = size[0] // 2, size[1] // 2
         r = self.config.zoom_range
-        left = max(cx - r, 0)
-        upper = max(cy - r, 0)
-        right = min(cx + r, orig_img.width)
-        lower = min(cy + r, orig_img.height)
-        # 拡大枠を元画像に描画
-        draw = ImageDraw.Draw(base_img)
-        # 元画像の表示サイズに合わせて枠位置を変換
-        disp_w, disp_h = base_img.width, base_img.height
-        scale_x = disp_w / orig_img.width
-        scale_y = disp_h / orig_img.height
-        rect = [left*scale_x, upper*scale_y, right*scale_x, lower*scale_y]
-        draw.rectangle(rect, outline='red', width=3)
-        # 拡大部分の作成
-        crop = orig_img.crop((left, upper, right, lower)).resize((r*2*self.config.zoom_scale, r*2*self.config.zoom_scale), Image.LANCZOS)
-        # 拡大部分の枠
-        crop_draw = ImageDraw.Draw(crop)
-        crop_draw.rectangle([0, 0, crop.width-1, crop.height-1], outline='red', width=3)
-        # ボタン領域に重ならないように下部マージンを確保
-        margin = 60  # ボタン領域の高さ+余白
-        pos_x = base_img.width - crop.width - 10
-        pos_y = base_img.height - crop.height - margin
-        if pos_y < 0:
-            pos_y = 0
-        base_img.paste(crop, (pos_x, pos_y))
-        return base_img
-
-    def overlay_blur_label(self, img):
-        from PIL import ImageDraw, ImageFont
-        img = img.copy()  # 画像の重なり防止
-        draw = ImageDraw.Draw(img)
-        try:
-            font = ImageFont.truetype("arial.ttf", 32)
-        except:
-            font = ImageFont.load_default()
-        draw.rectangle([0,0,100,40], fill=(255,255,255,128))
-        draw.text((5,5), 'Blur', fill='red', font=font)
-        return img
+        return (max(cx - r, 0), max(cy - r, 0), min(cx + r, size[0]), min(cy + r, size[1]))
+
+    @timed('blur_score')
+    def blur_score(self, img):
+        # 解析サイズに縮小した輝度で評価したシャープさ（大きいほどシャープ）
+        return self.sharpness.score(img)
 
     def is_blur(self, img):
-        arr = np.array(img.convert('L'))
-        lap = cv2.Laplacian(arr, cv2.CV_64F)
-        var = lap.var()
-        return var < self.config.blur_threshold
+        return self.blur_score(img) < self.config.blur_threshold
 
     def prefetch_next(self):
-        # プリフェッチ（次画像を事前読み込み）
-        idx = self.current_index + 1
-        if idx < len(self.image_list):
-            fname = self.image_list[idx]
-            path = os.path.join(self.open_dir, fname)
-            if fname not in self.prefetch_cache:
-                img = self.load_image(path)
-                self.prefetch_cache[fname] = img
+        # プリフェッチ（表示中の画像と前後の画像をバックグラウンドで事前読み込み。進行方向を優先）
+        # 対象外になった未着手の読み込みは取り消され、読み込み中のものも途中でやめる
+        n = len(self.image_list)
+        forward, backward = self.config.prefetch_ahead, self.config.prefetch_behind
+        if self.navigator.direction < 0:
+            forward, backward = backward, forward
+        ahead = range(self.current_index + 1, min(self.current_index + 1 + forward, n))
+        behind = range(self.current_index - 1, max(self.current_index - 1 - backward, -1), -1)
+        keys = [os.path.join(self.open_dir, self.image_list[i])
+                for i in [self.current_index] + list(ahead) + list(behind) if i < n]
+        if self.compare_on:
+            # 比較表示の候補を優先して読み込む
+            keys = [os.path.join(self.open_dir, f) for f in self.compare_candidates()] + keys
+        self.prefetcher.schedule(keys)
 
-    def copy_and_next(self, event=None):
+    @timed('copy_and_next')
+    def copy_and_next(self, event=None, destination=None):
         if not self.image_list:
             return
-        fname = self.image_list[self.current_index]
-        src = os.path.join(self.open_dir, fname)
-        dst = os.path.join(self.save_dir, fname)
-        try:
-            import shutil
-            shutil.copy2(src, dst)
-        except Exception as e:
-            messagebox.showerror('コピー失敗', str(e))
+        self.keep_image(self.image_list[self.current_index], destination)
         self.next_image()
 
+    def submit_keep(self, fname, destination=None):
+        # 保存（コピー・リンク・移動）はキューに積んでワーカースレッドで実行する（取り消し猶予の後に実行）
+        # destinationを省略すると保存先フォルダに保存する。付随ファイル（.xmp・RAWなど）も同じ構成で一緒に保存する
+        src = os.path.join(self.open_dir, fname)
+        if destination is None:
+            dst, strategy = os.path.join(self.save_dir, fname), self.config.keep_strategy
+        else:
+            dst, strategy = destination.path(self.save_dir, fname), destination.strategy or self.config.keep_strategy
+        folder = os.path.dirname(dst)
+        sidecars = [(s, os.path.join(folder, os.path.basename(s))) for s in self.sidecar_finder.find(src)]
+        return self.file_queue.submit('keep', src, dst, strategy=strategy, sidecars=sidecars)
+
+    def keep_image(self, fname, destination=None):
+        op = self.submit_keep(fname, destination)
+        self.undo_stack.append(('keep', fname, op, self.session.decision(fname)))
+        self.set_decision(fname, KEEP)
+        self.schedule_fileop_poll()
+
+    def route_kept(self, event=None):
+        # 保存と判定した写真を[routes]の条件で保存先ごとに振り分けてまとめて積む（Uキーでまとめて取り消せる）
+        if not self.routes or not self.image_list:
+            return
+        kept = [f for f in self.image_list if self.session.decision(f) == KEEP]
+
+        def facts_of(fname):
+            meta = self.folder_index.metadata(fname) if self.folder_index else None
+            return ImageFacts(meta, self.blur_scores.get(fname), self.session.rating(fname))
+
+        routed = route_images(kept, facts_of, self.routes)
+        ops = [self.submit_keep(f, destination) for destination, names in routed.items() for f in names]
+        if not ops:
+            self.fileop_label.config(text='振り分け先に当てはまる写真がありません')
+            return
+        self.undo_stack.append(('route', None, ops, None))
+        self.fileop_label.config(text=' '.join(f'{d.name} {len(names)}枚' for d, names in routed.items()))
+        self.schedule_fileop_poll()
+
+    def keep_best(self, event=None):
+        # 表示中の画像の連写グループで最もシャープな1枚を保存し、残りを削除マークして次のグループへ
+        if not self.image_list:
+            return
+        fname = self.image_list[self.current_index]
+        group = self.group_of.get(fname, [fname])
+        best = group[0]
+        if self.session.decision(best) != KEEP:
+            self.keep_image(best)
+        for other in group[1:]:
+            self.mark_delete_image(other)
+        last = max(self.image_list.index(f) for f in group)
+        self.navigate(last + 1 if last < len(self.image_list) - 1 else self.current_index)
+
+    def undo_last(self, event=None):
+        # 直前の保存（実行前のもの）または削除マークを取り消し、その画像に戻る
+        if not self.undo_stack:
+            return
+        kind, fname, op, previous = self.undo_stack.pop()
+        if kind == 'marks':
+            # まとめて付けた削除マーク（opは[(名前, 元の判定), ...]）
+            for name, decision in op:
+                self.set_decision(name, decision)
+            self.fileop_label.config(text=f'削除マーク {len(op)}枚を取り消しました')
+            if self.image_list:
+                self.update_title(self.image_list[self.current_index])
+            return
+        if kind == 'route':
+            # 振り分けは実行前のものだけ取り消す（判定は変わらない）
+            done = sum(1 for o in op if not self.file_queue.cancel(o))
+            self.fileop_label.config(text=f'振り分けを取り消しました（保存済み {done}件）' if done else '振り分けを取り消しました')
+            self.schedule_fileop_poll()
+            return
+        if kind == 'keep' and not self.file_queue.cancel(op):
+            self.fileop_label.config(text=f'{fname}は保存済みのため取り消せません')
+            return
+        self.set_decision(fname, previous)
+        if fname in self.image_list:
+            self.navigate(self.image_list.index(fname))
+        self.schedule_fileop_poll()
+
+    def schedule_fileop_poll(self):
+        if self.fileop_poll_id is None:
+            self.fileop_poll_id = self.after(300, self.poll_file_queue)
+
+    def poll_file_queue(self):
+        # キューの状態を表示し、すべて終わったら失敗をまとめて報告する
+        self.fileop_poll_id = None
+        self.fileop_errors.extend(self.file_queue.take_errors())
+        busy = self.file_queue.pending + self.file_queue.running
+        text = f'保存待ち {busy}件' if busy else ''
+        if self.fileop_errors:
+            text += f' 失敗 {len(self.fileop_errors)}件'
+        self.fileop_label.config(text=text.strip())
+        if busy:
+            self.schedule_fileop_poll()
+        else:
+            self.report_fileop_errors()
+
+    def report_fileop_errors(self, title='ファイル操作失敗'):
+        errors, self.fileop_errors = self.fileop_errors, []
+        if not errors:
+            return
+        lines = [op.describe() for op in errors[:20]]
+        if len(errors) > 20:
+            lines.append(f'ほか{len(errors) - 20}件')
+        messagebox.showerror(title, '\n'.join(lines))
+
+    def finish_file_operations(self):
+        # 取り消し待ちの操作もすぐに実行し、すべて終わるまで待つ
+        self.file_queue.flush()
+        self.file_queue.wait()
+        self.fileop_errors.extend(self.file_queue.take_errors())
+
     def next_image(self, event=None):
         if self.current_index < len(self.image_list) - 1:
-            self.current_index += 1
-            self.show_image()
+            self.navigate(self.current_index + 1)
+
+    def next_blur_image(self, event=None):
+        # 次のぼやけ画像へ移動
+        self.jump_to(lambda score: score < self.config.blur_threshold)
+
+    def next_sharp_image(self, event=None):
+        # 次のシャープな画像へ移動
+        self.jump_to(lambda score: score >= self.config.blur_threshold)
+
+    def jump_to(self, match):
+        # 現在位置の次から末尾→先頭の順に、ぼやけ値が条件に合う画像を探して表示する
+        n = len(self.image_list)
+        for step in range(1, n):
+            i = (self.current_index + step) % n
+            score = self.blur_scores.get(self.image_list[i])
+            if score is not None and match(score):
+                self.navigate(i)
+                return
+
+    def toggle_sort_blur(self, event=None):
+        # インデックス順⇔ぼやけ値順（ぼやけている順）を切り替える。表示中の画像は維持
+        if not self.image_list:
+            return
+        self.sort_by_blur = not self.sort_by_blur
+        self.refresh_order()
+        self.show_image()
 
     def prev_image(self, event=None):
         if self.current_index > 0:
-            self.current_index -= 1
-            self.show_image()
+            self.navigate(self.current_index - 1)
 
     def mark_delete(self, event=None):
-        fname = self.image_list[self.current_index]
-        if fname not in self.delete_list:
-            self.delete_list.append(fname)
+        self.mark_delete_image(self.image_list[self.current_index])
         self.next_image()
 
+    def mark_delete_image(self, fname):
+        previous = self.session.decision(fname)
+        if previous != DELETE:
+            self.set_decision(fname, DELETE)
+            self.undo_stack.append(('delete', fname, None, previous))
+
     def exit_and_delete(self):
+        # 削除した画像の判定を消してからセッションを閉じる
         self.save_delete_list()
         self.delete_files()
+        self.release_resources()
+        self.file_queue.shutdown()
         self.destroy()
 
     def exit_without_delete(self):
+        self.release_resources()
         self.save_delete_list()
+        self.finish_file_operations()
+        self.report_fileop_errors()
+        self.file_queue.shutdown()
         self.destroy()
 
+    def release_resources(self):
+        # 先読み・監視スレッドの停止とキャッシュ・セッションのクローズ
+        self.stop_index_watcher()
+        self.stop_duplicate_scan()
+        self.session.close()
+        self.prefetcher.shutdown()
+        self.thumbnails.shutdown()
+        self.blur_scanner.shutdown()
+        self.hash_scanner.shutdown()
+        if self.analysis_cache is not None:
+            self.analysis_cache.close()
+        self.export_trace()
+
     def save_delete_list(self):
         with open(self.json_delete_path, 'w', encoding='utf-8') as f:
             json.dump(self.delete_list, f, ensure_ascii=False, indent=2)
 
     def delete_files(self):
+        # 保存待ちの操作を先に終わらせてから、削除をまとめてキューで実行する
+        # 削除するのは開いているフォルダの一覧にある画像だけで、マークしたときからサイズか更新日時が変わったもの
+        # （同じ名前の別のファイルに置き換わったものなど）は残す。削除できた画像は判定を消す
+        self.finish_file_operations()
+        ops, skipped = [], []
         for fname in self.delete_list:
-            try:
-                os.remove(os.path.join(self.open_dir, fname))
-            except Exception as e:
-                messagebox.showerror('削除失敗', f'{fname}: {e}')
+            entry = self.folder_index.entries.get(fname) if self.folder_index is not None else None
+            stamp = self.session.stamp(fname) or (entry and (entry.size, entry.mtime_ns))
+            path = os.path.join(self.open_dir, fname)
+            if entry is None or file_stamp(path) != stamp:
+                skipped.append(fname)
+                continue
+            ops.append((fname, self.file_queue.submit('delete', path, delay=0)))
+        self.finish_file_operations()
+        for fname, op in ops:
+            if op.state == DONE:
+                self.set_decision(fname, UNRATED)
+        self.report_fileop_errors('削除失敗')
+        if skipped:
+            lines = skipped[:20] + ([f'ほか{len(skipped) - 20}件'] if len(skipped) > 20 else [])
+            messagebox.showwarning('削除しなかった画像', 'マークした後に変更された・フォルダに無い画像は削除していません:\n' + '\n'.join(lines))
 
     def on_exit(self):
         self.exit_without_delete()
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # exe化時にプロセスプールを使うため
+    if len(sys.argv) > 1:
+        # 引数があればウィンドウを開かずにバッチ処理する（cli.py参照）
+        from cli import main
+        sys.exit(main())
     config = AppConfig()
     app = PhotoSelectorApp(config)
     app.mainloop()
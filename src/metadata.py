@@ -0,0 +1,321 @@
+import io
+import operator
+import re
+import struct
+from datetime import datetime
+from PIL import Image
+
+from decode import is_raw, open_image
+
+# EXIFの向き(2〜8)を正しい向きに戻すPILの変換
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+# ヘッダーとして読むサイズ（JPEGのEXIFは64KBまで。RAWはIFDが先頭付近にある）
+JPEG_HEAD = 72 * 1024
+TIFF_HEAD = 256 * 1024
+
+# TIFFの型ごとの1要素のバイト数
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8, 11: 4, 12: 8}
+MAKE, MODEL, ORIENTATION, DATETIME = 0x010F, 0x0110, 0x0112, 0x0132
+THUMB_OFFSET, THUMB_LENGTH = 0x0201, 0x0202
+EXIF_IFD = 0x8769
+EXPOSURE_TIME, F_NUMBER, ISO, DATETIME_ORIGINAL, FOCAL_LENGTH, LENS_MODEL = \
+    0x829A, 0x829D, 0x8827, 0x9003, 0x920A, 0xA434
+WANTED = {MAKE, MODEL, ORIENTATION, DATETIME, THUMB_OFFSET, THUMB_LENGTH, EXIF_IFD,
+          EXPOSURE_TIME, F_NUMBER, ISO, DATETIME_ORIGINAL, FOCAL_LENGTH, LENS_MODEL}
+
+
+class ImageMetadata:
+    # ヘッダーから読み取った撮影情報（無い項目はNone。向きは1）
+    # thumbnailは埋め込みサムネイルのファイル内の(位置, 長さ)
+    __slots__ = ('orientation', 'capture_time', 'make', 'model', 'lens', 'focal_length',
+                 'exposure_time', 'f_number', 'iso', 'thumbnail')
+
+    def __init__(self, orientation=1, capture_time=None, make=None, model=None, lens=None, focal_length=None,
+                 exposure_time=None, f_number=None, iso=None, thumbnail=None):
+        self.orientation = orientation if orientation in range(1, 9) else 1
+        self.capture_time = capture_time
+        self.make = make
+        self.model = model
+        self.lens = lens
+        self.focal_length = focal_length
+        self.exposure_time = exposure_time
+        self.f_number = f_number
+        self.iso = iso
+        self.thumbnail = thumbnail
+
+    @property
+    def camera(self):
+        # メーカー名と機種名（機種名にメーカー名が含まれていれば機種名だけ）
+        if self.make and self.model and not self.model.lower().startswith(self.make.split()[0].lower()):
+            return f'{self.make} {self.model}'
+        return self.model or self.make
+
+    def shutter_text(self):
+        t = self.exposure_time
+        if not t:
+            return None
+        if t >= 0.3:
+            return f'{t:g}s'
+        return f'1/{round(1 / t)}'
+
+    def summary(self):
+        # タイトル表示用（例：1/250 f/2.8 ISO400 50mm）
+        parts = [self.shutter_text(),
+                 self.f_number and f'f/{self.f_number:g}',
+                 self.iso and f'ISO{self.iso}',
+                 self.focal_length and f'{self.focal_length:g}mm']
+        return ' '.join(p for p in parts if p)
+
+
+def _value(raw, typ, endian):
+    if typ == 2:
+        return raw.split(b'\x00', 1)[0].decode('utf-8', 'replace').strip() or None
+    if typ in (5, 10):
+        num, den = struct.unpack(endian + ('II' if typ == 5 else 'ii'), raw[:8])
+        return num / den if den else None
+    if typ == 3:
+        return struct.unpack(endian + 'H', raw[:2])[0]
+    if typ in (4, 9):
+        return struct.unpack(endian + ('I' if typ == 4 else 'i'), raw[:4])[0]
+    if typ in (11, 12):
+        return struct.unpack(endian + ('f' if typ == 11 else 'd'), raw[:TYPE_SIZES[typ]])[0]
+    return raw[0]
+
+
+def _read_ifd(data, offset, endian):
+    # IFDから必要なタグ{tag: 値}（配列は先頭の値）と次のIFDの位置を読む
+    if not 8 <= offset <= len(data) - 2:
+        return {}, 0
+    count = struct.unpack(endian + 'H', data[offset:offset + 2])[0]
+    tags = {}
+    for i in range(count):
+        pos = offset + 2 + i * 12
+        if pos + 12 > len(data):
+            return tags, 0
+        tag, typ, n = struct.unpack(endian + 'HHI', data[pos:pos + 8])
+        size = TYPE_SIZES.get(typ)
+        if tag not in WANTED or size is None or n == 0:
+            continue
+        total = size * n if typ == 2 else size
+        where = pos + 8 if size * n <= 4 else struct.unpack(endian + 'I', data[pos + 8:pos + 12])[0]
+        raw = data[where:where + total]
+        if len(raw) == total:
+            tags[tag] = _value(raw, typ, endian)
+    pos = offset + 2 + count * 12
+    next_offset = struct.unpack(endian + 'I', data[pos:pos + 4])[0] if pos + 4 <= len(data) else 0
+    return tags, next_offset
+
+
+def _parse_time(value):
+    try:
+        return datetime.strptime(value, '%Y:%m:%d %H:%M:%S').timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_tiff(data, base=None):
+    # TIFF形式のEXIF（先頭がIIまたはMMのバイト順。ORF・RW2などの独自のマジックナンバーも受け付ける）を解析する
+    # baseはdataの先頭のファイル内の位置（埋め込みサムネイルの位置の計算用。Noneならサムネイルは扱わない）
+    if data[:2] == b'II':
+        endian = '<'
+    elif data[:2] == b'MM':
+        endian = '>'
+    else:
+        return ImageMetadata()
+    if len(data) < 8:
+        return ImageMetadata()
+    ifd0, ifd1_offset = _read_ifd(data, struct.unpack(endian + 'I', data[4:8])[0], endian)
+    exif = _read_ifd(data, ifd0[EXIF_IFD], endian)[0] if EXIF_IFD in ifd0 else {}
+    ifd1 = _read_ifd(data, ifd1_offset, endian)[0] if ifd1_offset else {}
+    thumbnail = None
+    start, length = ifd1.get(THUMB_OFFSET), ifd1.get(THUMB_LENGTH)
+    if base is not None and start and length:
+        thumbnail = (base + start, length)
+    iso = exif.get(ISO)
+    return ImageMetadata(
+        orientation=ifd0.get(ORIENTATION, 1),
+        capture_time=_parse_time(exif.get(DATETIME_ORIGINAL)) or _parse_time(ifd0.get(DATETIME)),
+        make=ifd0.get(MAKE),
+        model=ifd0.get(MODEL),
+        lens=exif.get(LENS_MODEL),
+        focal_length=exif.get(FOCAL_LENGTH),
+        exposure_time=exif.get(EXPOSURE_TIME),
+        f_number=exif.get(F_NUMBER),
+        iso=iso if iso else None,
+        thumbnail=thumbnail,
+    )
+
+
+def _jpeg_exif(f):
+    # JPEGのマーカーをSOSまでたどり、APP1のEXIF(TIFF部分)とそのファイル内の位置を返す
+    head = f.read(JPEG_HEAD)
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF:
+            return None, None
+        marker = head[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):
+            return None, None
+        length = struct.unpack('>H', head[pos + 2:pos + 4])[0]
+        if marker == 0xE1 and head[pos + 4:pos + 10] == b'Exif\x00\x00':
+            start = pos + 10
+            data = head[start:pos + 2 + length]
+            if len(data) < length - 8:
+                f.seek(start)
+                data = f.read(length - 8)
+            return data, start
+        pos += 2 + length
+    return None, None
+
+
+def read_metadata(path):
+    # 画素をデコードせずにヘッダーから撮影情報を読み取る（読めなければ空のImageMetadata）
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(4)
+            f.seek(0)
+            if magic[:2] == b'\xff\xd8':
+                data, base = _jpeg_exif(f)
+                return parse_tiff(data, base) if data else ImageMetadata()
+            if magic[:2] in (b'II', b'MM'):
+                # TIFF・TIFF形式のRAW（DNG・CR2・NEF・ARW・ORF・RW2など）
+                return parse_tiff(f.read(TIFF_HEAD), 0)
+        if is_raw(path):
+            return ImageMetadata()
+        # HEIC・PNG・WebPなどはPillow（pillow-heif）でヘッダーだけ開いてEXIFを取り出す
+        data = open_image(path).info.get('exif') or b''
+        start = min((i for i in (data.find(b'II*\x00'), data.find(b'MM\x00*')) if i >= 0), default=-1)
+        return parse_tiff(data[start:]) if 0 <= start <= 16 else ImageMetadata()
+    except Exception:
+        return ImageMetadata()
+
+
+def read_thumbnail(path, metadata):
+    # 埋め込みサムネイル（JPEG）を返す。無ければNone
+    if not metadata.thumbnail:
+        return None
+    start, length = metadata.thumbnail
+    try:
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(length)
+        if data[:2] != b'\xff\xd8':
+            return None
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return apply_orientation(img, metadata.orientation)
+    except Exception:
+        return None
+
+
+def apply_orientation(img, orientation):
+    # EXIFの向きに従って回転・反転する（縮小済みの画像に使えばデコードし直さない）
+    method = ORIENTATION_TRANSPOSE.get(orientation)
+    return img.transpose(method) if method is not None else img
+
+
+def oriented_size(size, orientation):
+    # 向きを直した後の(幅, 高さ)（90度回転を含む向きは縦横が入れ替わる。逆変換も同じ）
+    return (size[1], size[0]) if orientation in (5, 6, 7, 8) else tuple(size)
+
+
+def source_box(box, size, orientation):
+    # 向きを直した画像上の範囲boxを、元ファイル（sizeは元ファイルの大きさ）上の範囲に変換する
+    left, top, right, bottom = box
+    w, h = size
+    if orientation == 2:
+        return (w - right, top, w - left, bottom)
+    if orientation == 3:
+        return (w - right, h - bottom, w - left, h - top)
+    if orientation == 4:
+        return (left, h - bottom, right, h - top)
+    if orientation == 5:
+        return (top, left, bottom, right)
+    if orientation == 6:
+        return (top, h - right, bottom, h - left)
+    if orientation == 7:
+        return (w - bottom, h - right, w - top, h - left)
+    if orientation == 8:
+        return (w - bottom, left, w - top, right)
+    return tuple(box)
+
+
+# 絞り込み条件で使える項目（camera・lensは文字列、それ以外は数値。captureは2024-05-01のような日付も書ける）
+TEXT_FIELDS = ('camera', 'lens')
+FILTER_FIELDS = {
+    'shutter': 'exposure_time',
+    'aperture': 'f_number',
+    'iso': 'iso',
+    'focal': 'focal_length',
+    'capture': 'capture_time',
+    'camera': 'camera',
+    'lens': 'lens',
+}
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y:%m:%d %H:%M:%S')
+FILTER_OPS = {'<=': operator.le, '>=': operator.ge, '!=': operator.ne, '<': operator.lt, '>': operator.gt,
+              '=': operator.eq}
+_CONDITION = re.compile(r'^\s*(\w+)\s*(<=|>=|!=|<|>|=)\s*(.+?)\s*$')
+
+
+def _filter_value(text):
+    # 1/60のような分数、数値、日付（ローカル時刻のタイムスタンプ）、それ以外は文字列
+    try:
+        if '/' in text:
+            num, den = text.split('/', 1)
+            return float(num) / float(den)
+        return float(text)
+    except (ValueError, ZeroDivisionError):
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            pass
+    return text.strip('\'"')
+
+
+def parse_filter(text, fields=FILTER_FIELDS):
+    # 「shutter > 1/60, iso >= 1600」のような絞り込み条件（カンマ区切りはすべて満たすもの）を解析する
+    # 戻り値は[(属性名, 比較関数, 値), ...]。書式が正しくなければValueError
+    # fieldsで使える項目（条件の名前 → 属性名）を差し替えられる
+    conditions = []
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        m = _CONDITION.match(part)
+        if not m or m.group(1).lower() not in fields:
+            raise ValueError(f'invalid filter: {part.strip()}')
+        field = m.group(1).lower()
+        value = _filter_value(m.group(3))
+        if isinstance(value, str) and field not in TEXT_FIELDS:
+            raise ValueError(f'invalid number: {part.strip()}')
+        conditions.append((fields[field], FILTER_OPS[m.group(2)], value))
+    return conditions
+
+
+def matches(metadata, conditions):
+    # すべての条件を満たすか（項目が無い画像は満たさない。文字列は大文字小文字を区別しない）
+    for attr, op, value in conditions:
+        actual = getattr(metadata, attr)
+        if actual is None:
+            return False
+        if isinstance(value, str):
+            if op not in (operator.eq, operator.ne):
+                return False
+            if op(str(actual).lower(), value.lower()):
+                continue
+            return False
+        if isinstance(actual, str) or not op(actual, value):
+            return False
+    return True
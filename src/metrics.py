@@ -0,0 +1,160 @@
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# 区間ごとに直近何回分の所要時間から中央値・p99を出すか
+RECENT = 256
+
+
+def _percentile(ordered, q):
+    return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+
+class SpanStats:
+    __slots__ = ('count', 'total_ns', 'max_ns', 'recent')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.recent = deque(maxlen=RECENT)
+
+
+class Metrics:
+    # 処理区間の所要時間・回数（カウンター）・値（キューの長さなど）を記録する
+    # 記録はperf_counter_nsとロック1回だけの軽い処理。enabled=Falseなら何も記録しない
+    # 区間と値の変化はトレースとしてtrace_limit件まで保持し、JSON Lines・Chromeのトレース形式で書き出せる
+    def __init__(self, enabled=True, trace_limit=100000):
+        self.enabled = enabled
+        self.origin = time.perf_counter_ns()
+        self.spans = {}
+        self.counters = {}
+        self.gauges = {}
+        self.events = deque(maxlen=trace_limit)
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter_ns() - start)
+
+    def record(self, name, start_ns, duration_ns):
+        thread = threading.current_thread()
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.count += 1
+            stats.total_ns += duration_ns
+            stats.max_ns = max(stats.max_ns, duration_ns)
+            stats.recent.append(duration_ns)
+            self.threads[thread.ident] = thread.name
+            self.events.append(('span', name, start_ns - self.origin, duration_ns, thread.ident))
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.gauges.get(name) != value:
+                self.gauges[name] = value
+                self.events.append(('gauge', name, time.perf_counter_ns() - self.origin, value, None))
+
+    def hit_rate(self, prefix):
+        # prefix.hit / (prefix.hit + prefix.miss)。まだ1回も無ければNone
+        hits = self.counters.get(f'{prefix}.hit', 0)
+        total = hits + self.counters.get(f'{prefix}.miss', 0)
+        return hits / total if total else None
+
+    def summary(self):
+        # {区間名: {count, mean_ms, p50_ms, p99_ms, max_ms}}（p50・p99は直近RECENT回分）
+        with self._lock:
+            items = [(name, s.count, s.total_ns, s.max_ns, sorted(s.recent)) for name, s in self.spans.items()]
+        return {name: {
+            'count': count,
+            'mean_ms': total / count / 1e6,
+            'p50_ms': _percentile(recent, 50) / 1e6,
+            'p99_ms': _percentile(recent, 99) / 1e6,
+            'max_ms': max_ns / 1e6,
+        } for name, count, total, max_ns, recent in items}
+
+    def format_table(self):
+        # HUD用の表（区間ごとの回数・中央値・p99、カウンター、値）
+        lines = [f'{"":22}{"n":>6}{"p50":>8}{"p99":>8}']
+        for name, s in sorted(self.summary().items()):
+            lines.append(f'{name:22}{s["count"]:6d}{s["p50_ms"]:8.1f}{s["p99_ms"]:8.1f}')
+        with self._lock:
+            values = sorted(self.counters.items()) + sorted(self.gauges.items())
+        lines += [f'{name:22}{value:>22}' for name, value in values]
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+            self.gauges.clear()
+            self.events.clear()
+
+    def export(self, path):
+        # 拡張子が.jsonならChromeのトレース形式（chrome://tracing・Perfettoで開ける）、それ以外はJSON Lines
+        with open(path, 'w', encoding='utf-8') as f:
+            if os.path.splitext(path)[1].lower() == '.json':
+                self.export_chrome(f)
+            else:
+                self.export_jsonl(f)
+
+    def export_jsonl(self, f):
+        # 1行1イベント（時刻・所要時間はms）。最後の行に回数（カウンター）をまとめて書く
+        with self._lock:
+            events, threads, counters = list(self.events), dict(self.threads), dict(self.counters)
+        for kind, name, ts, value, tid in events:
+            if kind == 'span':
+                record = {'type': kind, 'name': name, 'ts_ms': ts / 1e6, 'dur_ms': value / 1e6,
+                          'thread': threads.get(tid, str(tid))}
+            else:
+                record = {'type': kind, 'name': name, 'ts_ms': ts / 1e6, 'value': value}
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.write(json.dumps({'type': 'counters', 'values': counters}, ensure_ascii=False) + '\n')
+
+    def export_chrome(self, f):
+        # Trace Event Format（区間は"X"、値は"C"のイベント。時刻はμs）
+        with self._lock:
+            events, threads = list(self.events), dict(self.threads)
+        pid = os.getpid()
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                 for tid, name in threads.items()]
+        for kind, name, ts, value, tid in events:
+            if kind == 'span':
+                trace.append({'name': name, 'cat': 'picsel', 'ph': 'X', 'ts': ts / 1e3, 'dur': value / 1e3,
+                              'pid': pid, 'tid': tid})
+            else:
+                trace.append({'name': name, 'ph': 'C', 'ts': ts / 1e3, 'pid': pid, 'args': {'value': value}})
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+
+def timed(name):
+    # メソッドの実行時間をself.metricsに記録するデコレーター
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.span(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorate
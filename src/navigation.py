@@ -0,0 +1,42 @@
+import time
+
+
+class Navigator:
+    # キー送りの移動先をまとめ、送りが続いている（スクロール中）かを判断する
+    # キーを押し続けると移動のたびに呼ばれるが、表示は溜まった移動をまとめて最後の移動先だけ行う
+    # Tkには依存しない（表示の予約はmoveの戻り値を見て呼び出し側が行う）
+    def __init__(self, settle_seconds=0.15, clock=time.monotonic):
+        self.settle_seconds = settle_seconds
+        self.clock = clock
+        self.target = None
+        self.direction = 1
+        self.last_move = None
+        self.pending = False
+        self.coalesced = 0
+
+    def move(self, index):
+        # 移動先を記録する。表示の予約が必要（まだ予約されていない）ならTrue
+        if self.target is not None and index != self.target:
+            self.direction = 1 if index > self.target else -1
+        self.target = index
+        self.last_move = self.clock()
+        if self.pending:
+            self.coalesced += 1
+            return False
+        self.pending = True
+        return True
+
+    def take(self):
+        # 予約された表示を実行するときに呼び、表示する移動先を返す
+        self.pending = False
+        return self.target
+
+    def scrolling(self):
+        # 最後の移動からsettle_seconds以内ならスクロール中
+        return self.last_move is not None and self.clock() - self.last_move < self.settle_seconds
+
+    def settle_delay(self):
+        # スクロールが止まったとみなせるまでの残り時間（秒）
+        if self.last_move is None:
+            return 0.0
+        return max(0.0, self.settle_seconds - (self.clock() - self.last_move))
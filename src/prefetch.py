@@ -0,0 +1,179 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+from metrics import Metrics
+
+
+def image_nbytes(img):
+    # 画像1枚あたりのおおよそのメモリ使用量（バイト）
+    if img is None:
+        return 0
+    nbytes = getattr(img, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    try:
+        return img.width * img.height * len(img.getbands())
+    except Exception:
+        return 0
+
+
+class LRUImageCache:
+    # バイト数上限付きのLRUキャッシュ（ワーカースレッドからも使用するためロック付き）
+    def __init__(self, max_bytes, sizeof=image_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.nbytes += size
+            # 上限を超えた分は古いものから破棄
+            while self.nbytes > self.max_bytes:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self.nbytes -= old_size
+
+    def pop(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            value, size = self._items.pop(key)
+            self.nbytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def keys(self):
+        with self._lock:
+            return list(self._items)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+class PrefetchEngine:
+    # 前後の画像をワーカースレッドで先読みし、LRUキャッシュに保持する
+    # metricsを渡すとキャッシュのヒット・待ち・読み込みの回数と未完了の件数を記録する
+    # 読み込み中に対象外になったキーは、loaderがstale()を見て途中でやめられる
+    def __init__(self, loader, cache_bytes, workers=2, metrics=None):
+        self.loader = loader
+        self.metrics = metrics or Metrics(enabled=False)
+        self.cache = LRUImageCache(cache_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='prefetch')
+        self._futures = {}
+        self._wanted = set()
+        self._local = threading.local()
+        # Futureの完了コールバックがロック保持中に同じスレッドで呼ばれることがあるためRLock
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        # キャッシュにあれば即返す。読み込み中なら完了を待つ。どちらでもなければその場で読み込む
+        img = self.cache.get(key)
+        if img is not None:
+            self.metrics.count('prefetch.hit')
+            return img
+        self.metrics.count('prefetch.miss')
+        with self._lock:
+            future = self._futures.get(key)
+        if future is not None:
+            try:
+                with self.metrics.span('prefetch.wait'):
+                    img = future.result()
+            except CancelledError:
+                img = None
+            if img is not None:
+                return img
+        img = self.loader(key)
+        if img is not None:
+            self.cache.put(key, img)
+        return img
+
+    def schedule(self, keys):
+        # keysは優先度順。範囲外になった未着手の読み込みは取り消す
+        wanted = set(keys)
+        with self._lock:
+            self._wanted = wanted
+            for key, future in list(self._futures.items()):
+                if key not in wanted and future.cancel():
+                    self._futures.pop(key, None)
+            for key in keys:
+                if key in self._futures or key in self.cache:
+                    continue
+                try:
+                    future = self._executor.submit(self._load, key)
+                except RuntimeError:
+                    # shutdown済み
+                    break
+                self._futures[key] = future
+                future.add_done_callback(lambda f, k=key: self._discard(k, f))
+            self.metrics.gauge('prefetch.queue', len(self._futures))
+
+    def _load(self, key):
+        self._local.key = key
+        try:
+            img = self.loader(key)
+        finally:
+            self._local.key = None
+        if img is not None:
+            self.cache.put(key, img)
+        return img
+
+    def stale(self):
+        # ワーカースレッドで読み込み中のキーが、その後のscheduleで対象外になったらTrue
+        # （getから直接呼ばれた読み込みは常にFalse）
+        key = getattr(self._local, 'key', None)
+        with self._lock:
+            stale = key is not None and key not in self._wanted
+        if stale:
+            self.metrics.count('prefetch.abandoned')
+        return stale
+
+    def _discard(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+            self.metrics.gauge('prefetch.queue', len(self._futures))
+
+    def loading(self, key):
+        # keyを読み込み中（未着手を含む）ならTrue
+        with self._lock:
+            return key in self._futures
+
+    def pending(self):
+        with self._lock:
+            return len(self._futures)
+
+    def clear(self):
+        with self._lock:
+            for future in list(self._futures.values()):
+                future.cancel()
+            self._futures.clear()
+            self._wanted = set()
+        self.cache.clear()
+
+    def shutdown(self):
+        self.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
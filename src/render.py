@@ -0,0 +1,248 @@
+import functools
+from collections import OrderedDict
+from PIL import Image, ImageDraw, ImageFont
+
+FILTERS = {
+    'nearest': Image.NEAREST,
+    'box': Image.BOX,
+    'bilinear': Image.BILINEAR,
+    'hamming': Image.HAMMING,
+    'bicubic': Image.BICUBIC,
+    'lanczos': Image.LANCZOS,
+}
+
+# 拡大図・ラベルの枠の色と太さ
+FRAME_COLOR = 'red'
+FRAME_WIDTH = 3
+# 比較表示で選択中の画像の枠の色
+SELECTED_COLOR = 'yellow'
+# 一覧表示の判定の色（保存・削除）と背景色
+KEEP_COLOR = 'lime'
+DELETE_COLOR = 'red'
+CELL_BACKGROUND = (40, 40, 40)
+
+
+def resample_filter(name):
+    try:
+        return FILTERS[name.lower()]
+    except KeyError:
+        raise ValueError(f'unknown resize filter: {name}') from None
+
+
+def fit_size(size, bounds):
+    # アスペクト比を保ったままboundsに収まる最大のサイズ
+    scale = min(bounds[0] / size[0], bounds[1] / size[1])
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def pick_level(pyramid, size):
+    # size以上の解像度を持つ最も小さい段（どの段も足りなければ最大の段）
+    for level in reversed(pyramid):
+        if level.width >= size[0] and level.height >= size[1]:
+            return level
+    return pyramid[0]
+
+
+@functools.lru_cache(maxsize=None)
+def label_font(size=32):
+    # フォントはディスクから1回だけ読み込む
+    try:
+        return ImageFont.truetype('arial.ttf', size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+@functools.lru_cache(maxsize=None)
+def blur_label():
+    # 「Blur」ラベルの画像（1回だけ作成）
+    label = Image.new('RGB', (100, 40), (255, 255, 255))
+    ImageDraw.Draw(label).text((5, 5), 'Blur', fill=FRAME_COLOR, font=label_font())
+    return label
+
+
+@functools.lru_cache(maxsize=4)
+def blank_cell(cell):
+    # 一覧表示のセルの下地（セルの大きさごとに1回だけ作成し、コピーして使う）
+    return Image.new('RGB', (cell, cell), CELL_BACKGROUND)
+
+
+@functools.lru_cache(maxsize=None)
+def small_blur_label():
+    # 一覧表示用の小さい「Blur」ラベル
+    label = Image.new('RGB', (36, 18), (255, 255, 255))
+    ImageDraw.Draw(label).text((3, 2), 'Blur', fill=FRAME_COLOR, font=label_font(12))
+    return label
+
+
+class Renderer:
+    # 表示用バッファにレイヤー（縮小画像・拡大枠・拡大図・ぼやけラベル）を重ねて描画する
+    # 縮小した画像に直接描き込むのでコピーは作らない。拡大図と描画結果は画像ごとにキャッシュする
+    # fast=Trueの描画（連続して送っている間）は軽いフィルタで縮小する
+    def __init__(self, zoom_range, zoom_scale, filter='lanczos', fast_filter='bilinear',
+                 cache_size=8, margin=60):
+        self.zoom_range = zoom_range
+        self.zoom_scale = zoom_scale
+        self.filter = resample_filter(filter)
+        self.fast_filter = resample_filter(fast_filter)
+        self.cache_size = max(1, cache_size)
+        self.margin = margin
+        self._insets = OrderedDict()
+        self._renders = OrderedDict()
+        self._bases = OrderedDict()
+        self._scratch = OrderedDict()
+
+    def _cache_get(self, cache, key, frame, params=None):
+        entry = cache.get(key)
+        if entry is None or entry[0] is not frame or entry[1] != params:
+            return None
+        cache.move_to_end(key)
+        return entry[2]
+
+    def _cache_put(self, cache, key, frame, params, value):
+        cache[key] = (frame, params, value)
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def scratch_copy(self, slot, img):
+        # imgを写した作業用バッファ。同じslotで同じ大きさなら前回のバッファに上書きして使い回す
+        # （ルーペを動かすたびに表示サイズのバッファを確保し直さない。返した画像は同じslotの次の呼び出しまで有効）
+        buf = self._scratch.get(slot)
+        if buf is None or buf.size != img.size or buf.mode != img.mode:
+            buf = img.copy()
+        else:
+            buf.paste(img)
+        self._scratch[slot] = buf
+        self._scratch.move_to_end(slot)
+        while len(self._scratch) > self.cache_size:
+            self._scratch.popitem(last=False)
+        return buf
+
+    def resize(self, img, bounds, fast=False, pyramid=None):
+        # 縮小画像のレイヤー。アスペクト比を保ってboundsに収め、ピラミッドの最も近い段から縮小する
+        # （resizeは新しいバッファを返すのでそのまま描き込める）
+        size = fit_size(img.size, bounds)
+        src = pick_level(pyramid or [img], size)
+        return src.resize(size, self.fast_filter if fast else self.filter)
+
+    def inset(self, key, frame):
+        # 拡大図のレイヤー（元解像度の切り出しを拡大し、枠を付けたもの）
+        inset = self._cache_get(self._insets, key, frame)
+        if inset is None:
+            side = self.zoom_range * 2 * self.zoom_scale
+            inset = frame.zoom.resize((side, side), Image.LANCZOS)
+            ImageDraw.Draw(inset).rectangle([0, 0, side - 1, side - 1], outline=FRAME_COLOR, width=FRAME_WIDTH)
+            self._cache_put(self._insets, key, frame, None, inset)
+        return inset
+
+    def draw_box(self, img, frame, box):
+        # 元画像上の範囲boxを表示サイズに換算して枠を描く。換算した範囲を返す
+        scale_x = img.width / frame.original_size[0]
+        scale_y = img.height / frame.original_size[1]
+        rect = [box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y]
+        ImageDraw.Draw(img).rectangle(rect, outline=FRAME_COLOR, width=FRAME_WIDTH)
+        return rect
+
+    def draw_zoom(self, img, key, frame, box):
+        # 拡大範囲の枠と拡大図をimgに直接描く
+        self.draw_box(img, frame, box)
+        inset = self.inset(key, frame)
+        # ボタン領域に重ならないように下部マージンを確保
+        pos = (img.width - inset.width - 10, max(img.height - inset.height - self.margin, 0))
+        img.paste(inset, pos)
+
+    def draw_loupe(self, img, frame, box, loupe):
+        # ルーペ（拡大した元解像度の範囲）を、範囲の中心に重ねて描く（画面外にははみ出さない）
+        rect = self.draw_box(img, frame, box)
+        cx, cy = (rect[0] + rect[2]) / 2, (rect[1] + rect[3]) / 2
+        x = int(min(max(cx - loupe.width / 2, 0), max(img.width - loupe.width, 0)))
+        y = int(min(max(cy - loupe.height / 2, 0), max(img.height - loupe.height, 0)))
+        img.paste(loupe, (x, y))
+        ImageDraw.Draw(img).rectangle([x, y, x + loupe.width - 1, y + loupe.height - 1],
+                                      outline=FRAME_COLOR, width=FRAME_WIDTH)
+
+    def draw_blur_label(self, img):
+        img.paste(blur_label(), (0, 0))
+
+    def render(self, key, frame, size, box, blur, fast=False):
+        # 表示する画像を返す。同じ画像・同じ条件の描画結果はキャッシュから返す
+        params = (tuple(size), tuple(box), blur, fast)
+        img = self._cache_get(self._renders, key, frame, params)
+        if img is not None:
+            return img
+        img = self.resize(frame.image, size, fast, frame.pyramid)
+        if frame.zoom is not None:
+            self.draw_zoom(img, key, frame, box)
+        if blur:
+            self.draw_blur_label(img)
+        self._cache_put(self._renders, key, frame, params, img)
+        return img
+
+    def base_layer(self, key, frame, size, blur, fast=False):
+        # 拡大図を除いた下地（縮小画像＋ぼやけラベル）。ルーペを動かしても作り直さない
+        params = (tuple(size), blur, fast)
+        img = self._cache_get(self._bases, key, frame, params)
+        if img is None:
+            img = self.resize(frame.image, size, fast, frame.pyramid)
+            if blur:
+                self.draw_blur_label(img)
+            self._cache_put(self._bases, key, frame, params, img)
+        return img
+
+    def render_loupe(self, key, frame, size, blur, box, loupe, fast=False):
+        # 下地のコピーにルーペを重ねた画像を返す（ルーペの位置は毎回変わるため結果はキャッシュしない）
+        img = self.scratch_copy('loupe', self.base_layer(key, frame, size, blur, fast))
+        self.draw_loupe(img, frame, box, loupe)
+        return img
+
+    def draw_caption(self, img, text, color='black'):
+        # 左下に文字を描く（シャープさの表示用）
+        font = label_font(20)
+        left, top, right, bottom = ImageDraw.Draw(img).textbbox((0, 0), text, font=font)
+        y = img.height - (bottom - top) - 12
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([0, y, right - left + 10, img.height], fill=(255, 255, 255))
+        draw.text((5 - left, y + 6 - top), text, fill=color, font=font)
+
+    def render_pane(self, key, frame, size, blur, box, loupe=None, caption='', selected=False, fast=False):
+        # 比較表示の1枚分。下地のコピーにルーペ（無ければ中央の拡大図）・シャープさ・選択枠を重ねる
+        img = self.scratch_copy(('pane', key), self.base_layer(key, frame, size, blur, fast))
+        if loupe is not None:
+            self.draw_loupe(img, frame, box, loupe)
+        elif frame.zoom is not None:
+            self.draw_zoom(img, key, frame, box)
+        if caption:
+            self.draw_caption(img, caption, FRAME_COLOR if blur else 'black')
+        if selected:
+            ImageDraw.Draw(img).rectangle([0, 0, img.width - 1, img.height - 1], outline=SELECTED_COLOR, width=4)
+        return img
+
+    def render_cell(self, thumb, cell, decision_color=None, blur=False, selected=False):
+        # 一覧表示の1セル。サムネイル（未読み込みならNone）を中央に置き、判定の枠・Blur・選択枠を重ねる
+        # （ファイル名は画像に描かず、キャンバスの文字として重ねる）
+        img = blank_cell(cell).copy()
+        inner = cell - 12
+        if thumb is not None:
+            if thumb.width > inner or thumb.height > inner:
+                thumb = thumb.resize(fit_size(thumb.size, (inner, inner)), self.fast_filter)
+            img.paste(thumb, ((cell - thumb.width) // 2, (cell - thumb.height) // 2))
+        draw = ImageDraw.Draw(img)
+        if decision_color:
+            draw.rectangle([3, 3, cell - 4, cell - 4], outline=decision_color, width=FRAME_WIDTH)
+        if blur:
+            img.paste(small_blur_label(), (6, 6))
+        if selected:
+            draw.rectangle([0, 0, cell - 1, cell - 1], outline=SELECTED_COLOR, width=2)
+        return img
+
+    def discard(self, key):
+        self._insets.pop(key, None)
+        self._renders.pop(key, None)
+        self._bases.pop(key, None)
+        self._scratch.pop(('pane', key), None)
+
+    def clear(self):
+        self._insets.clear()
+        self._renders.clear()
+        self._bases.clear()
+        self._scratch.clear()
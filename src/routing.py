@@ -0,0 +1,88 @@
+import os
+
+from fileops import KEEP_STRATEGIES
+from metadata import FILTER_FIELDS, ImageMetadata, matches, parse_filter
+
+# 振り分け条件で使える項目（撮影情報の項目に加えて、シャープさのスコアと評価）
+ROUTE_FIELDS = dict(FILTER_FIELDS, blur='blur', rating='rating')
+
+
+class Destination:
+    # 保存先の1つ。keyを押すと表示中の画像をfolderに保存する（strategyがNoneなら[keep] strategyを使う）
+    def __init__(self, name, key, folder, strategy=None):
+        self.name = name
+        self.key = key
+        self.folder = folder
+        self.strategy = strategy
+
+    def path(self, save_dir, fname):
+        # 相対パスのフォルダは保存先フォルダからの相対とする
+        return os.path.join(save_dir, self.folder, fname)
+
+
+def parse_destinations(items):
+    # [destinations]の「client = F1, D:/delivery/client, copy」（キー, フォルダ[, 保存方法]）を解析する
+    # 戻り値は{名前: Destination}（書いた順）。書式が正しくなければValueError
+    destinations = {}
+    for name, line in items:
+        parts = [p.strip() for p in line.split(',')]
+        strategy = None
+        if len(parts) > 2 and parts[-1].lower() in KEEP_STRATEGIES:
+            strategy = parts.pop().lower()
+        if len(parts) < 2 or not parts[0] or not parts[1]:
+            raise ValueError(f'invalid destination: {name} = {line}')
+        # フォルダ名にカンマがあってもよい
+        destinations[name] = Destination(name, parts[0], ', '.join(parts[1:]), strategy)
+    return destinations
+
+
+def destination_folders(save_dir, destinations):
+    # 保存先フォルダと各保存先のフォルダ（保存先フォルダが未選択なら絶対パスの保存先だけ）
+    folders = [save_dir] if save_dir else []
+    for destination in destinations.values():
+        if save_dir or os.path.isabs(destination.folder):
+            folders.append(os.path.join(save_dir, destination.folder))
+    return folders
+
+
+def parse_routes(items, destinations):
+    # [routes]の「print = blur >= 300, capture >= 2024-05-01」を解析する（上に書いたものほど優先）
+    # 戻り値は[(Destination, 条件), ...]。保存先が無い・条件が正しくなければValueError
+    routes = []
+    for name, text in items:
+        if name not in destinations:
+            raise ValueError(f'unknown destination: {name}')
+        routes.append((destinations[name], parse_filter(text, ROUTE_FIELDS)))
+    return routes
+
+
+class ImageFacts:
+    # 振り分けの判定に使う1枚分の情報（撮影情報にシャープさのスコアと評価を足したもの）
+    __slots__ = ('meta', 'blur', 'rating')
+
+    def __init__(self, meta, blur=None, rating=None):
+        self.meta = meta if meta is not None else ImageMetadata()
+        self.blur = blur
+        self.rating = rating
+
+    def __getattr__(self, name):
+        return getattr(self.meta, name)
+
+
+def route(facts, routes):
+    # 最初に条件を満たした保存先（どれも満たさなければNone）
+    for destination, conditions in routes:
+        if matches(facts, conditions):
+            return destination
+    return None
+
+
+def route_images(names, facts_of, routes):
+    # namesを保存先ごとにまとめる。戻り値は{Destination: [名前, ...]}（どこにも当てはまらない画像は含まない）
+    # facts_of(名前)はImageFacts（撮影情報の読み込みはここで1枚ずつ行われる）
+    routed = {}
+    for name in names:
+        destination = route(facts_of(name), routes)
+        if destination is not None:
+            routed.setdefault(destination, []).append(name)
+    return routed
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+
+KEEP = 'keep'
+DELETE = 'delete'
+UNRATED = 'unrated'
+DECISIONS = (KEEP, DELETE, UNRATED)
+
+SESSION_NAME = 'picsel_session.json'
+
+
+def file_stamp(path):
+    # 削除マークしたときのファイルの(サイズ, 更新日時ns)。読めなければNone
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class SessionStore:
+    # 画像ごとの判定（keep/delete/unrated）と評価(0〜5)、最後に表示した画像を保持する
+    # 削除マークにはマークしたときのファイルの(サイズ, 更新日時)も残し、削除する前に同じファイルか確かめられるようにする
+    # 変更はすぐにジャーナルへ1行ずつ追記し、一定件数ごとにスナップショットへまとめる
+    # pathがNoneの場合はメモリ上だけで保持する
+    def __init__(self, path=None, compact_every=500):
+        self.path = path
+        self.compact_every = compact_every
+        self.decisions = {}
+        self.stamps = {}
+        self.ratings = {}
+        self.position = None
+        self._journal = None
+        self._journal_lines = 0
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+            self._open_journal()
+
+    @property
+    def journal_path(self):
+        return os.path.splitext(self.path)[0] + '.journal'
+
+    @classmethod
+    def for_folder(cls, folder, compact_every=500):
+        return cls(os.path.join(folder, SESSION_NAME), compact_every)
+
+    def _load(self):
+        # スナップショットを読み込み、その後のジャーナルを再生する
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.decisions = dict(data.get('decisions', {}))
+            self.stamps = {name: tuple(stamp) for name, stamp in data.get('stamps', {}).items()}
+            self.ratings = dict(data.get('ratings', {}))
+            self.position = data.get('position')
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        # 書き込み途中で終了した行は無視する
+                        continue
+                    self._journal_lines += 1
+        except OSError:
+            pass
+
+    def _open_journal(self):
+        self._journal = open(self.journal_path, 'ab+')
+        # 途中で途切れた行があれば改行で区切ってから追記する
+        size = self._journal.seek(0, os.SEEK_END)
+        if size > 0:
+            self._journal.seek(size - 1)
+            if self._journal.read(1) != b'\n':
+                self._journal.write(b'\n')
+
+    def _apply(self, record):
+        name = record.get('n')
+        if 'd' in record:
+            if record['d'] == UNRATED:
+                self.decisions.pop(name, None)
+            elif record['d'] in DECISIONS:
+                self.decisions[name] = record['d']
+            if record['d'] == DELETE and record.get('s'):
+                self.stamps[name] = tuple(record['s'])
+            else:
+                self.stamps.pop(name, None)
+        elif 'r' in record:
+            if record['r']:
+                self.ratings[name] = int(record['r'])
+            else:
+                self.ratings.pop(name, None)
+        elif 'p' in record:
+            self.position = record['p']
+
+    def _record(self, record):
+        with self._lock:
+            self._apply(record)
+            if self._journal is None:
+                return
+            self._journal.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+            self._journal.flush()
+            self._journal_lines += 1
+            if self._journal_lines >= self.compact_every:
+                self._compact()
+
+    def _compact(self):
+        # 現在の状態をスナップショットに書き出し、ジャーナルを空にする
+        data = {'decisions': self.decisions, 'stamps': self.stamps, 'ratings': self.ratings, 'position': self.position}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._journal.seek(0)
+        self._journal.truncate()
+        self._journal_lines = 0
+
+    def decision(self, name):
+        return self.decisions.get(name, UNRATED)
+
+    def stamp(self, name):
+        # 削除マークしたときの(サイズ, 更新日時ns)（記録が無ければNone）
+        return self.stamps.get(name)
+
+    def set_decision(self, name, decision, stamp=None):
+        # stampは削除マークのときだけ記録する（file_stampの値）
+        if decision not in DECISIONS:
+            raise ValueError(f'unknown decision: {decision}')
+        stamp = tuple(stamp) if stamp and decision == DELETE else None
+        if self.decision(name) != decision or self.stamp(name) != stamp:
+            record = {'n': name, 'd': decision}
+            if stamp:
+                record['s'] = list(stamp)
+            self._record(record)
+
+    def rating(self, name):
+        return self.ratings.get(name, 0)
+
+    def set_rating(self, name, rating):
+        if not 0 <= rating <= 5:
+            raise ValueError(f'rating must be 0-5: {rating}')
+        if self.rating(name) != rating:
+            self._record({'n': name, 'r': rating})
+
+    def set_position(self, name):
+        if self.position != name:
+            self._record({'p': name})
+
+    def names_with(self, decision):
+        # 判定がdecisionの画像名（判定した順）
+        return [name for name, d in self.decisions.items() if d == decision]
+
+    def compact(self):
+        with self._lock:
+            if self._journal is not None:
+                self._compact()
+
+    def close(self):
+        # スナップショットにまとめてジャーナルを閉じる
+        with self._lock:
+            if self._journal is None:
+                return
+            self._compact()
+            self._journal.close()
+            self._journal = None
@@ -0,0 +1,109 @@
+from PIL import Image
+
+# numpyは起動を速くするため、最初に解析するとき（各関数の中）で読み込む
+
+# 解析用の輝度バッファの長辺（px）。カメラの画素数に関わらずこの解像度で評価する
+DEFAULT_ANALYSIS_SIZE = 1024
+
+
+def luminance(img, size=DEFAULT_ANALYSIS_SIZE):
+    # 長辺をsizeに縮小した輝度(float32)を返す。元画像より大きくはしない
+    import numpy as np
+    gray = img.convert('L')
+    scale = size / max(gray.width, gray.height)
+    if scale < 1:
+        target = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(target, Image.BOX)
+    return np.asarray(gray, dtype=np.float32)
+
+
+# 以下の評価関数は(..., H, W)の配列を受け取り、末尾2軸について評価した(...)の配列を返す
+def laplacian_variance(arr):
+    # 4近傍ラプラシアンの分散
+    lap = (arr[..., :-2, 1:-1] + arr[..., 2:, 1:-1] + arr[..., 1:-1, :-2] + arr[..., 1:-1, 2:]
+           - 4 * arr[..., 1:-1, 1:-1])
+    return lap.var(axis=(-2, -1))
+
+
+def tenengrad(arr):
+    # Sobel勾配の二乗平均
+    p = arr
+    gx = (p[..., :-2, 2:] + 2 * p[..., 1:-1, 2:] + p[..., 2:, 2:]
+          - p[..., :-2, :-2] - 2 * p[..., 1:-1, :-2] - p[..., 2:, :-2])
+    gy = (p[..., 2:, :-2] + 2 * p[..., 2:, 1:-1] + p[..., 2:, 2:]
+          - p[..., :-2, :-2] - 2 * p[..., :-2, 1:-1] - p[..., :-2, 2:])
+    return (gx * gx + gy * gy).mean(axis=(-2, -1))
+
+
+def fft_energy(arr, cutoff=0.25):
+    # 全周波数エネルギーに対する高周波成分(ナイキストのcutoff倍より上)の割合を1000倍した値
+    import numpy as np
+    spec = np.abs(np.fft.rfft2(arr - arr.mean(axis=(-2, -1), keepdims=True))) ** 2
+    fy = np.abs(np.fft.fftfreq(arr.shape[-2]))[:, None]
+    fx = np.fft.rfftfreq(arr.shape[-1])[None, :]
+    high = np.sqrt(fx * fx + fy * fy) > cutoff * 0.5
+    total = spec.sum(axis=(-2, -1))
+    return 1000.0 * (spec * high).sum(axis=(-2, -1)) / np.maximum(total, 1e-6)
+
+
+METRICS = {
+    'laplacian': laplacian_variance,
+    'tenengrad': tenengrad,
+    'fft': fft_energy,
+}
+
+
+def register_metric(name, func):
+    # 評価関数を追加する（funcは(..., H, W)→(...)の配列を返すこと）
+    METRICS[name] = func
+
+
+def split_tiles(arr, tiles):
+    # (..., H, W)を(..., tiles, tiles, h, w)のタイルに分割する（端数は切り捨て）
+    import numpy as np
+    h, w = arr.shape[-2] // tiles, arr.shape[-1] // tiles
+    arr = arr[..., :h * tiles, :w * tiles]
+    arr = arr.reshape(*arr.shape[:-2], tiles, h, tiles, w)
+    return np.swapaxes(arr, -3, -2)
+
+
+class SharpnessEngine:
+    # 縮小した輝度バッファでシャープさを評価する（値が大きいほどシャープ）
+    # tiles>1の場合は画面をtiles×tilesに分割し、最もシャープなタイルの値を採用する
+    # （被写界深度が浅く背景がぼけた写真をぼやけと判定しないため）
+    def __init__(self, metric='laplacian', size=DEFAULT_ANALYSIS_SIZE, tiles=1):
+        if metric not in METRICS:
+            raise ValueError(f'unknown sharpness metric: {metric}')
+        self.metric = metric
+        self.size = size
+        self.tiles = max(1, tiles)
+
+    @property
+    def signature(self):
+        # 評価条件を表す文字列（キャッシュした値の互換性判定に使う）
+        return f'{self.metric}/{self.size}/{self.tiles}'
+
+    def evaluate(self, arr):
+        # 輝度配列(..., H, W)を評価する
+        func = METRICS[self.metric]
+        if self.tiles == 1 or min(arr.shape[-2:]) < self.tiles * 8:
+            return func(arr)
+        values = func(split_tiles(arr, self.tiles))
+        return values.max(axis=(-2, -1))
+
+    def score(self, img):
+        return float(self.evaluate(luminance(img, self.size)))
+
+    def score_batch(self, imgs):
+        # 複数画像をまとめて評価する。同じ大きさの輝度バッファは1つの配列に積んで一括計算
+        import numpy as np
+        lums = [luminance(img, self.size) for img in imgs]
+        scores = [0.0] * len(lums)
+        groups = {}
+        for i, lum in enumerate(lums):
+            groups.setdefault(lum.shape, []).append(i)
+        for indices in groups.values():
+            values = self.evaluate(np.stack([lums[i] for i in indices]))
+            for i, value in zip(indices, values):
+                scores[i] = float(value)
+        return scores
@@ -0,0 +1,153 @@
+from PIL import Image
+
+from decode import load_scaled
+
+# numpyは起動を速くするため、最初にハッシュを計算するとき（各関数の中）で読み込む
+
+HASH_METHODS = ('dhash', 'phash')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _bits(flags):
+    value = 0
+    for flag in flags.ravel():
+        value = (value << 1) | int(flag)
+    return value
+
+
+def dhash(img, size=8):
+    # 隣り合う画素の明るさの大小を並べた(size*size)ビットのハッシュ
+    import numpy as np
+    gray = img.convert('L').resize((size + 1, size), Image.BOX)
+    arr = np.asarray(gray, dtype=np.int16)
+    return _bits(arr[:, 1:] > arr[:, :-1])
+
+
+def _dct_matrix(n):
+    import numpy as np
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    m[0] /= np.sqrt(2)
+    return m * np.sqrt(2 / n)
+
+
+def phash(img, size=8, scale=4):
+    # 縮小画像のDCT低周波成分が中央値より大きいかを並べた(size*size)ビットのハッシュ
+    import numpy as np
+    n = size * scale
+    arr = np.asarray(img.convert('L').resize((n, n), Image.BOX), dtype=np.float64)
+    m = _dct_matrix(n)
+    low = (m @ arr @ m.T)[:size, :size]
+    # 直流成分は明るさだけを表すので中央値の計算から除く
+    return _bits(low > np.median(low.ravel()[1:]))
+
+
+def image_hash(img, method='dhash'):
+    if method == 'dhash':
+        return dhash(img)
+    if method == 'phash':
+        return phash(img)
+    raise ValueError(f'unknown hash method: {method}')
+
+
+def hash_files(paths, method):
+    # プロセスプールのワーカーで実行される。最小限の解像度でデコードしてハッシュを計算する
+    # 戻り値は[(path, hash), ...]（読み込めなかったファイルはNone）
+    results = []
+    for path in paths:
+        try:
+            img, _ = load_scaled(path, (64, 64))
+            results.append((path, image_hash(img, method)))
+        except Exception:
+            results.append((path, None))
+    return results
+
+
+class MultiIndexHash:
+    # ハミング距離radius以内のハッシュを探すための多重インデックス
+    # ハッシュをradius+1個の区間に分けると、距離radius以内の2つは必ずどれかの区間が完全に一致する
+    # （鳩の巣原理）ため、区間ごとの辞書で候補を引いてから距離を確かめる
+    def __init__(self, radius, bits=64):
+        self.radius = radius
+        n = radius + 1
+        edges = [bits * i // n for i in range(n + 1)]
+        self.chunks = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+        self.tables = [{} for _ in self.chunks]
+        self.size = 0
+
+    def add(self, value, item):
+        entry = (value, item)
+        for (shift, mask), table in zip(self.chunks, self.tables):
+            table.setdefault((value >> shift) & mask, []).append(entry)
+        self.size += 1
+
+    def search(self, value, radius=None):
+        # 距離radius（省略時は作成時のradius）以内の(距離, 値)を返す
+        radius = self.radius if radius is None else min(radius, self.radius)
+        found = {}
+        for (shift, mask), table in zip(self.chunks, self.tables):
+            for entry in table.get((value >> shift) & mask, ()):
+                if id(entry) not in found:
+                    found[id(entry)] = entry
+        result = []
+        for other, item in found.values():
+            d = hamming(value, other)
+            if d <= radius:
+                result.append((d, item))
+        return result
+
+    def __len__(self):
+        return self.size
+
+
+def group_bursts(names, hashes, threshold=10, window=3):
+    # 並び順で近く（window枚以内）かつハッシュが近い（距離threshold以下）画像を同じグループにまとめる
+    # 戻り値は[[名前, ...], ...]（並び順。ハッシュの無い画像は1枚のグループ）
+    parent = list(range(len(names)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, name in enumerate(names):
+        h = hashes.get(name)
+        if h is None:
+            continue
+        for j in range(max(0, i - window), i):
+            other = hashes.get(names[j])
+            if other is not None and hamming(h, other) <= threshold:
+                parent[find(i)] = find(j)
+    groups = {}
+    for i, name in enumerate(names):
+        groups.setdefault(find(i), []).append(name)
+    return list(groups.values())
+
+
+def near_duplicates(hashes, threshold=4):
+    # 並び順に関係なくハッシュが近い画像を多重インデックスで探してまとめる
+    # 戻り値は[[名前, ...], ...]（2枚以上のグループのみ）
+    index = MultiIndexHash(threshold)
+    parent = {}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for name, h in hashes.items():
+        if h is None:
+            continue
+        parent[name] = name
+        for _, other in index.search(h):
+            parent[find(name)] = find(other)
+        index.add(h, name)
+    groups = {}
+    for name in parent:
+        groups.setdefault(find(name), []).append(name)
+    return [group for group in groups.values() if len(group) > 1]
@@ -0,0 +1,76 @@
+import io
+import math
+from PIL import Image
+
+from decode import load_scaled
+from metadata import apply_orientation, read_metadata, read_thumbnail
+
+
+class GridLayout:
+    # 一覧表示のセルの配置。offsetは縦方向のスクロール位置（ピクセル）
+    # 画像の枚数に関係なく、見えている行のセルだけを計算する
+    def __init__(self, count, size, cell):
+        self.count = count
+        self.width, self.height = size
+        self.cell = max(1, cell)
+        self.columns = max(1, self.width // self.cell)
+        self.rows = math.ceil(count / self.columns)
+
+    @property
+    def max_offset(self):
+        return max(0, self.rows * self.cell - self.height)
+
+    def clamp(self, offset):
+        return min(max(int(offset), 0), self.max_offset)
+
+    def visible(self, offset):
+        # offsetで一部でも見えているセルの番号の範囲
+        first = offset // self.cell * self.columns
+        last = math.ceil((offset + self.height) / self.cell) * self.columns
+        return range(min(first, self.count), min(last, self.count))
+
+    def position(self, index, offset):
+        # セルの左上の表示位置（列の余りは左右に均等に配る）
+        margin = (self.width - self.columns * self.cell) // 2
+        row, col = divmod(index, self.columns)
+        return margin + col * self.cell, row * self.cell - offset
+
+    def index_at(self, x, y, offset):
+        # 表示位置(x, y)にあるセルの番号（セルが無ければNone）
+        margin = (self.width - self.columns * self.cell) // 2
+        col = (x - margin) // self.cell
+        if not 0 <= col < self.columns or y < 0:
+            return None
+        index = (y + offset) // self.cell * self.columns + col
+        return index if index < self.count else None
+
+    def centered(self, index):
+        # indexのセルが縦方向の中央に来るスクロール位置
+        return self.clamp(index // self.columns * self.cell - (self.height - self.cell) // 2)
+
+    def scroll_to(self, index, offset):
+        # indexのセルが全体が見えるようにしたスクロール位置（見えていればそのまま）
+        top = index // self.columns * self.cell
+        if top < offset:
+            return self.clamp(top)
+        if top + self.cell > offset + self.height:
+            return self.clamp(top + self.cell - self.height)
+        return self.clamp(offset)
+
+
+def load_thumbnail(path, size, analysis_cache=None):
+    # 一覧表示用にsize以内に縮めたサムネイル。速いものから順に使う
+    # EXIFの埋め込みサムネイル → 永続キャッシュの表示用プレビュー → 縮小デコード（HEICは埋め込みプレビュー、RAWは埋め込みJPEG）
+    meta = read_metadata(path)
+    img = read_thumbnail(path, meta)
+    if img is None and analysis_cache is not None:
+        entry = analysis_cache.lookup(path)
+        if entry and entry['preview']:
+            img = Image.open(io.BytesIO(entry['preview']))
+            img.draft('RGB', (size, size))
+    if img is None:
+        img, _ = load_scaled(path, (size, size))
+        img = apply_orientation(img, meta.orientation)
+    img = img.convert('RGB')
+    img.thumbnail((size, size), Image.BILINEAR)
+    return img
@@ -0,0 +1,74 @@
+import threading
+from PIL import Image
+
+from decode import load_regions
+from prefetch import LRUImageCache
+
+# 元解像度タイルの一辺（px）
+TILE_SIZE = 256
+
+
+class TileCache:
+    # 元解像度の画像をタイル単位で切り出して保持するLRUキャッシュ
+    # JPEGは範囲の下端までの行を全幅で復号するため、足りないタイルがあれば
+    # その行（上下halo行を含む）のタイルを横一列まとめて切り出しておく（左右に動かしてもデコードしない）
+    def __init__(self, max_bytes, tile_size=TILE_SIZE, halo=1):
+        self.tile_size = tile_size
+        self.halo = halo
+        self.cache = LRUImageCache(max_bytes)
+        self._lock = threading.Lock()
+
+    def tile_box(self, tx, ty, image_size):
+        t = self.tile_size
+        return (tx * t, ty * t, min((tx + 1) * t, image_size[0]), min((ty + 1) * t, image_size[1]))
+
+    def tiles_for(self, box, image_size, halo=0):
+        # box(left, upper, right, lower)に掛かるタイル番号(tx, ty)の一覧
+        t = self.tile_size
+        cols = (image_size[0] + t - 1) // t
+        rows = (image_size[1] + t - 1) // t
+        x0, y0 = max(box[0] // t - halo, 0), max(box[1] // t - halo, 0)
+        x1, y1 = min((box[2] - 1) // t + halo, cols - 1), min((box[3] - 1) // t + halo, rows - 1)
+        return [(tx, ty) for ty in range(y0, y1 + 1) for tx in range(x0, x1 + 1)]
+
+    def load(self, path, box, image_size):
+        # boxに必要なタイルをキャッシュに読み込み、{(tx, ty): タイル}で返す
+        needed = self.tiles_for(box, image_size)
+        tiles = {}
+        for tile in needed:
+            img = self.cache.get((path, *tile))
+            if img is not None:
+                tiles[tile] = img
+        if len(tiles) == len(needed):
+            return tiles
+        with self._lock:
+            # 足りないタイルの行と上下の行を1回のデコードで切り出す
+            band = (0, box[1], image_size[0], box[3])
+            todo = [tile for tile in self.tiles_for(band, image_size, self.halo)
+                    if tile not in tiles and (path, *tile) not in self.cache]
+            boxes = [self.tile_box(tx, ty, image_size) for tx, ty in todo]
+            for tile, img in zip(todo, load_regions(path, boxes) if boxes else []):
+                self.cache.put((path, *tile), img)
+                tiles[tile] = img
+        for tile in needed:
+            if tile not in tiles:
+                tiles[tile] = self.cache.get((path, *tile)) or \
+                    load_regions(path, [self.tile_box(*tile, image_size)])[0]
+        return {tile: tiles[tile] for tile in needed}
+
+    def region(self, path, box, image_size):
+        # 元解像度のbox範囲をタイルから組み立てて返す
+        box = (max(box[0], 0), max(box[1], 0), min(box[2], image_size[0]), min(box[3], image_size[1]))
+        out = Image.new('RGB', (max(box[2] - box[0], 1), max(box[3] - box[1], 1)))
+        t = self.tile_size
+        for (tx, ty), img in self.load(path, box, image_size).items():
+            out.paste(img, (tx * t - box[0], ty * t - box[1]))
+        return out
+
+    def discard(self, path):
+        for key in self.cache.keys():
+            if key[0] == path:
+                self.cache.pop(key)
+
+    def clear(self):
+        self.cache.clear()
@@ -0,0 +1,208 @@
+import pytest
+import os
+import sys
+import tempfile
+import time
+from PIL import Image
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from analysis_cache import AnalysisCache, file_hash, encode_image, decode_image
+
+
+class TestAnalysisCache:
+    """AnalysisCacheクラスのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'cache', 'analysis.sqlite')
+        self.img_path = os.path.join(self.temp_dir, 'img1.jpg')
+        Image.new('RGB', (64, 48), color='blue').save(self.img_path)
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_store_and_lookup(self):
+        """保存した値が取得できるテスト"""
+        cache = AnalysisCache(self.db_path)
+        cache.store(self.img_path, blur=123.5, orientation=6, width=64, height=48)
+
+        entry = cache.lookup(self.img_path)
+
+        assert entry['blur'] == 123.5
+        assert entry['orientation'] == 6
+        assert (entry['width'], entry['height']) == (64, 48)
+        assert entry['preview'] is None
+        cache.close()
+
+    def test_persists_across_instances(self):
+        """再オープン後もエントリが残っているテスト"""
+        cache = AnalysisCache(self.db_path)
+        cache.store(self.img_path, blur=10.0)
+        cache.close()
+
+        cache = AnalysisCache(self.db_path)
+        assert cache.lookup(self.img_path)['blur'] == 10.0
+        cache.close()
+
+    def test_partial_store_keeps_other_fields(self):
+        """一部の項目だけ保存しても他の項目は保持されるテスト"""
+        cache = AnalysisCache(self.db_path)
+        cache.store(self.img_path, blur=10.0)
+        cache.store(self.img_path, orientation=3)
+
+        entry = cache.lookup(self.img_path)
+        assert entry['blur'] == 10.0
+        assert entry['orientation'] == 3
+        cache.close()
+
+    def test_modified_file_is_invalidated(self):
+        """ファイルが変更されるとエントリが無効になるテスト"""
+        cache = AnalysisCache(self.db_path)
+        cache.store(self.img_path, blur=10.0)
+        Image.new('RGB', (32, 32), color='red').save(self.img_path)
+        os.utime(self.img_path, ns=(1, 1))
+
+        assert cache.lookup(self.img_path) is None
+        cache.close()
+
+    def test_content_hash_survives_touch(self):
+        """内容ハッシュ有効時は更新時刻だけの変更でエントリを引き継ぐテスト"""
+        cache = AnalysisCache(self.db_path, use_hash=True)
+        cache.store(self.img_path, blur=10.0)
+        os.utime(self.img_path, ns=(1, 1))
+
+        entry = cache.lookup(self.img_path)
+        assert entry is not None
+        assert entry['blur'] == 10.0
+        assert entry['mtime_ns'] == 1
+        cache.close()
+
+    def test_lookup_many_and_missing(self):
+        """存在しないファイルやエントリの無いファイルは結果に含まれないテスト"""
+        cache = AnalysisCache(self.db_path)
+        cache.store(self.img_path, blur=1.0)
+        missing = os.path.join(self.temp_dir, 'missing.jpg')
+
+        result = cache.lookup_many([self.img_path, missing])
+
+        assert list(result) == [self.img_path]
+        cache.close()
+
+    def test_unknown_field(self):
+        """未定義の項目はエラーになるテスト"""
+        cache = AnalysisCache(self.db_path)
+        with pytest.raises(ValueError):
+            cache.store(self.img_path, unknown=1)
+        cache.close()
+
+    def test_encode_decode_image(self):
+        """プレビュー画像のエンコードとデコードのテスト"""
+        img = Image.new('RGB', (20, 10), color='green')
+
+        assert decode_image(encode_image(img)).size == (20, 10)
+        assert decode_image(encode_image(img, 'PNG')).getpixel((0, 0)) == (0, 128, 0)
+
+    def test_file_hash(self):
+        """内容が同じなら同じハッシュになるテスト"""
+        other = os.path.join(self.temp_dir, 'copy.jpg')
+        with open(self.img_path, 'rb') as src, open(other, 'wb') as dst:
+            dst.write(src.read())
+
+        assert file_hash(self.img_path) == file_hash(other)
+
+    def test_store_many(self):
+        """複数ファイルをまとめて保存するテスト"""
+        other = os.path.join(self.temp_dir, 'img2.jpg')
+        Image.new('RGB', (8, 8)).save(other)
+        missing = os.path.join(self.temp_dir, 'missing.jpg')
+        cache = AnalysisCache(self.db_path)
+
+        cache.store_many([(self.img_path, {'blur': 1.0}), (other, {'blur': 2.0}), (missing, {'blur': 3.0})])
+
+        result = cache.lookup_many([self.img_path, other])
+        assert result[self.img_path]['blur'] == 1.0
+        assert result[other]['blur'] == 2.0
+        cache.close()
+
+    def test_prune_removes_deleted_files(self):
+        """削除されたファイルのエントリは消え、フォルダごと見つからないファイルのエントリは残るテスト"""
+        cache = AnalysisCache(self.db_path)
+        other = os.path.join(self.temp_dir, 'img2.jpg')
+        card = os.path.join(self.temp_dir, 'card')
+        offline = os.path.join(card, 'img3.jpg')
+        os.makedirs(card)
+        for path in (other, offline):
+            Image.new('RGB', (8, 8)).save(path)
+        cache.store_many([(self.img_path, {'blur': 1.0}), (other, {'blur': 2.0}), (offline, {'blur': 3.0})])
+        os.remove(other)
+        os.rename(card, card + '_ejected')
+
+        assert cache.prune() == 1
+
+        rows = dict(cache._conn.execute('SELECT path, blur FROM entries').fetchall())
+        assert sorted(rows.values()) == [1.0, 3.0]
+        cache.close()
+
+    def test_prune_least_recently_used(self):
+        """容量の上限を超えた分は最近使っていないエントリからプレビューが消え、ぼやけ値などは残るテスト"""
+        paths = []
+        for i in range(3):
+            path = os.path.join(self.temp_dir, f'p{i}.jpg')
+            Image.new('RGB', (8, 8)).save(path)
+            paths.append(path)
+        cache = AnalysisCache(self.db_path, max_bytes=2 * (1010 + 256) + 256)
+        for path in paths:
+            cache.store(path, blur=1.0, phash='dhash:01', preview=b'x' * 1000, zoom=b'z' * 10)
+        # 最初に保存したものを読むと、2番目が最も古くなる
+        assert cache.lookup(paths[0]) is not None
+
+        assert cache.prune() == 1
+
+        assert cache.lookup(paths[0])['preview'] is not None
+        assert cache.lookup(paths[2])['preview'] is not None
+        evicted = cache.lookup(paths[1])
+        assert evicted['preview'] is None and evicted['zoom'] is None
+        assert evicted['blur'] == 1.0 and evicted['phash'] == 'dhash:01'
+        # プレビューの無いエントリは容量の計算に入らず、もう一度pruneしても変わらない
+        assert cache.prune() == 0
+        cache.close()
+
+    def test_lookup_scalars(self):
+        """画像以外の項目をまとめて取得し、変更されたファイルのエントリは返さないテスト"""
+        cache = AnalysisCache(self.db_path)
+        other = os.path.join(self.temp_dir, 'img2.jpg')
+        Image.new('RGB', (8, 8)).save(other)
+        cache.store(self.img_path, blur=1.0, phash='dhash:00ff', preview=b'x' * 100)
+        cache.store(other, blur=2.0)
+        st = os.stat(self.img_path)
+
+        result = cache.lookup_scalars([self.img_path, other, os.path.join(self.temp_dir, 'missing.jpg')],
+                                      {self.img_path: (st.st_size, st.st_mtime_ns), other: (1, 1)})
+
+        assert set(result) == {self.img_path}
+        assert result[self.img_path]['blur'] == 1.0
+        assert result[self.img_path]['phash'] == 'dhash:00ff'
+        assert 'preview' not in result[self.img_path]
+        assert set(cache.lookup_scalars([other])) == {other}
+
+        lookup = cache.start_lookup([self.img_path, other])
+        deadline = time.time() + 10
+        found = lookup.poll()
+        while found is None and time.time() < deadline:
+            time.sleep(0.01)
+            found = lookup.poll()
+        assert set(found) == {self.img_path, other}
+        cache.close()
+
+    def test_closed_cache_is_noop(self):
+        """クローズ後の操作はエラーにならず何もしないテスト"""
+        cache = AnalysisCache(self.db_path)
+        cache.close()
+
+        cache.store(self.img_path, blur=1.0)
+        assert cache.lookup(self.img_path) is None
+        cache.close()
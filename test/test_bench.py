@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+from bench import main, run, compare, percentile, build_corpus, STAGES
+
+
+class TestBench:
+    """ベンチマークの集計・基準値との比較のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_percentile(self):
+        """最近傍順位法でパーセンタイルを求めるテスト"""
+        values = list(range(1, 101))
+
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile([5.0], 99) == 5.0
+        assert percentile([], 50) is None
+
+    def test_corpus_is_reused(self):
+        """作成済みの合成画像は作り直さないテスト"""
+        paths = build_corpus(self.temp_dir, 'jpeg', 0.05, 2, burst=2)
+        mtimes = [os.stat(p).st_mtime_ns for p in paths]
+
+        again = build_corpus(self.temp_dir, 'jpeg', 0.05, 2, burst=2)
+
+        assert again == paths and len(paths) == 4
+        assert [os.stat(p).st_mtime_ns for p in again] == mtimes
+
+    def test_run(self):
+        """全段階のp50・p99と処理速度・メモリが記録されるテスト"""
+        results = run(self.temp_dir, ['jpeg', 'png'], [0.05], 2, 1, jobs=1, dwell=0)
+
+        assert set(results) == {'jpeg_0.05mp', 'png_0.05mp'}
+        for result in results.values():
+            for stage in STAGES + ('navigate',):
+                assert result[stage]['n'] == 3
+                assert 0 <= result[stage]['p50'] <= result[stage]['p99']
+            assert result['throughput']['scan'] > 0
+            assert result['peak_rss_mb'] is None or result['peak_rss_mb'] > 0
+
+    def test_missing_baseline(self):
+        """基準値が無いときは比較せずに終了コード2で失敗し、--save-baselineで作れるテスト"""
+        baseline = os.path.join(self.temp_dir, 'baseline.json')
+        argv = ['--formats', 'jpeg', '--sizes', '0.05', '--count', '1', '--burst', '0', '--jobs', '1',
+                '--dwell', '0', '--corpus', os.path.join(self.temp_dir, 'corpus'), '--baseline', baseline]
+
+        assert main(argv) == 2
+        assert main(argv + ['--save-baseline']) == 0
+        assert os.path.exists(baseline)
+
+    def test_compare(self):
+        """許容範囲を超えて遅くなった段階・処理速度・増えたメモリだけが報告されるテスト"""
+        base = {'jpeg_12mp': {'decode': {'p50': 100.0, 'p99': 120.0}, 'resize': {'p50': 1.0, 'p99': 1.0},
+                              'throughput': {'scan': 10.0}, 'peak_rss_mb': 100}}
+        now = {'jpeg_12mp': {'decode': {'p50': 110.0, 'p99': 200.0}, 'resize': {'p50': 2.0, 'p99': 2.5},
+                             'throughput': {'scan': 5.0}, 'peak_rss_mb': 500},
+               'png_12mp': {'decode': {'p50': 1.0, 'p99': 1.0}, 'throughput': {}}}
+
+        regressions = compare(now, base, tolerance=0.25, min_ms=2.0)
+
+        assert regressions == ['jpeg_12mp decode p99: 120.0ms -> 200.0ms',
+                               'jpeg_12mp throughput scan: 10.00/s -> 5.00/s',
+                               'jpeg_12mp peak_rss_mb: 100.0MB -> 500.0MB']
+        # 少し増えただけのメモリは報告しない
+        now['jpeg_12mp']['peak_rss_mb'] = 110
+        assert len(compare(now, base, tolerance=0.25, min_ms=2.0)) == 2
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import tempfile
+from PIL import Image, ImageFilter
+import numpy as np
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from blur_scan import PoolScanner, score_files
+from sharpness import SharpnessEngine
+from similarity import hash_files
+
+
+class TestBlurScan:
+    """フォルダ全体のぼやけ判定のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        sharp = Image.fromarray(rng.integers(0, 256, (240, 320), dtype=np.uint8)).convert('RGB')
+        self.sharp_path = os.path.join(self.temp_dir, 'sharp.png')
+        self.blurry_path = os.path.join(self.temp_dir, 'blurry.png')
+        sharp.save(self.sharp_path)
+        sharp.filter(ImageFilter.GaussianBlur(6)).save(self.blurry_path)
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_score_files(self):
+        """まとめて評価し、読み込めないファイルはNoneを返すテスト"""
+        missing = os.path.join(self.temp_dir, 'missing.jpg')
+
+        results = dict(score_files([self.sharp_path, missing, self.blurry_path], SharpnessEngine(size=160)))
+
+        assert results[missing] is None
+        assert results[self.sharp_path] > results[self.blurry_path]
+
+    def test_scanner_streams_results(self):
+        """プロセスプールで計算した結果がpollで取得できるテスト"""
+        scanner = PoolScanner(SharpnessEngine(size=160), jobs=2)
+        try:
+            scanner.start([self.sharp_path, self.blurry_path])
+            results = {}
+            deadline = time.time() + 60
+            while scanner.running and time.time() < deadline:
+                time.sleep(0.05)
+            results.update(scanner.poll())
+
+            assert scanner.done == scanner.total == 2
+            assert results[self.sharp_path] > results[self.blurry_path]
+        finally:
+            scanner.shutdown()
+
+    def test_custom_task(self):
+        """taskを差し替えて別の解析（知覚ハッシュ）にも使えるテスト"""
+        scanner = PoolScanner('dhash', jobs=1, task=hash_files)
+        try:
+            scanner.start([self.sharp_path, self.blurry_path])
+            deadline = time.time() + 60
+            while scanner.running and time.time() < deadline:
+                time.sleep(0.05)
+            results = dict(scanner.poll())
+
+            assert results == dict(hash_files([self.sharp_path, self.blurry_path], 'dhash'))
+        finally:
+            scanner.shutdown()
+
+    def test_cancel_discards_results(self):
+        """取り消したスキャンの結果は返されないテスト"""
+        scanner = PoolScanner(SharpnessEngine(size=160), jobs=1)
+        try:
+            scanner.start([self.sharp_path])
+            scanner.cancel()
+            time.sleep(0.5)
+
+            assert scanner.poll() == []
+            assert not scanner.running
+        finally:
+            scanner.shutdown()
@@ -0,0 +1,124 @@
+import os
+import sys
+import io
+import csv
+import json
+import shutil
+import tempfile
+from PIL import Image, ImageFilter
+import numpy as np
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from cli import main, decide, exact_duplicates, write_report
+from session import SessionStore, KEEP, DELETE, UNRATED
+
+
+class TestCli:
+    """ウィンドウを開かないバッチ処理のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.folder = os.path.join(self.temp_dir, 'photos')
+        os.makedirs(self.folder)
+        rng = np.random.default_rng(0)
+        sharp = Image.fromarray(rng.integers(0, 256, (240, 320), dtype=np.uint8)).convert('RGB')
+        other = Image.fromarray(rng.integers(0, 256, (240, 320), dtype=np.uint8)).convert('RGB')
+        sharp.save(os.path.join(self.folder, 'a.png'))
+        shutil.copy(os.path.join(self.folder, 'a.png'), os.path.join(self.folder, 'b.png'))
+        sharp.filter(ImageFilter.GaussianBlur(6)).save(os.path.join(self.folder, 'c.png'))
+        other.save(os.path.join(self.folder, 'd.png'))
+        self.config_path = os.path.join(self.temp_dir, 'setting.ini')
+        with open(self.config_path, 'w', encoding='utf-8') as f:
+            f.write('[blur]\nthreshold = 100\nanalysis_size = 160\n[cache]\nenabled = false\n')
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_exact_duplicates(self):
+        """サイズと内容が一致するファイルだけがまとめられるテスト"""
+        paths = [os.path.join(self.folder, n) for n in ('a.png', 'b.png', 'c.png', 'd.png')]
+        sizes = {path: os.path.getsize(path) for path in paths}
+
+        groups = exact_duplicates(sizes)
+
+        assert [sorted(group) for group in groups] == [paths[:2]]
+
+    def test_decide(self):
+        """重複はグループで最もシャープな1枚を残し、残りはぼやけ値で判定するテスト"""
+        names = ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg']
+        scores = {'a.jpg': 500.0, 'b.jpg': 500.0, 'c.jpg': 50.0, 'd.jpg': 800.0, 'e.jpg': None}
+
+        records = decide(names, scores, 100.0, [['b.jpg', 'a.jpg']], [['a.jpg', 'd.jpg']])
+        result = {r['name']: (r['decision'], r['reason'], r['duplicate_of']) for r in records}
+
+        assert [r['name'] for r in records] == names
+        assert result['a.jpg'] == (DELETE, 'near_duplicate', 'd.jpg')
+        assert result['b.jpg'] == (DELETE, 'duplicate', 'a.jpg')
+        assert result['c.jpg'] == (DELETE, 'blur', '')
+        assert result['d.jpg'] == (KEEP, '', '')
+        assert result['e.jpg'] == (UNRATED, 'unreadable', '')
+
+    def test_write_csv(self):
+        """CSVは1画像1行で書き出されるテスト"""
+        records = decide(['a.jpg', 'b.jpg'], {'a.jpg': 500.0, 'b.jpg': 10.0}, 100.0)
+        out = io.StringIO()
+
+        write_report(records, out, 'csv', self.folder, 100.0)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+
+        assert [(r['name'], r['decision'], r['reason']) for r in rows] == \
+            [('a.jpg', KEEP, ''), ('b.jpg', DELETE, 'blur')]
+
+    def test_main(self):
+        """フォルダを解析してJSONを書き出し、セッションには書き込まないテスト"""
+        output = os.path.join(self.temp_dir, 'result.json')
+
+        code = main([self.folder, '-c', self.config_path, '-j', '1', '-o', output, '-q'])
+        with open(output, encoding='utf-8') as f:
+            report = json.load(f)
+
+        assert code == 0
+        assert report['keep'] == ['a.png', 'd.png']
+        assert report['delete'] == ['b.png', 'c.png']
+        assert sorted(os.listdir(self.folder)) == ['a.png', 'b.png', 'c.png', 'd.png']
+
+    def test_mark_session(self):
+        """--mark-sessionを指定した場合だけ削除候補をセッションに書き込むテスト"""
+        store = SessionStore.for_folder(self.folder)
+        store.set_decision('c.png', KEEP)
+        store.close()
+        output = os.path.join(self.temp_dir, 'result.json')
+
+        code = main([self.folder, '-c', self.config_path, '-j', '1', '-o', output, '-q', '--mark-session'])
+
+        assert code == 0
+        store = SessionStore.for_folder(self.folder)
+        # GUIで判定済みの画像は上書きしない
+        assert store.decision('b.png') == DELETE
+        assert store.decision('c.png') == KEEP
+        store.close()
+
+    def test_near_delete(self):
+        """--near-deleteを指定した場合だけ連写のグループの2枚目以降を削除候補にするテスト"""
+        d = np.asarray(Image.open(os.path.join(self.folder, 'd.png')), dtype=np.int16)
+        Image.fromarray(np.clip(d + 3, 0, 255).astype(np.uint8)).save(os.path.join(self.folder, 'e.png'))
+        output = os.path.join(self.temp_dir, 'result.json')
+
+        main([self.folder, '-c', self.config_path, '-j', '1', '-o', output, '-q'])
+        with open(output, encoding='utf-8') as f:
+            report = json.load(f)
+        assert report['keep'] == ['a.png', 'd.png', 'e.png']
+
+        main([self.folder, '-c', self.config_path, '-j', '1', '-o', output, '-q', '--near-delete'])
+        with open(output, encoding='utf-8') as f:
+            report = json.load(f)
+        records = {r['name']: r for r in report['images']}
+        assert report['keep'] == ['a.png', 'd.png']
+        assert (records['e.png']['reason'], records['e.png']['duplicate_of']) == ('near_duplicate', 'd.png')
+
+    def test_missing_folder(self):
+        """存在しないフォルダは終了コード2になるテスト"""
+        assert main([os.path.join(self.temp_dir, 'missing'), '-c', self.config_path, '-q']) == 2
@@ -0,0 +1,279 @@
+import pytest
+import os
+import io
+import struct
+import sys
+import tempfile
+from PIL import Image
+import numpy as np
+from unittest.mock import patch
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import decode
+from decode import DisplayImage, open_image, load_scaled, load_region, load_regions, MCU_MARGIN, raw_preview, read_orientation
+from decode import analysis_image, scaled_size
+
+
+class TestDecode:
+    """縮小デコード・領域切り出しのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        arr = rng.integers(0, 256, (960, 1280, 3), dtype=np.uint8)
+        self.jpg_path = os.path.join(self.temp_dir, 'test.jpg')
+        self.png_path = os.path.join(self.temp_dir, 'test.png')
+        Image.fromarray(arr).save(self.jpg_path, quality=90)
+        Image.fromarray(arr).save(self.png_path)
+        self.arr = arr
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_load_scaled_jpeg_uses_draft(self):
+        """JPEGは表示サイズを下回らない範囲で縮小デコードされるテスト"""
+        img, original_size = load_scaled(self.jpg_path, (300, 200))
+
+        assert original_size == (1280, 960)
+        assert img.mode == 'RGB'
+        assert img.width >= 300 and img.height >= 200
+        assert img.width <= 640 and img.height <= 480
+
+    def test_load_scaled_png_reduces(self):
+        """draft非対応形式も整数倍で縮小されるテスト"""
+        img, original_size = load_scaled(self.png_path, (300, 200))
+
+        assert original_size == (1280, 960)
+        assert img.width >= 300 and img.height >= 200
+        assert img.width < 1280
+
+    def test_load_scaled_palette_png(self):
+        """間引きに対応しない形式（パレット）はRGBにしてから縮小されるテスト"""
+        path = os.path.join(self.temp_dir, 'palette.png')
+        Image.fromarray(self.arr).convert('P').save(path)
+
+        img, original_size = load_scaled(path, (300, 200))
+
+        assert img.mode == 'RGB'
+        assert img.size == (320, 240)
+
+    def test_load_scaled_without_size(self):
+        """サイズ指定なしでは元解像度でデコードされるテスト"""
+        img, original_size = load_scaled(self.png_path, None)
+
+        assert img.size == original_size == (1280, 960)
+
+    def test_scaled_size(self):
+        """デコードせずにload_scaledの結果の大きさが分かるテスト"""
+        for path in (self.jpg_path, self.png_path):
+            for size, long_edge in (((100, 75), None), (None, 200), ((500, 300), 200), (None, None)):
+                assert scaled_size(path, size, long_edge) == load_scaled(path, size, long_edge)[0].size
+
+    def test_analysis_image_matches_scan_decode(self):
+        """表示用に大きくデコードした画像でも、スキャンと同じ解像度の画像でぼやけ判定するテスト"""
+        for path in (self.jpg_path, self.png_path):
+            scan, _ = load_scaled(path, None, long_edge=200)
+            display, _ = load_scaled(path, (800, 600), long_edge=200)
+
+            img = analysis_image(path, display, 200)
+
+            assert display.size != scan.size
+            assert img.size == scan.size
+            assert analysis_image(path, scan, 200) is scan
+
+    def test_load_region(self):
+        """元解像度で領域が切り出されるテスト"""
+        crop = load_region(self.png_path, (100, 50, 120, 80))
+
+        assert crop.size == (20, 30)
+        assert np.array_equal(np.asarray(crop), self.arr[50:80, 100:120])
+
+    def test_display_image_covers(self):
+        """表示サイズを満たしているかの判定テスト"""
+        frame = DisplayImage(Image.new('RGB', (400, 300)), (1600, 1200))
+
+        assert frame.covers((400, 300))
+        assert not frame.covers((800, 600))
+        # ピラミッド（1/2・1/4）の分も含む
+        assert frame.nbytes == (400 * 300 + 200 * 150 + 100 * 75) * 3
+
+        small = DisplayImage(Image.new('RGB', (100, 80)), (100, 80))
+        assert small.covers((800, 600))
+
+        # 枠と縦横比が違う場合は、枠に収めた大きさがあればよい
+        wide = DisplayImage(Image.new('RGB', (1350, 900)), (6000, 4000))
+        assert wide.fitted((1600, 900)) == (1350, 900)
+        assert wide.covers((1600, 900))
+        assert not wide.covers((1600, 1000))
+
+    def test_pyramid(self):
+        """プレビューピラミッドが1/2ずつ縮小して作られるテスト"""
+        frame = DisplayImage(Image.new('RGB', (1600, 1200)), (1600, 1200))
+
+        assert [level.size for level in frame.pyramid] == [(1600, 1200), (800, 600), (400, 300), (200, 150)]
+        small = DisplayImage(Image.new('RGB', (200, 100)), (200, 100))
+        assert [level.size for level in small.pyramid] == [(200, 100)]
+
+    def test_heif_registered_once(self):
+        """pillow-heifは最初にHEIF画像を開くときに1回だけ登録されるテスト"""
+        import pillow_heif
+        path = os.path.join(self.temp_dir, 'test.heic')
+        pillow_heif.from_pillow(Image.fromarray(self.arr[:64, :64])).save(path)
+        decode._heif_registered = False
+
+        with patch('pillow_heif.register_heif_opener', wraps=pillow_heif.register_heif_opener) as mock_register:
+            open_image(self.jpg_path)
+            assert mock_register.call_count == 0
+            assert open_image(path).size == (64, 64)
+            open_image(path)
+
+        assert mock_register.call_count == 1
+
+    def test_load_scaled_long_edge(self):
+        """長辺指定では長辺がその値以上になる最小の解像度でデコードされるテスト"""
+        img, _ = load_scaled(self.jpg_path, None, long_edge=300)
+
+        assert max(img.size) >= 300
+        assert img.size == (320, 240)
+
+        img, _ = load_scaled(self.jpg_path, (100, 100), long_edge=600)
+        assert img.size == (640, 480)
+
+
+class TestLoadRegions:
+    """領域デコード（ROI）のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(1)
+        self.arr = rng.integers(0, 256, (600, 800, 3), dtype=np.uint8)
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def save(self, name, **kwargs):
+        path = os.path.join(self.temp_dir, name)
+        Image.fromarray(self.arr).save(path, **kwargs)
+        return path
+
+    @pytest.mark.parametrize('name,kwargs', [
+        ('baseline.jpg', {'quality': 90}),
+        ('progressive.jpg', {'quality': 90, 'progressive': True}),
+        ('plain.png', {}),
+    ])
+    def test_regions_match_full_decode(self, name, kwargs):
+        """部分デコードの結果が全体デコードからの切り出しと一致するテスト"""
+        path = self.save(name, **kwargs)
+        boxes = [(390, 290, 410, 310), (0, 0, 16, 16), (700, 100, 800, 140)]
+
+        crops = load_regions(path, boxes)
+
+        full = Image.open(path).convert('RGB')
+        for box, crop in zip(boxes, crops):
+            assert crop.size == (box[2] - box[0], box[3] - box[1])
+            assert np.array_equal(np.asarray(crop), np.asarray(full.crop(box)))
+
+    def test_decodes_only_needed_rows(self):
+        """下端より下の行を復号しないテスト"""
+        path = self.save('rows.png')
+
+        with patch('decode.Image.Image.crop', autospec=True, side_effect=Image.Image.crop) as mock_crop:
+            load_regions(path, [(10, 10, 20, 20)])
+
+        src = mock_crop.call_args[0][0]
+        assert src.height == 20 + MCU_MARGIN
+
+    def test_jpeg_file_is_not_modified(self):
+        """JPEGの部分デコードでメモリマップを書き換えてもファイルは変わらないテスト"""
+        path = self.save('mapped.jpg', quality=90)
+        with open(path, 'rb') as f:
+            before = f.read()
+
+        load_regions(path, [(10, 10, 20, 20)])
+
+        with open(path, 'rb') as f:
+            assert f.read() == before
+        # 閉じた後は移動・削除できる
+        os.remove(path)
+
+    def test_region_at_bottom_uses_full_decode(self):
+        """最下端の範囲は通常どおり全体をデコードするテスト"""
+        path = self.save('bottom.jpg', quality=90)
+
+        crop = load_region(path, (0, 590, 10, 600))
+
+        assert crop.size == (10, 10)
+
+
+
+def make_raw(path, size, orientation):
+    # TIFF形式のRAWを模したファイル（IFD0に向きとSubIFD、SubIFDに大きいプレビュー、IFD1に小さいサムネイル）
+    def jpeg(sz):
+        buf = io.BytesIO()
+        Image.new('RGB', sz, (200, 30, 30)).save(buf, 'JPEG')
+        return buf.getvalue()
+
+    def ifd(entries, next_offset):
+        out = struct.pack('<H', len(entries))
+        for tag, typ, value in entries:
+            out += struct.pack('<HHII', tag, typ, 1, value)
+        return out + struct.pack('<I', next_offset)
+
+    big, small = jpeg(size), jpeg((8, 6))
+    sub_offset = 8 + 2 + 12 * 2 + 4
+    ifd1_offset = sub_offset + 2 + 12 * 2 + 4
+    data_offset = ifd1_offset + 2 + 12 * 2 + 4
+    data = b'II*\x00' + struct.pack('<I', 8)
+    data += ifd([(0x0112, 3, orientation), (0x014A, 4, sub_offset)], ifd1_offset)
+    data += ifd([(0x0201, 4, data_offset), (0x0202, 4, len(big))], 0)
+    data += ifd([(0x0201, 4, data_offset + len(big)), (0x0202, 4, len(small))], 0)
+    with open(path, 'wb') as f:
+        f.write(data + big + small)
+
+
+class TestRawPreview:
+    """RAWの埋め込みプレビューのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.raw_path = os.path.join(self.temp_dir, 'test.dng')
+        make_raw(self.raw_path, (640, 480), 6)
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_largest_preview_is_used(self):
+        """SubIFDの大きいプレビューがサムネイルより優先されるテスト"""
+        img, original_size = load_scaled(self.raw_path, None)
+
+        assert original_size == (640, 480)
+        assert img.getpixel((10, 10))[0] > 150
+
+    def test_orientation_from_raw_header(self):
+        """向きはRAW本体のIFD0から読み取られるテスト"""
+        assert read_orientation(self.raw_path) == 6
+
+    def test_region_from_preview(self):
+        """プレビューから領域を切り出せるテスト"""
+        region = load_region(self.raw_path, (0, 0, 32, 32))
+
+        assert region.size == (32, 32)
+
+    def test_non_tiff_falls_back_to_scan(self):
+        """TIFF形式でないファイルはSOI〜EOIの走査で最大のJPEGを探すテスト"""
+        with open(self.raw_path, 'rb') as f:
+            data = b'ftypcrx ' + f.read()
+
+        preview = raw_preview(data)
+
+        assert Image.open(io.BytesIO(preview)).size == (640, 480)
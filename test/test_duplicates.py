@@ -0,0 +1,100 @@
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import duplicates
+from duplicates import exact_duplicates, find_duplicates, same_content
+
+
+class TestExactDuplicates:
+    """完全一致の検出のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.temp_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_staged(self):
+        """先頭と末尾が同じでも途中が違うファイルは全体のハッシュで分けられるテスト"""
+        body = os.urandom(300 * 1024)
+        a = self.write('a.jpg', body)
+        b = self.write('b.jpg', body)
+        c = self.write('c.jpg', body[:100000] + b'x' + body[100001:])
+        d = self.write('d.jpg', body[:-1] + b'y')
+        sizes = {path: os.path.getsize(path) for path in (a, b, c, d)}
+
+        assert exact_duplicates(sizes, workers=2) == [[a, b]]
+
+    def test_unique_sizes_are_not_read(self):
+        """サイズが他と違うファイルは内容を読まないテスト"""
+        a = self.write('a.jpg', b'1' * 10)
+        b = self.write('b.jpg', b'1' * 11)
+        with patch.object(duplicates, 'edge_digest', side_effect=AssertionError), \
+                patch.object(duplicates, 'file_digest', side_effect=AssertionError):
+            assert exact_duplicates({a: 10, b: 11}) == []
+
+    def test_small_files_read_once(self):
+        """先頭と末尾で全体を読み切れる小さいファイルは読み直さないテスト"""
+        a = self.write('a.jpg', b'same')
+        b = self.write('b.jpg', b'same')
+        with patch.object(duplicates, 'file_digest', side_effect=AssertionError):
+            assert exact_duplicates({a: 4, b: 4}) == [[a, b]]
+
+    def test_same_content(self):
+        """2つのファイルの内容の比較のテスト"""
+        body = os.urandom(200 * 1024)
+        a = self.write('a.jpg', body)
+        b = self.write('b.jpg', body)
+        c = self.write('c.jpg', body[:-1] + b'!')
+
+        assert same_content(a, b)
+        assert not same_content(a, c)
+        assert not same_content(a, os.path.join(self.temp_dir, 'missing.jpg'))
+
+    def test_find_duplicates(self):
+        """写真フォルダ内の重複と保存先に既にある画像が見つかるテスト"""
+        folder = os.path.join(self.temp_dir, 'card')
+        self.write('card/a.jpg', b'A' * 100)
+        self.write('card/sub/a.jpg', b'A' * 100)
+        self.write('card/b.jpg', b'B' * 100)
+        self.write('card/c.jpg', b'C' * 50)
+        self.write('sel/old/b.jpg', b'B' * 100)
+        sizes = {'a.jpg': 100, os.path.join('sub', 'a.jpg'): 100, 'b.jpg': 100, 'c.jpg': 50}
+
+        result = find_duplicates(folder, sizes, [os.path.join(self.temp_dir, 'sel')])
+
+        assert result.duplicates == [['a.jpg', os.path.join('sub', 'a.jpg')]]
+        assert result.saved == {'b.jpg'}
+
+    def test_find_duplicates_nested_save_dir(self):
+        """写真フォルダの中に保存先がある場合、保存先の画像は重複として扱わないテスト"""
+        folder = os.path.join(self.temp_dir, 'card')
+        self.write('card/a.jpg', b'A' * 100)
+        self.write('card/sel/a.jpg', b'A' * 100)
+        self.write('card/sel/print/a.jpg', b'A' * 100)
+        self.write('card/b.jpg', b'B' * 100)
+        self.write('card/sel/print/b.jpg', b'B' * 100)
+        self.write('card/c.jpg', b'C' * 100)
+        sel = os.path.join('sel', 'a.jpg')
+        printed = os.path.join('sel', 'print', 'a.jpg')
+        sizes = {'a.jpg': 100, sel: 100, printed: 100, 'b.jpg': 100,
+                 os.path.join('sel', 'print', 'b.jpg'): 100, 'c.jpg': 100}
+
+        result = find_duplicates(folder, sizes, [os.path.join(folder, 'sel'), os.path.join(folder, 'sel', 'print')])
+
+        assert result.duplicates == []
+        assert result.saved == {'a.jpg', 'b.jpg'}
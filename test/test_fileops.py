@@ -0,0 +1,308 @@
+import pytest
+import os
+import sys
+import time
+import tempfile
+from unittest.mock import patch
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from fileops import (FileOperation, FileOperationQueue, SidecarFinder, keep_file, keep_group, keep_methods,
+                     sidecar_extensions, DONE, FAILED, CANCELLED)
+
+
+class TestFileOperationQueue:
+    """FileOperationQueueクラスのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.temp_dir, 'img1.jpg')
+        with open(self.src, 'wb') as f:
+            f.write(b'data')
+        self.dst_dir = os.path.join(self.temp_dir, 'sel')
+        os.mkdir(self.dst_dir)
+        self.queue = FileOperationQueue(workers=2, undo_seconds=0.2, retries=2, retry_delay=0)
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        self.queue.shutdown()
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_copy_runs_after_undo_window(self):
+        """取り消し猶予の後にコピーが実行されるテスト"""
+        dst = os.path.join(self.dst_dir, 'img1.jpg')
+        op = self.queue.submit('keep', self.src, dst)
+
+        assert not os.path.exists(dst)
+        assert self.queue.wait(5)
+        assert op.state == DONE
+        with open(dst, 'rb') as f:
+            assert f.read() == b'data'
+
+    def test_cancel_within_undo_window(self):
+        """猶予中の操作は取り消せるテスト"""
+        dst = os.path.join(self.dst_dir, 'img1.jpg')
+        op = self.queue.submit('keep', self.src, dst)
+
+        assert self.queue.cancel(op)
+        assert op.state == CANCELLED
+        time.sleep(0.3)
+        assert not os.path.exists(dst)
+        assert not self.queue.cancel(op)
+
+    def test_flush_runs_immediately(self):
+        """flushで猶予中の操作がすぐに実行されるテスト"""
+        queue = FileOperationQueue(undo_seconds=60)
+        try:
+            op = queue.submit('delete', self.src)
+            queue.flush()
+            assert queue.wait(5)
+            assert op.state == DONE
+            assert not os.path.exists(self.src)
+        finally:
+            queue.shutdown()
+
+    def test_retry_then_succeed(self):
+        """一時的な失敗は再試行されるテスト"""
+        calls = []
+
+        def flaky(src, dst):
+            calls.append(src)
+            if len(calls) < 2:
+                raise OSError('network busy')
+
+        with patch('shutil.copy2', side_effect=flaky):
+            op = self.queue.submit('keep', self.src, 'dst', delay=0)
+            assert self.queue.wait(5)
+
+        assert op.state == DONE
+        assert op.attempts == 2
+        assert self.queue.take_errors() == []
+
+    def test_errors_are_collected(self):
+        """失敗した操作がまとめて取り出せるテスト"""
+        missing = os.path.join(self.temp_dir, 'missing.jpg')
+        with patch('shutil.copy2', side_effect=OSError('offline')):
+            op1 = self.queue.submit('keep', self.src, 'dst', delay=0)
+            op2 = self.queue.submit('delete', missing, delay=0)
+            assert self.queue.wait(5)
+
+        errors = self.queue.take_errors()
+        assert set(errors) == {op1, op2}
+        assert op1.state == op2.state == FAILED
+        assert op1.attempts == 3  # 初回＋再試行2回
+        assert op2.attempts == 1  # 存在しないファイルは再試行しない
+        assert op1.describe().startswith('保存 img1.jpg')
+        assert self.queue.take_errors() == []
+
+    def test_batched_per_destination(self):
+        """同じ保存先フォルダへの操作が1つのワーカーでまとめて実行されるテスト"""
+        queue = FileOperationQueue(workers=1, undo_seconds=60, batch=3)
+        calls = []
+        try:
+            with patch.object(FileOperation, 'run', lambda op, context=None: calls.append((op.group, id(context)))):
+                for folder in ('a', 'b', 'a', 'a', 'a', 'b'):
+                    queue.submit('keep', self.src, os.path.join(self.dst_dir, folder, 'img1.jpg'))
+                queue.flush()
+                assert queue.wait(5)
+        finally:
+            queue.shutdown()
+
+        groups = [os.path.basename(group) for group, _ in calls]
+        assert groups == ['a', 'a', 'a', 'b', 'b', 'a']
+        # まとめて実行した操作はフォルダの作成・ファイルシステムの判定を共有する
+        assert len({context for _, context in calls[:3]}) == 1
+        assert calls[3][1] == calls[4][1] != calls[2][1]
+
+    def test_keep_with_sidecars(self):
+        """付随ファイルが画像と一緒に保存されるテスト"""
+        xmp = os.path.join(self.temp_dir, 'img1.xmp')
+        with open(xmp, 'w') as f:
+            f.write('<x/>')
+        dst = os.path.join(self.dst_dir, 'sub', 'img1.jpg')
+        op = self.queue.submit('keep', self.src, dst, delay=0,
+                               sidecars=[(xmp, os.path.join(self.dst_dir, 'sub', 'img1.xmp'))])
+
+        assert self.queue.wait(5)
+        assert op.state == DONE
+        assert os.path.exists(dst)
+        assert os.path.exists(os.path.join(self.dst_dir, 'sub', 'img1.xmp'))
+
+
+class TestKeepFile:
+    """保存方法（コピー・リンク・移動）のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.temp_dir, 'img1.jpg')
+        with open(self.src, 'wb') as f:
+            f.write(b'data')
+        self.dst = os.path.join(self.temp_dir, 'sel', 'img1.jpg')
+        os.mkdir(os.path.dirname(self.dst))
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_copy(self):
+        """コピーのテスト"""
+        assert keep_file(self.src, self.dst, 'copy') == 'copy'
+        assert self.read(self.dst) == b'data'
+        assert os.stat(self.src).st_ino != os.stat(self.dst).st_ino
+
+    def test_hardlink(self):
+        """ハードリンクのテスト（既存ファイルは置き換える）"""
+        with open(self.dst, 'wb') as f:
+            f.write(b'old')
+
+        assert keep_file(self.src, self.dst, 'hardlink') == 'hardlink'
+        assert os.stat(self.src).st_ino == os.stat(self.dst).st_ino
+        assert not os.path.exists(self.dst + '.picsel-tmp')
+
+    def test_hardlink_falls_back_to_copy(self):
+        """ハードリンクできない場合はコピーにフォールバックするテスト"""
+        with patch('os.link', side_effect=OSError('cross-device link')):
+            assert keep_file(self.src, self.dst, 'hardlink') == 'copy'
+        assert self.read(self.dst) == b'data'
+
+    def test_auto_on_same_device(self):
+        """同じファイルシステム上ではリフリンクかハードリンクを選ぶテスト"""
+        assert keep_methods('auto', self.src, self.dst) == ['reflink', 'hardlink', 'copy']
+        assert keep_file(self.src, self.dst, 'auto') in ('reflink', 'hardlink')
+        assert self.read(self.dst) == b'data'
+
+    def test_auto_on_other_device(self):
+        """別のファイルシステムへはコピーするテスト"""
+        with patch('fileops.same_device', return_value=False):
+            assert keep_methods('auto', self.src, self.dst) == ['copy']
+
+    def test_move(self):
+        """移動のテスト"""
+        assert keep_file(self.src, self.dst, 'move') == 'move'
+        assert not os.path.exists(self.src)
+        assert self.read(self.dst) == b'data'
+
+    def test_symlink(self):
+        """シンボリックリンクのテスト"""
+        assert keep_file(self.src, self.dst, 'symlink') in ('symlink', 'copy')
+        assert self.read(self.dst) == b'data'
+
+    def test_missing_source(self):
+        """元ファイルが無い場合はフォールバックせずにエラーになるテスト"""
+        os.remove(self.src)
+        with pytest.raises(FileNotFoundError):
+            keep_file(self.src, self.dst, 'hardlink')
+
+    def test_unknown_strategy(self):
+        """未定義の保存方法はエラーになるテスト"""
+        with pytest.raises(ValueError):
+            keep_file(self.src, self.dst, 'teleport')
+
+
+class TestKeepGroup:
+    """画像と付随ファイルをまとめて保存するテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.dst_dir = os.path.join(self.temp_dir, 'sel')
+        self.files = []
+        for name in ('img1.jpg', 'img1.xmp', 'img1.cr2'):
+            path = os.path.join(self.temp_dir, name)
+            with open(path, 'wb') as f:
+                f.write(name.encode())
+            self.files.append((path, os.path.join(self.dst_dir, name)))
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_all_saved(self):
+        """すべてのファイルが保存され、画像の保存方法が返るテスト"""
+        assert keep_group(self.files, 'copy') == 'copy'
+        assert sorted(os.listdir(self.dst_dir)) == ['img1.cr2', 'img1.jpg', 'img1.xmp']
+
+    def test_identical_file_is_not_copied(self):
+        """保存先に同じ内容のファイルが既にあれば書き込まないテスト"""
+        keep_group(self.files, 'copy')
+        with patch('shutil.copy2', side_effect=AssertionError):
+            assert keep_group(self.files, 'copy') == 'exists'
+
+    def test_missing_sidecar_is_skipped(self):
+        """保存までに無くなった付随ファイルは飛ばすテスト"""
+        os.remove(self.files[1][0])
+        keep_group(self.files, 'copy')
+        assert sorted(os.listdir(self.dst_dir)) == ['img1.cr2', 'img1.jpg']
+
+    def test_rollback_copy(self):
+        """途中で失敗すると作ったファイルが消されるテスト"""
+        import shutil
+        copy2 = shutil.copy2
+
+        def fail_on_raw(src, dst):
+            if src.endswith('.cr2'):
+                raise OSError('disk full')
+            return copy2(src, dst)
+
+        with patch('shutil.copy2', side_effect=fail_on_raw):
+            with pytest.raises(OSError):
+                keep_group(self.files, 'copy')
+        assert os.listdir(self.dst_dir) == []
+
+    def test_rollback_move(self):
+        """移動の途中で失敗すると移動したファイルが元に戻るテスト"""
+        os.makedirs(self.dst_dir)
+        # 付随ファイルの保存先を作れないようにする
+        with open(os.path.join(self.temp_dir, 'blocked'), 'w') as f:
+            f.write('')
+        self.files[2] = (self.files[2][0], os.path.join(self.temp_dir, 'blocked', 'img1.cr2'))
+
+        with pytest.raises(OSError):
+            keep_group(self.files, 'move')
+        for src, _ in self.files:
+            assert os.path.exists(src)
+        assert os.listdir(self.dst_dir) == []
+
+
+class TestSidecarFinder:
+    """付随ファイルの検索のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        for name in ('IMG_1.JPG', 'IMG_1.xmp', 'IMG_1.CR2', 'IMG_1.JPG.xmp', 'IMG_10.xmp', 'IMG_1.txt'):
+            with open(os.path.join(self.temp_dir, name), 'w') as f:
+                f.write('')
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_find(self):
+        """同じ名前の指定した拡張子のファイルだけが見つかるテスト"""
+        finder = SidecarFinder(sidecar_extensions('xmp, raw'))
+        found = finder.find(os.path.join(self.temp_dir, 'IMG_1.JPG'))
+
+        assert [os.path.basename(p) for p in found] == ['IMG_1.CR2', 'IMG_1.JPG.xmp', 'IMG_1.xmp']
+        assert SidecarFinder(sidecar_extensions('')).find(os.path.join(self.temp_dir, 'IMG_1.JPG')) == []
+
+    def test_listing_is_cached(self):
+        """フォルダの一覧はclearするまで取り直さないテスト"""
+        finder = SidecarFinder(sidecar_extensions('xmp'))
+        path = os.path.join(self.temp_dir, 'IMG_2.JPG')
+        assert finder.find(path) == []
+        with open(os.path.join(self.temp_dir, 'IMG_2.xmp'), 'w') as f:
+            f.write('')
+        assert finder.find(path) == []
+        finder.clear()
+        assert len(finder.find(path)) == 1
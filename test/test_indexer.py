@@ -0,0 +1,192 @@
+import pytest
+import os
+import sys
+import time
+import tempfile
+from PIL import Image
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from indexer import FolderIndex, IndexWatcher
+
+
+def make_image(path, taken=None, exposure=None):
+    img = Image.new('RGB', (32, 24), (128, 128, 128))
+    exif = Image.Exif()
+    if taken:
+        exif.get_ifd(0x8769)[0x9003] = taken
+    if exposure:
+        exif.get_ifd(0x8769)[0x829A] = exposure
+    img.save(path, exif=exif)
+
+
+class TestFolderIndex:
+    """フォルダインデックスのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        for name in ('b.jpg', 'a.JPG', 'c.png'):
+            make_image(os.path.join(self.temp_dir, name))
+        open(os.path.join(self.temp_dir, 'memo.txt'), 'w').close()
+        os.makedirs(os.path.join(self.temp_dir, 'sub'))
+        os.makedirs(os.path.join(self.temp_dir, '.hidden'))
+        make_image(os.path.join(self.temp_dir, 'sub', 'd.jpg'))
+        make_image(os.path.join(self.temp_dir, '.hidden', 'e.jpg'))
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_scan_lists_images(self):
+        """画像だけがファイル名順に列挙されるテスト"""
+        index = FolderIndex(self.temp_dir)
+        changes = index.scan()
+
+        assert index.names() == ['a.JPG', 'b.jpg', 'c.png']
+        assert sorted(changes.added) == ['a.JPG', 'b.jpg', 'c.png']
+
+    def test_recursive(self):
+        """サブフォルダも含め、隠しフォルダは除外されるテスト"""
+        index = FolderIndex(self.temp_dir, recursive=True)
+        index.scan()
+
+        assert os.path.join('sub', 'd.jpg') in index.names()
+        assert not any('e.jpg' in name for name in index.names())
+
+    def test_excluded_folder(self):
+        """サブフォルダにある保存先などの除外フォルダは走査されないテスト"""
+        index = FolderIndex(self.temp_dir, recursive=True, exclude=[os.path.join(self.temp_dir, 'sub')])
+        index.scan()
+
+        assert index.names() == ['a.JPG', 'b.jpg', 'c.png']
+
+    def test_extra_extensions(self):
+        """追加の拡張子が一覧に含まれるテスト"""
+        index = FolderIndex(self.temp_dir, extensions=['.txt'])
+        index.scan()
+
+        assert 'memo.txt' in index.names()
+
+    def test_rescan_reports_changes(self):
+        """再走査で追加・変更・削除が検出されるテスト"""
+        index = FolderIndex(self.temp_dir)
+        index.scan()
+        os.remove(os.path.join(self.temp_dir, 'a.JPG'))
+        make_image(os.path.join(self.temp_dir, 'f.jpg'))
+        path = os.path.join(self.temp_dir, 'b.jpg')
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+        changes = index.scan()
+
+        assert changes.added == ['f.jpg']
+        assert changes.changed == ['b.jpg']
+        assert changes.removed == ['a.JPG']
+        assert index.scan().reordered is False
+
+    def test_mtime_order(self):
+        """更新日時順に並ぶテスト"""
+        for i, name in enumerate(('c.png', 'a.JPG', 'b.jpg')):
+            os.utime(os.path.join(self.temp_dir, name), ns=(0, (i + 1) * 10**9))
+        index = FolderIndex(self.temp_dir, order='mtime')
+        index.scan()
+
+        assert index.names() == ['c.png', 'a.JPG', 'b.jpg']
+
+    def test_capture_order(self):
+        """撮影日時順に並ぶテスト（EXIFが無いファイルは更新日時で代用）"""
+        make_image(os.path.join(self.temp_dir, 'a.JPG'), '2030:01:02 03:04:05')
+        make_image(os.path.join(self.temp_dir, 'b.jpg'), '2000:01:01 00:00:00')
+        os.utime(os.path.join(self.temp_dir, 'c.png'), ns=(0, 3 * 10**18))
+        index = FolderIndex(self.temp_dir, order='capture')
+        index.scan()
+
+        assert index.load_metadata() == 3
+        assert index.names() == ['b.jpg', 'a.JPG', 'c.png']
+
+    def test_shutter_order_and_filter(self):
+        """シャッター速度の遅い順（値が無いものは末尾）に並び、条件を満たす画像だけに絞り込まれるテスト"""
+        make_image(os.path.join(self.temp_dir, 'a.JPG'), exposure=1 / 250)
+        make_image(os.path.join(self.temp_dir, 'b.jpg'), exposure=1 / 15)
+        index = FolderIndex(self.temp_dir, order='shutter')
+        index.scan()
+        index.load_metadata()
+
+        assert index.names() == ['b.jpg', 'a.JPG', 'c.png']
+
+        index = FolderIndex(self.temp_dir, where='shutter > 1/60')
+        index.scan()
+        # 撮影情報を読み取るまでは一覧に含まれない
+        assert index.needs_metadata
+        assert index.names() == []
+        index.load_metadata()
+        assert index.names() == ['b.jpg']
+
+    def test_invalid_filter(self):
+        """書式が正しくない絞り込み条件はValueErrorになるテスト"""
+        with pytest.raises(ValueError):
+            FolderIndex(self.temp_dir, where='speed > 1')
+
+
+class TestIndexWatcher:
+    """フォルダ監視のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        make_image(os.path.join(self.temp_dir, 'a.jpg'))
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def wait_for_changes(self, watcher, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            changes = watcher.poll()
+            if changes is not None:
+                return changes
+            time.sleep(0.02)
+        return None
+
+    def test_initial_scan(self):
+        """initial=Trueなら最初の走査を監視スレッドで行い、終わるとreadyがセットされるテスト"""
+        index = FolderIndex(self.temp_dir, where='iso >= 0')
+        watcher = IndexWatcher(index, interval=0, initial=True)
+        try:
+            assert watcher.ready.wait(5)
+        finally:
+            watcher.stop()
+
+        assert list(index.entries) == ['a.jpg']
+        assert index.entries['a.jpg'].meta is not None
+        assert watcher.poll() is None
+
+    def test_detects_added_file(self):
+        """追加されたファイルが通知されるテスト"""
+        index = FolderIndex(self.temp_dir)
+        index.scan()
+        watcher = IndexWatcher(index, interval=0.05)
+        try:
+            make_image(os.path.join(self.temp_dir, 'b.jpg'))
+            changes = self.wait_for_changes(watcher)
+        finally:
+            watcher.stop()
+
+        assert changes is not None
+        assert changes.added == ['b.jpg']
+        assert index.names() == ['a.jpg', 'b.jpg']
+
+    def test_no_rescan_when_disabled(self):
+        """間隔が0なら再走査しないテスト"""
+        index = FolderIndex(self.temp_dir)
+        index.scan()
+        watcher = IndexWatcher(index, interval=0)
+        make_image(os.path.join(self.temp_dir, 'b.jpg'))
+        time.sleep(0.1)
+
+        assert watcher.poll() is None
+        assert index.names() == ['a.jpg']
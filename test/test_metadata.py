@@ -0,0 +1,147 @@
+import pytest
+import os
+import io
+import struct
+import sys
+import tempfile
+from datetime import datetime
+from PIL import Image, TiffImagePlugin
+import numpy as np
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from metadata import (ImageMetadata, read_metadata, read_thumbnail, apply_orientation, oriented_size, source_box,
+                      parse_filter, matches)
+
+
+def make_jpeg(path, orientation=1):
+    exif = Image.Exif()
+    exif[0x010F] = 'FUJIFILM'
+    exif[0x0110] = 'X-T4'
+    exif[0x0112] = orientation
+    exif[0x0132] = '2020:01:01 00:00:00'
+    sub = exif.get_ifd(0x8769)
+    sub[0x829A] = TiffImagePlugin.IFDRational(1, 60)
+    sub[0x829D] = TiffImagePlugin.IFDRational(28, 10)
+    sub[0x8827] = 1600
+    sub[0x9003] = '2021:02:03 04:05:06'
+    sub[0x920A] = TiffImagePlugin.IFDRational(35, 1)
+    sub[0xA434] = 'XF35mmF1.4 R'
+    Image.new('RGB', (64, 48), (90, 90, 90)).save(path, exif=exif)
+
+
+def make_tiff_with_thumbnail(path, orientation):
+    # IFD0に向き、IFD1に埋め込みサムネイル(8x6のJPEG)を持つTIFF形式のファイル
+    buf = io.BytesIO()
+    Image.new('RGB', (8, 6), (200, 30, 30)).save(buf, 'JPEG')
+    thumb = buf.getvalue()
+    ifd1_offset = 8 + 2 + 12 + 4
+    data_offset = ifd1_offset + 2 + 12 * 2 + 4
+    data = b'II*\x00' + struct.pack('<I', 8)
+    data += struct.pack('<H', 1) + struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0)
+    data += struct.pack('<I', ifd1_offset)
+    data += struct.pack('<H', 2) + struct.pack('<HHII', 0x0201, 4, 1, data_offset)
+    data += struct.pack('<HHII', 0x0202, 4, 1, len(thumb)) + struct.pack('<I', 0)
+    with open(path, 'wb') as f:
+        f.write(data + thumb)
+
+
+class TestReadMetadata:
+    """撮影情報の読み取りのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_jpeg(self):
+        """JPEGのEXIFから撮影情報が読み取られるテスト"""
+        path = os.path.join(self.temp_dir, 'a.jpg')
+        make_jpeg(path, orientation=6)
+
+        meta = read_metadata(path)
+
+        assert meta.orientation == 6
+        assert meta.capture_time == datetime(2021, 2, 3, 4, 5, 6).timestamp()
+        assert meta.camera == 'FUJIFILM X-T4'
+        assert meta.lens == 'XF35mmF1.4 R'
+        assert meta.exposure_time == pytest.approx(1 / 60)
+        assert meta.f_number == pytest.approx(2.8)
+        assert meta.iso == 1600
+        assert meta.summary() == '1/60 f/2.8 ISO1600 35mm'
+
+    def test_png_with_exif(self):
+        """JPEG以外はPillowでヘッダーだけ開いてEXIFが読み取られるテスト"""
+        path = os.path.join(self.temp_dir, 'a.png')
+        exif = Image.Exif()
+        exif[0x0112] = 8
+        Image.new('RGB', (16, 16)).save(path, exif=exif)
+
+        assert read_metadata(path).orientation == 8
+
+    def test_without_exif(self):
+        """EXIFが無い・壊れたファイルは空の撮影情報になるテスト"""
+        path = os.path.join(self.temp_dir, 'a.png')
+        Image.new('RGB', (16, 16)).save(path)
+        broken = os.path.join(self.temp_dir, 'b.jpg')
+        with open(broken, 'wb') as f:
+            f.write(b'\xff\xd8\xff\xe1\x00\x10Exif\x00\x00II*\x00\xff\xff')
+
+        for meta in (read_metadata(path), read_metadata(broken)):
+            assert meta.orientation == 1
+            assert meta.capture_time is None
+            assert meta.summary() == ''
+
+    def test_thumbnail(self):
+        """埋め込みサムネイルが向きを直して取り出されるテスト"""
+        path = os.path.join(self.temp_dir, 'a.dng')
+        make_tiff_with_thumbnail(path, 6)
+
+        meta = read_metadata(path)
+        thumb = read_thumbnail(path, meta)
+
+        assert meta.orientation == 6
+        assert thumb.size == (6, 8)
+        assert read_thumbnail(path, ImageMetadata()) is None
+
+
+class TestOrientation:
+    """向きの補正のテスト"""
+
+    @pytest.mark.parametrize('orientation', range(1, 9))
+    def test_source_box(self, orientation):
+        """向きを直した画像上の範囲が元ファイル上の同じ画素の範囲に変換されるテスト"""
+        rng = np.random.default_rng(orientation)
+        source = Image.fromarray(rng.integers(0, 256, (30, 40, 3), dtype=np.uint8))
+        oriented = apply_orientation(source, orientation)
+        box = (3, 5, 17, 12)
+
+        region = apply_orientation(source.crop(source_box(box, source.size, orientation)), orientation)
+
+        assert oriented.size == oriented_size(source.size, orientation)
+        assert np.array_equal(np.asarray(region), np.asarray(oriented.crop(box)))
+
+
+class TestFilter:
+    """絞り込み条件のテスト"""
+
+    def test_matches(self):
+        """数値・分数・文字列の条件がすべて満たされたときだけ一致するテスト"""
+        meta = ImageMetadata(make='Canon', model='Canon EOS R5', exposure_time=1 / 30, iso=3200)
+
+        assert matches(meta, parse_filter('shutter > 1/60'))
+        assert matches(meta, parse_filter('shutter >= 1/30, iso>=1600, camera = "canon eos r5"'))
+        assert not matches(meta, parse_filter('shutter > 1/60, iso < 800'))
+        # 項目が無い画像は満たさない
+        assert not matches(meta, parse_filter('aperture < 4'))
+        assert matches(meta, parse_filter(''))
+
+    def test_invalid(self):
+        """書式が正しくない条件はValueErrorになるテスト"""
+        for text in ('shutter', 'speed > 1/60', 'iso >> 100'):
+            with pytest.raises(ValueError):
+                parse_filter(text)
@@ -0,0 +1,137 @@
+import pytest
+import os
+import sys
+import io
+import json
+import time
+import tempfile
+import threading
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from metrics import Metrics, timed, RECENT
+
+
+class TestMetrics:
+    """処理時間・カウンターの記録と書き出しのテスト"""
+
+    def test_span(self):
+        """区間の回数・所要時間が記録されるテスト"""
+        metrics = Metrics()
+        for _ in range(3):
+            with metrics.span('decode'):
+                time.sleep(0.01)
+
+        stats = metrics.summary()['decode']
+
+        assert stats['count'] == 3
+        assert 10 <= stats['p50_ms'] <= stats['p99_ms'] <= stats['max_ms']
+        assert len(metrics.events) == 3
+
+    def test_span_records_on_error(self):
+        """例外で抜けた区間も記録されるテスト"""
+        metrics = Metrics()
+        with pytest.raises(ValueError):
+            with metrics.span('load'):
+                raise ValueError('broken')
+
+        assert metrics.summary()['load']['count'] == 1
+
+    def test_disabled(self):
+        """無効の場合は何も記録しないテスト"""
+        metrics = Metrics(enabled=False)
+        with metrics.span('decode'):
+            pass
+        metrics.count('prefetch.hit')
+        metrics.gauge('prefetch.queue', 3)
+
+        assert metrics.summary() == {}
+        assert metrics.counters == {} and metrics.gauges == {}
+        assert len(metrics.events) == 0
+
+    def test_percentiles_use_recent(self):
+        """中央値・p99は直近RECENT回分から求めるテスト"""
+        metrics = Metrics()
+        for _ in range(RECENT):
+            metrics.record('show', 0, 100 * 10 ** 6)
+        for _ in range(RECENT):
+            metrics.record('show', 0, 10 ** 6)
+
+        stats = metrics.summary()['show']
+
+        assert stats['p99_ms'] == pytest.approx(1.0)
+        assert stats['max_ms'] == pytest.approx(100.0)
+        assert stats['count'] == RECENT * 2
+
+    def test_counters_and_gauges(self):
+        """カウンターとヒット率、値の変化だけがトレースに残るテスト"""
+        metrics = Metrics()
+        assert metrics.hit_rate('prefetch') is None
+        metrics.count('prefetch.hit', 3)
+        metrics.count('prefetch.miss')
+        metrics.gauge('prefetch.queue', 2)
+        metrics.gauge('prefetch.queue', 2)
+        metrics.gauge('prefetch.queue', 0)
+
+        assert metrics.hit_rate('prefetch') == 0.75
+        assert metrics.gauges == {'prefetch.queue': 0}
+        assert [e[3] for e in metrics.events] == [2, 0]
+        assert 'prefetch.hit' in metrics.format_table()
+
+    def test_trace_limit(self):
+        """トレースは上限件数を超えると古いものから捨てるテスト"""
+        metrics = Metrics(trace_limit=5)
+        for i in range(10):
+            metrics.record('show', i, 1)
+
+        assert [e[2] for e in metrics.events] == [i - metrics.origin for i in range(5, 10)]
+        assert metrics.summary()['show']['count'] == 10
+
+    def test_export_chrome(self):
+        """Chromeのトレース形式でスレッド名と区間・値が書き出されるテスト"""
+        metrics = Metrics()
+        thread = threading.Thread(target=lambda: metrics.record('load', metrics.origin + 2000, 3000),
+                                  name='prefetch_0')
+        thread.start()
+        thread.join()
+        metrics.gauge('prefetch.queue', 1)
+        out = io.StringIO()
+
+        metrics.export_chrome(out)
+        events = json.loads(out.getvalue())['traceEvents']
+
+        assert {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread.ident,
+                'args': {'name': 'prefetch_0'}} in events
+        span = next(e for e in events if e['ph'] == 'X')
+        assert (span['name'], span['ts'], span['dur'], span['tid']) == ('load', 2.0, 3.0, thread.ident)
+        assert next(e for e in events if e['ph'] == 'C')['args'] == {'value': 1}
+
+    def test_export_jsonl(self):
+        """拡張子が.json以外ならJSON Linesで書き出されるテスト"""
+        metrics = Metrics()
+        metrics.record('show', metrics.origin, 2 * 10 ** 6)
+        metrics.count('prefetch.hit')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'trace.jsonl')
+            metrics.export(path)
+            with open(path, encoding='utf-8') as f:
+                lines = [json.loads(line) for line in f]
+
+        assert lines[0] == {'type': 'span', 'name': 'show', 'ts_ms': 0.0, 'dur_ms': 2.0, 'thread': 'MainThread'}
+        assert lines[-1] == {'type': 'counters', 'values': {'prefetch.hit': 1}}
+
+    def test_timed(self):
+        """デコレーターでメソッドの実行時間がself.metricsに記録されるテスト"""
+        class Viewer:
+            def __init__(self):
+                self.metrics = Metrics()
+
+            @timed('show_image')
+            def show_image(self, n):
+                return n * 2
+
+        viewer = Viewer()
+
+        assert viewer.show_image(3) == 6
+        assert viewer.show_image.__name__ == 'show_image'
+        assert viewer.metrics.summary()['show_image']['count'] == 1
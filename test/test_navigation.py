@@ -0,0 +1,56 @@
+import pytest
+import os
+import sys
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from navigation import Navigator
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestNavigator:
+    """キー送りのまとめ・スクロール判定のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.clock = FakeClock()
+        self.nav = Navigator(0.15, clock=self.clock)
+
+    def test_coalesces_moves(self):
+        """表示の予約は最初の移動だけ必要で、表示時には最後の移動先が返されるテスト"""
+        assert self.nav.move(1) is True
+        assert self.nav.move(2) is False
+        assert self.nav.move(3) is False
+
+        assert self.nav.take() == 3
+        assert self.nav.coalesced == 2
+        # 表示した後の移動は再び予約が必要
+        assert self.nav.move(4) is True
+
+    def test_scrolling(self):
+        """最後の移動から一定時間はスクロール中と判定されるテスト"""
+        assert self.nav.scrolling() is False
+        self.nav.move(1)
+        self.clock.now += 0.1
+
+        assert self.nav.scrolling() is True
+        assert self.nav.settle_delay() == pytest.approx(0.05)
+
+        self.clock.now += 0.1
+        assert self.nav.scrolling() is False
+        assert self.nav.settle_delay() == 0.0
+
+    def test_direction(self):
+        """送りの方向が記録されるテスト"""
+        self.nav.move(5)
+        self.nav.move(4)
+        assert self.nav.direction == -1
+        self.nav.move(6)
+        assert self.nav.direction == 1
@@ -38,9 +38,24 @@ class TestAppConfig:
         assert config.key_next == 'Right'
         assert config.key_prev == 'Left'
         assert config.key_delete == 'D'
+        assert config.key_next_blur == 'B'
+        assert config.key_next_sharp == 'S'
+        assert config.key_sort_blur == 'O'
         assert config.zoom_range == 10
         assert config.zoom_scale == 10
-        assert config.blur_threshold == 100.0
+        assert config.blur_threshold == 2000.0
+        assert config.blur_metric == 'laplacian'
+        assert config.blur_analysis_size == 1024
+        assert config.blur_tiles == 1
+        assert config.blur_scan is True
+        assert config.blur_jobs == 0
+        assert config.prefetch_ahead == 3
+        assert config.prefetch_behind == 1
+        assert config.prefetch_cache_mb == 512
+        assert config.prefetch_workers == 2
+        assert config.cache_enabled is True
+        assert config.cache_dir == ''
+        assert config.cache_content_hash is False
         assert config.last_open_dir == ''
         assert config.last_save_dir == ''
     
@@ -134,28 +149,39 @@ class TestPhotoSelectorApp:
         with patch.object(PhotoSelectorApp, 'load_images'), \
              patch.object(PhotoSelectorApp, 'show_image'):
             app = PhotoSelectorApp(self.config)
+            # フォルダの読み込みはウィンドウを表示した後に行われる
+            assert app.open_dir == ''
+            app.open_first_folder()
             
             assert app.config == self.config
             assert app.current_index == 0
             assert app.delete_list == []
             assert app.open_dir == '/test/open'
             assert app.save_dir == '/test/save'
-            assert app.prefetch_cache == {}
+            assert len(app.prefetch_cache) == 0
     
-    @patch('os.listdir')
-    def test_load_images(self, mock_listdir):
+    def test_load_images(self):
         """画像読み込みテスト"""
-        mock_listdir.return_value = [
-            'image1.jpg', 'image2.PNG', 'image3.heic',
-            'document.txt', 'image4.jpeg', 'image5.HEIC'
-        ]
+        open_dir = os.path.join(self.temp_dir, 'open')
+        os.makedirs(open_dir)
+        for name in ['image1.jpg', 'image2.PNG', 'image3.heic',
+                     'document.txt', 'image4.jpeg', 'image5.HEIC']:
+            open(os.path.join(open_dir, name), 'w').close()
         
         with patch('tkinter.Tk'), \
              patch('tkinter.filedialog.askdirectory', side_effect=['/test/open', '/test/save']), \
-             patch.object(PhotoSelectorApp, 'show_image'):
+             patch.object(PhotoSelectorApp, 'show_image'), \
+             patch.object(PhotoSelectorApp, 'show_when_loaded'):
             app = PhotoSelectorApp(self.config)
-            app.open_dir = '/test/open'
+            app.open_dir = open_dir
+            app.undo_stack = [('delete', 'other.jpg', None, 'unrated')]
             app.load_images()
+            # 前のフォルダの取り消し履歴は持ち越さない
+            assert app.undo_stack == []
+            # フォルダの走査は監視スレッドで行い、終わってから一覧を作る
+            assert app.image_list == []
+            assert app.index_watcher.ready.wait(5)
+            app.poll_first_scan()
             
             expected_images = ['image1.jpg', 'image2.PNG', 'image3.heic', 'image4.jpeg', 'image5.HEIC']
             assert sorted(app.image_list) == sorted(expected_images)
@@ -188,7 +214,8 @@ class TestPhotoSelectorApp:
         with patch('tkinter.Tk'), \
              patch('tkinter.filedialog.askdirectory', side_effect=['/test/open', '/test/save']), \
              patch.object(PhotoSelectorApp, 'show_image'), \
-             patch('pillow_heif.register_heif_opener') as mock_heif:
+             patch('pillow_heif.register_heif_opener') as mock_heif, \
+             patch('decode._heif_registered', False):
             app = PhotoSelectorApp(self.config)
             
             result = app.load_image('/test/image.heic')
@@ -221,35 +248,36 @@ class TestPhotoSelectorApp:
             # テスト用画像を作成
             test_img = Image.new('RGB', (100, 100), color='white')
             
-            with patch('numpy.array') as mock_array, \
-                 patch('cv2.Laplacian') as mock_laplacian:
-                mock_array.return_value = np.zeros((100, 100))
-                mock_lap = Mock()
-                mock_lap.var.return_value = 50.0  # blur_threshold (100.0) より小さい値
-                mock_laplacian.return_value = mock_lap
+            with patch.object(app.sharpness, 'score') as mock_score:
+                mock_score.return_value = 50.0  # blur_threshold (2000.0) より小さい値
                 
                 result = app.is_blur(test_img)
                 
                 assert result is True
+                mock_score.assert_called_once_with(test_img)
                 
                 # 閾値より大きい値の場合
-                mock_lap.var.return_value = 150.0
+                mock_score.return_value = 150.0
                 result = app.is_blur(test_img)
                 assert result is False
+            
+            # 実画像：無地はぼやけ、ノイズはシャープと判定される
+            assert app.is_blur(test_img) is True
+            noise = Image.fromarray(np.random.default_rng(0).integers(0, 256, (100, 100), dtype=np.uint8))
+            assert app.is_blur(noise) is False
     
     def test_next_image(self):
         """次の画像に移動するテスト"""
         with patch('tkinter.Tk'), \
              patch('tkinter.filedialog.askdirectory', side_effect=['/test/open', '/test/save']), \
-             patch.object(PhotoSelectorApp, 'show_image') as mock_show:
+             patch.object(PhotoSelectorApp, 'navigate') as mock_show:
             app = PhotoSelectorApp(self.config)
             app.image_list = ['img1.jpg', 'img2.jpg', 'img3.jpg']
             app.current_index = 0
             
             app.next_image()
             
-            assert app.current_index == 1
-            mock_show.assert_called_once()
+            mock_show.assert_called_once_with(1)
             
             # 最後の画像の場合、インデックスは変わらない
             app.current_index = 2
@@ -258,20 +286,41 @@ class TestPhotoSelectorApp:
             
             assert app.current_index == 2
             mock_show.assert_not_called()
+
+    def test_key_repeat_coalesced(self):
+        """キーリピートで溜まった移動はまとめて最後の移動先だけ表示されるテスト"""
+        with patch('tkinter.Tk'), \
+             patch('tkinter.filedialog.askdirectory', side_effect=['/test/open', '/test/save']), \
+             patch.object(PhotoSelectorApp, 'after_idle') as mock_idle, \
+             patch.object(PhotoSelectorApp, 'show_image') as mock_show, \
+             patch.object(PhotoSelectorApp, 'show_when_loaded') as mock_wait:
+            app = PhotoSelectorApp(self.config)
+            app.image_list = [f'img{i}.jpg' for i in range(10)]
+            app.current_index = 0
+
+            for _ in range(5):
+                app.next_image()
+            mock_idle.assert_called_once_with(app.show_target)
+            app.show_target()
+
+            assert app.current_index == 5
+            assert app.navigator.coalesced == 4
+            # 先読みされていない画像は待たずに読み込みを待つ
+            mock_wait.assert_called_once()
+            mock_show.assert_not_called()
     
     def test_prev_image(self):
         """前の画像に移動するテスト"""
         with patch('tkinter.Tk'), \
              patch('tkinter.filedialog.askdirectory', side_effect=['/test/open', '/test/save']), \
-             patch.object(PhotoSelectorApp, 'show_image') as mock_show:
+             patch.object(PhotoSelectorApp, 'navigate') as mock_show:
             app = PhotoSelectorApp(self.config)
             app.image_list = ['img1.jpg', 'img2.jpg', 'img3.jpg']
             app.current_index = 2
             
             app.prev_image()
             
-            assert app.current_index == 1
-            mock_show.assert_called_once()
+            mock_show.assert_called_once_with(1)
             
             # 最初の画像の場合、インデックスは変わらない
             app.current_index = 0
@@ -300,9 +349,8 @@ class TestPhotoSelectorApp:
             app.mark_delete()
             assert app.delete_list.count('img1.jpg') == 1
     
-    @patch('shutil.copy2')
-    def test_copy_and_next_success(self, mock_copy):
-        """コピーアンドネクスト成功テスト"""
+    def test_copy_and_next_success(self):
+        """コピーアンドネクスト成功テスト（コピーはキューに積まれ、次の画像へ進む）"""
         with patch('tkinter.Tk'), \
              patch('tkinter.filedialog.askdirectory', side_effect=['/test/open', '/test/save']), \
              patch.object(PhotoSelectorApp, 'show_image'), \
@@ -313,15 +361,17 @@ class TestPhotoSelectorApp:
             app.open_dir = '/test/open'
             app.save_dir = '/test/save'
             
-            app.copy_and_next()
+            with patch.object(app.file_queue, 'submit') as mock_submit:
+                app.copy_and_next()
             
-            mock_copy.assert_called_once_with('/test/open/img1.jpg', '/test/save/img1.jpg')
+            mock_submit.assert_called_once_with('keep', '/test/open/img1.jpg', '/test/save/img1.jpg',
+                                                strategy='auto', sidecars=[])
             mock_next.assert_called_once()
     
     @patch('shutil.copy2')
     @patch('tkinter.messagebox.showerror')
     def test_copy_and_next_failure(self, mock_messagebox, mock_copy):
-        """コピーアンドネクスト失敗テスト"""
+        """コピーアンドネクスト失敗テスト（失敗はまとめて1回だけ報告される）"""
         mock_copy.side_effect = Exception("Copy failed")
         
         with patch('tkinter.Tk'), \
@@ -329,15 +379,42 @@ class TestPhotoSelectorApp:
              patch.object(PhotoSelectorApp, 'show_image'), \
              patch.object(PhotoSelectorApp, 'next_image') as mock_next:
             app = PhotoSelectorApp(self.config)
-            app.image_list = ['img1.jpg']
+            app.file_queue.retry_delay = 0
+            app.image_list = ['img1.jpg', 'img2.jpg']
             app.current_index = 0
             app.open_dir = '/test/open'
             app.save_dir = '/test/save'
             
             app.copy_and_next()
+            app.current_index = 1
+            app.copy_and_next()
+            mock_messagebox.assert_not_called()
+            app.finish_file_operations()
+            app.report_fileop_errors()
             
             mock_messagebox.assert_called_once()
-            mock_next.assert_called_once()
+            assert mock_next.call_count == 2
+    
+    def test_undo_last(self):
+        """直前のコピーと削除マークの取り消しテスト"""
+        with patch('tkinter.Tk'), \
+             patch('tkinter.filedialog.askdirectory', side_effect=['/test/open', '/test/save']), \
+             patch.object(PhotoSelectorApp, 'show_image'), \
+             patch.object(PhotoSelectorApp, 'next_image'):
+            app = PhotoSelectorApp(self.config)
+            app.image_list = ['img1.jpg', 'img2.jpg']
+            app.current_index = 0
+            app.copy_and_next()
+            app.current_index = 1
+            app.mark_delete()
+            
+            app.undo_last()
+            assert app.delete_list == []
+            assert app.current_index == 1
+            
+            app.undo_last()
+            assert app.file_queue.pending == 0
+            assert app.current_index == 0
     
     def test_save_delete_list(self):
         """削除リスト保存テスト"""
@@ -369,11 +446,9 @@ class TestPhotoSelectorApp:
             
             app.delete_files()
             
-            expected_calls = [
-                (('/test/open/img1.jpg',), {}),
-                (('/test/open/img2.jpg',), {})
-            ]
-            assert mock_remove.call_args_list == expected_calls
+            # 削除はワーカースレッドで並行して実行されるため順不同で比較
+            removed = sorted(call.args[0] for call in mock_remove.call_args_list)
+            assert removed == ['/test/open/img1.jpg', '/test/open/img2.jpg']
     
     @patch('os.remove')
     @patch('tkinter.messagebox.showerror')
@@ -404,13 +479,14 @@ class TestPhotoSelectorApp:
             app.image_frame.winfo_width.return_value = 800
             app.image_frame.winfo_height.return_value = 600
             
-            # テスト用画像を作成
-            test_img = Mock()
-            test_img.resize.return_value = Mock()
+            # テスト用画像を作成（フレームより横長）
+            test_img = Image.new('RGB', (2000, 1000))
             
-            result = app.resize_image(test_img)
+            with patch.object(test_img, 'resize', return_value=Mock()) as mock_resize:
+                result = app.resize_image(test_img)
             
-            test_img.resize.assert_called_once_with((800, 600), Image.LANCZOS)
+            # アスペクト比を保ってフレームに収める
+            mock_resize.assert_called_once_with((800, 400), Image.LANCZOS)
             assert result is not None
 
 
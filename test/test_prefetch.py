@@ -0,0 +1,153 @@
+import pytest
+import os
+import sys
+import threading
+from PIL import Image
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from prefetch import LRUImageCache, PrefetchEngine, image_nbytes
+from metrics import Metrics
+
+
+class TestLRUImageCache:
+    """LRUImageCacheクラスのテスト"""
+
+    def test_image_nbytes(self):
+        """画像サイズ計算のテスト"""
+        assert image_nbytes(Image.new('RGB', (10, 20))) == 600
+        assert image_nbytes(Image.new('L', (10, 20))) == 200
+        assert image_nbytes(None) == 0
+
+    def test_evicts_least_recently_used(self):
+        """上限超過時に最も古い要素が破棄されるテスト"""
+        cache = LRUImageCache(max_bytes=2 * 300)
+        cache.put('a', Image.new('RGB', (10, 10)))
+        cache.put('b', Image.new('RGB', (10, 10)))
+        cache.get('a')  # aを最近使用にする
+        cache.put('c', Image.new('RGB', (10, 10)))
+
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+        assert cache.nbytes == 600
+
+    def test_oversized_item_is_not_cached(self):
+        """上限より大きい画像はキャッシュしないテスト"""
+        cache = LRUImageCache(max_bytes=100)
+        cache.put('big', Image.new('RGB', (10, 10)))
+
+        assert len(cache) == 0
+        assert cache.nbytes == 0
+
+    def test_replace_and_clear(self):
+        """同一キーの上書きとクリアのテスト"""
+        cache = LRUImageCache(max_bytes=10000)
+        cache.put('a', Image.new('RGB', (10, 10)))
+        cache.put('a', Image.new('RGB', (20, 10)))
+        assert cache.nbytes == 600
+        assert cache.pop('a').size == (20, 10)
+        cache.put('b', Image.new('RGB', (10, 10)))
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.nbytes == 0
+
+
+class TestPrefetchEngine:
+    """PrefetchEngineクラスのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def loader(self, key):
+        with self.lock:
+            self.calls.append(key)
+        if key == 'broken':
+            return None
+        return Image.new('RGB', (4, 4))
+
+    def test_get_uses_prefetched_image(self):
+        """先読み済みの画像はローダーを再実行しないテスト"""
+        engine = PrefetchEngine(self.loader, 1024 * 1024, workers=2)
+        try:
+            engine.schedule(['a', 'b'])
+            img_a = engine.get('a')
+            img_b = engine.get('b')
+
+            assert img_a is not None and img_b is not None
+            assert sorted(self.calls) == ['a', 'b']
+        finally:
+            engine.shutdown()
+
+    def test_get_loads_on_miss(self):
+        """未先読みの画像はその場で読み込むテスト"""
+        engine = PrefetchEngine(self.loader, 1024 * 1024)
+        try:
+            assert engine.get('x') is not None
+            assert 'x' in engine.cache
+            assert engine.get('broken') is None
+            assert 'broken' not in engine.cache
+        finally:
+            engine.shutdown()
+
+    def test_metrics(self):
+        """キャッシュのヒット・ミスの回数が記録されるテスト"""
+        metrics = Metrics()
+        engine = PrefetchEngine(self.loader, 1024 * 1024, metrics=metrics)
+        try:
+            engine.get('x')
+            engine.get('x')
+            engine.get('x')
+
+            assert metrics.counters == {'prefetch.hit': 2, 'prefetch.miss': 1}
+            assert metrics.hit_rate('prefetch') == pytest.approx(2 / 3)
+        finally:
+            engine.shutdown()
+
+    def test_schedule_cancels_out_of_window(self):
+        """範囲外になった未着手の先読みが取り消されるテスト"""
+        gate = threading.Event()
+
+        def slow_loader(key):
+            gate.wait(5)
+            return self.loader(key)
+
+        engine = PrefetchEngine(slow_loader, 1024 * 1024, workers=1)
+        try:
+            engine.schedule(['a', 'b', 'c'])
+            engine.schedule(['a'])
+            gate.set()
+            engine.get('a')
+
+            assert 'b' not in self.calls
+            assert 'c' not in self.calls
+        finally:
+            engine.shutdown()
+
+    def test_stale_load_is_abandoned(self):
+        """読み込み中に対象外になったキーはstale()で途中でやめられるテスト"""
+        started, gate = threading.Event(), threading.Event()
+        results = {}
+
+        def loader(key):
+            started.set()
+            gate.wait(5)
+            results[key] = engine.stale()
+            return None if results[key] else self.loader(key)
+
+        engine = PrefetchEngine(loader, 1024 * 1024, workers=1)
+        try:
+            engine.schedule(['a'])
+            started.wait(5)
+            engine.schedule(['b'])
+            gate.set()
+            engine.get('b')
+
+            assert results == {'a': True, 'b': False}
+            assert 'a' not in engine.cache
+            # getから直接読み込む場合は対象外にならない
+            assert engine.stale() is False
+        finally:
+            engine.shutdown()
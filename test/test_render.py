@@ -0,0 +1,146 @@
+import pytest
+import os
+import sys
+from PIL import Image
+from unittest.mock import patch
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from decode import DisplayImage
+from render import Renderer, resample_filter, blur_label, blank_cell, small_blur_label, CELL_BACKGROUND
+
+
+class TestRenderer:
+    """表示画像の描画パイプラインのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.renderer = Renderer(zoom_range=10, zoom_scale=2)
+        self.frame = DisplayImage(Image.new('RGB', (400, 300), (0, 128, 0)), (1600, 1200),
+                                  zoom=Image.new('RGB', (20, 20), (0, 0, 255)), blur_score=10.0)
+        self.box = (790, 590, 810, 610)
+
+    def test_render_layers(self):
+        """縮小画像に拡大枠・拡大図・ラベルが描かれるテスト"""
+        img = self.renderer.render('a.jpg', self.frame, (200, 150), self.box, blur=True)
+
+        assert img.size == (200, 150)
+        assert img.getpixel((10, 30)) == blur_label().getpixel((10, 30))
+        # 拡大図は右下（下部マージンを除く）に貼られる
+        assert img.getpixel((200 - 10 - 20, 150 - 60 - 20)) == (0, 0, 255)
+        assert img.getpixel((150, 20)) == (0, 128, 0)
+
+    def test_source_is_not_modified(self):
+        """描画は縮小後のバッファに対して行われ、元の画像は変更されないテスト"""
+        self.renderer.render('a.jpg', self.frame, (400, 300), self.box, blur=True)
+
+        assert self.frame.image.getpixel((0, 0)) == (0, 128, 0)
+        assert self.frame.zoom.getpixel((0, 0)) == (0, 0, 255)
+
+    def test_render_is_cached(self):
+        """同じ条件の描画はキャッシュから返され、条件が変われば描き直すテスト"""
+        first = self.renderer.render('a.jpg', self.frame, (200, 150), self.box, blur=False)
+
+        assert self.renderer.render('a.jpg', self.frame, (200, 150), self.box, blur=False) is first
+        assert self.renderer.render('a.jpg', self.frame, (300, 200), self.box, blur=False) is not first
+
+    def test_inset_is_reused(self):
+        """拡大図はサイズが変わっても作り直されないテスト"""
+        self.renderer.render('a.jpg', self.frame, (200, 150), self.box, blur=False)
+        with patch.object(self.frame.zoom, 'resize') as mock_resize:
+            self.renderer.render('a.jpg', self.frame, (300, 200), self.box, blur=False)
+
+        mock_resize.assert_not_called()
+
+    def test_new_frame_invalidates(self):
+        """画像が読み直された場合はキャッシュを使わないテスト"""
+        first = self.renderer.render('a.jpg', self.frame, (200, 150), self.box, blur=False)
+        frame = DisplayImage(self.frame.image.copy(), self.frame.original_size, self.frame.zoom.copy(), 10.0)
+
+        assert self.renderer.render('a.jpg', frame, (200, 150), self.box, blur=False) is not first
+
+    def test_fast_filter(self):
+        """fast指定時は軽いフィルタで縮小するテスト"""
+        renderer = Renderer(10, 2, filter='lanczos', fast_filter='nearest')
+        with patch.object(self.frame.image, 'resize', return_value=Image.new('RGB', (400, 300))) as mock_resize:
+            renderer.render('a.jpg', self.frame, (400, 300), self.box, blur=False, fast=True)
+
+        mock_resize.assert_called_once_with((400, 300), Image.NEAREST)
+
+    def test_aspect_ratio_is_kept(self):
+        """フレームの縦横比が異なってもアスペクト比を保って描画されるテスト"""
+        img = self.renderer.render('a.jpg', self.frame, (800, 300), self.box, blur=False)
+
+        assert img.size == (400, 300)
+
+    def test_nearest_pyramid_level(self):
+        """表示サイズ以上で最も小さいピラミッドの段から縮小されるテスト"""
+        level = self.frame.pyramid[1]
+        with patch.object(level, 'resize', return_value=Image.new('RGB', (150, 113))) as mock_resize:
+            self.renderer.render('a.jpg', self.frame, (150, 150), self.box, blur=False)
+
+        mock_resize.assert_called_once_with((150, 112), Image.LANCZOS)
+
+    def test_cache_size(self):
+        """キャッシュは指定枚数を超えると古いものから破棄されるテスト"""
+        renderer = Renderer(10, 2, cache_size=2)
+        first = renderer.render('a.jpg', self.frame, (200, 150), self.box, blur=False)
+        renderer.render('b.jpg', self.frame, (200, 150), self.box, blur=False)
+        renderer.render('c.jpg', self.frame, (200, 150), self.box, blur=False)
+
+        assert renderer.render('a.jpg', self.frame, (200, 150), self.box, blur=False) is not first
+
+    def test_render_loupe(self):
+        """ルーペは範囲の中心に重ねて描かれ、下地は使い回されるテスト"""
+        loupe = Image.new('RGB', (40, 40), (255, 255, 0))
+        img = self.renderer.render_loupe('a.jpg', self.frame, (400, 300), False, (400, 400, 560, 560), loupe)
+
+        assert img.getpixel((120, 120)) == (255, 255, 0)
+        assert img.getpixel((300, 250)) == (0, 128, 0)
+        with patch.object(self.renderer, 'resize') as mock_resize:
+            again = self.renderer.render_loupe('a.jpg', self.frame, (400, 300), False, (0, 0, 160, 160), loupe)
+        mock_resize.assert_not_called()
+        assert again.getpixel((120, 120)) == (0, 128, 0)
+        # 作業用バッファは確保し直さずに使い回す
+        assert again is img
+
+    def test_render_pane(self):
+        """比較表示の1枚には拡大図・シャープさ・選択枠が描かれ、下地は書き換えないテスト"""
+        img = self.renderer.render_pane('a.jpg', self.frame, (200, 150), False, self.box,
+                                        caption='Sharp 10', selected=True)
+
+        assert img.size == (200, 150)
+        assert img.getpixel((0, 75)) == (255, 255, 0)
+        assert img.getpixel((200 - 10 - 20, 150 - 60 - 20)) == (0, 0, 255)
+        # シャープさは左下に白地で描かれる
+        assert img.getpixel((8, 150 - 6)) == (255, 255, 255)
+        base = self.renderer.base_layer('a.jpg', self.frame, (200, 150), False)
+        assert base.getpixel((0, 75)) == (0, 128, 0)
+
+        loupe = Image.new('RGB', (40, 40), (255, 0, 255))
+        img = self.renderer.render_pane('a.jpg', self.frame, (200, 150), False, (400, 400, 560, 560), loupe)
+        assert img.getpixel((60, 60)) == (255, 0, 255)
+        assert img.getpixel((0, 75)) == (0, 128, 0)
+
+    def test_render_cell(self):
+        """一覧表示のセルにサムネイル・判定の枠・Blur・選択枠が描かれ、下地は書き換えないテスト"""
+        thumb = Image.new('RGB', (160, 120), (0, 0, 255))
+
+        img = self.renderer.render_cell(thumb, 100, decision_color='red', blur=True, selected=True)
+
+        assert img.size == (100, 100)
+        # サムネイルはセルに収まるように縮めて中央に置く
+        assert img.getpixel((50, 50)) == (0, 0, 255)
+        assert img.getpixel((50, 10)) == CELL_BACKGROUND
+        assert img.getpixel((4, 50)) == (255, 0, 0)
+        assert img.getpixel((0, 50)) == (255, 255, 0)
+        assert img.getpixel((6, 6)) == small_blur_label().getpixel((0, 0))
+        assert blank_cell(100).getpixel((4, 50)) == CELL_BACKGROUND
+
+        # 読み込み前のセルは下地だけ
+        assert self.renderer.render_cell(None, 100).getpixel((50, 50)) == CELL_BACKGROUND
+
+    def test_unknown_filter(self):
+        """不明なフィルタ名はValueErrorになるテスト"""
+        with pytest.raises(ValueError):
+            resample_filter('sharpest')
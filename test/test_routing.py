@@ -0,0 +1,57 @@
+import pytest
+import os
+import sys
+from datetime import datetime
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from metadata import ImageMetadata
+from routing import ImageFacts, parse_destinations, parse_routes, route_images
+
+
+class TestDestinations:
+    """保存先の設定の解析のテスト"""
+
+    def test_parse(self):
+        """キー・フォルダ・保存方法が解析されるテスト"""
+        destinations = parse_destinations([('client', 'F1, client'), ('print', 'F2, D:/print, 2024, move')])
+
+        assert list(destinations) == ['client', 'print']
+        assert destinations['client'].key == 'F1'
+        assert destinations['client'].strategy is None
+        assert destinations['client'].path('/sel', 'a.jpg') == os.path.join('/sel', 'client', 'a.jpg')
+        # フォルダ名のカンマは残る
+        assert destinations['print'].folder == 'D:/print, 2024'
+        assert destinations['print'].strategy == 'move'
+
+    def test_invalid(self):
+        """キーかフォルダが無い・保存先が無い振り分けはValueErrorになるテスト"""
+        with pytest.raises(ValueError):
+            parse_destinations([('client', 'F1')])
+        destinations = parse_destinations([('client', 'F1, client')])
+        with pytest.raises(ValueError):
+            parse_routes([('print', 'blur > 1')], destinations)
+        with pytest.raises(ValueError):
+            parse_routes([('client', 'sharpness > 1')], destinations)
+
+
+class TestRouteImages:
+    """条件による振り分けのテスト"""
+
+    def test_route(self):
+        """上に書いた条件から順に判定され、当てはまらない画像は含まれないテスト"""
+        destinations = parse_destinations([('client', 'F1, client'), ('print', 'F2, print')])
+        routes = parse_routes([('print', 'blur >= 300, rating >= 4'), ('client', 'capture >= 2024-05-01')],
+                              destinations)
+        may = datetime(2024, 5, 2).timestamp()
+        facts = {
+            'sharp.jpg': ImageFacts(ImageMetadata(capture_time=may), 500.0, 5),
+            'recent.jpg': ImageFacts(ImageMetadata(capture_time=may), 100.0, 5),
+            'old.jpg': ImageFacts(ImageMetadata(capture_time=datetime(2024, 4, 1).timestamp()), 100.0, 0),
+            # 撮影情報もぼやけ値も無い画像はどこにも当てはまらない
+            'unknown.jpg': ImageFacts(None),
+        }
+
+        routed = route_images(list(facts), facts.get, routes)
+
+        assert routed == {destinations['print']: ['sharp.jpg'], destinations['client']: ['recent.jpg']}
@@ -0,0 +1,126 @@
+import pytest
+import os
+import sys
+import json
+import tempfile
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from session import SessionStore, KEEP, DELETE, UNRATED, file_stamp
+
+
+class TestSessionStore:
+    """セッション（判定・評価・表示位置）の保存テスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_in_memory(self):
+        """パス無しの場合はファイルを作らずに保持するテスト"""
+        store = SessionStore()
+        store.set_decision('a.jpg', DELETE)
+        store.set_rating('a.jpg', 3)
+        store.close()
+
+        assert store.decision('a.jpg') == DELETE
+        assert store.rating('a.jpg') == 3
+        assert store.decision('b.jpg') == UNRATED
+        assert os.listdir(self.temp_dir) == []
+
+    def test_journal_survives_crash(self):
+        """closeせずに終了しても、ジャーナルから判定が復元されるテスト"""
+        store = SessionStore.for_folder(self.temp_dir)
+        store.set_decision('a.jpg', KEEP)
+        store.set_decision('b.jpg', DELETE)
+        store.set_rating('a.jpg', 5)
+        store.set_position('b.jpg')
+
+        resumed = SessionStore.for_folder(self.temp_dir)
+
+        assert resumed.decision('a.jpg') == KEEP
+        assert resumed.names_with(DELETE) == ['b.jpg']
+        assert resumed.rating('a.jpg') == 5
+        assert resumed.position == 'b.jpg'
+
+    def test_truncated_line_is_ignored(self):
+        """書き込み途中の行は無視され、その後の追記も読めるテスト"""
+        store = SessionStore.for_folder(self.temp_dir)
+        store.set_decision('a.jpg', DELETE)
+        with open(store.journal_path, 'ab') as f:
+            f.write(b'{"n": "b.jpg", "d"')
+
+        resumed = SessionStore.for_folder(self.temp_dir)
+        resumed.set_decision('c.jpg', DELETE)
+        again = SessionStore.for_folder(self.temp_dir)
+
+        assert again.names_with(DELETE) == ['a.jpg', 'c.jpg']
+
+    def test_compaction(self):
+        """一定件数ごとにスナップショットへまとめられ、ジャーナルが空になるテスト"""
+        store = SessionStore.for_folder(self.temp_dir, compact_every=3)
+        for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+            store.set_decision(name, DELETE)
+        store.set_decision('a.jpg', UNRATED)
+
+        with open(store.path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        assert sorted(snapshot['decisions']) == ['a.jpg', 'b.jpg', 'c.jpg']
+        with open(store.journal_path, 'r', encoding='utf-8') as f:
+            assert len(f.readlines()) == 1
+
+        resumed = SessionStore.for_folder(self.temp_dir)
+        assert resumed.names_with(DELETE) == ['b.jpg', 'c.jpg']
+
+    def test_close_compacts(self):
+        """close時にジャーナルがスナップショットにまとめられるテスト"""
+        store = SessionStore.for_folder(self.temp_dir)
+        store.set_decision('a.jpg', DELETE)
+        store.close()
+
+        assert os.path.getsize(store.journal_path) == 0
+        assert SessionStore.for_folder(self.temp_dir).decision('a.jpg') == DELETE
+
+    def test_unchanged_values_are_not_journaled(self):
+        """値が変わらない操作はジャーナルに書かれないテスト"""
+        store = SessionStore.for_folder(self.temp_dir)
+        store.set_position('a.jpg')
+        store.set_position('a.jpg')
+        store.set_decision('a.jpg', UNRATED)
+
+        with open(store.journal_path, 'r', encoding='utf-8') as f:
+            assert len(f.readlines()) == 1
+
+    def test_delete_stamp(self):
+        """削除マークのサイズと更新日時がジャーナル・スナップショットから復元され、判定を変えると消えるテスト"""
+        path = os.path.join(self.temp_dir, 'a.jpg')
+        with open(path, 'wb') as f:
+            f.write(b'A' * 10)
+        stamp = file_stamp(path)
+        assert stamp[0] == 10
+        assert file_stamp(os.path.join(self.temp_dir, 'missing.jpg')) is None
+
+        store = SessionStore.for_folder(self.temp_dir)
+        store.set_decision('a.jpg', DELETE, stamp)
+        store.set_decision('b.jpg', DELETE, stamp)
+        store.set_decision('b.jpg', KEEP, stamp)
+        store._journal.close()
+
+        reopened = SessionStore.for_folder(self.temp_dir)
+        assert reopened.stamp('a.jpg') == stamp
+        assert reopened.stamp('b.jpg') is None
+        reopened.close()
+        assert SessionStore.for_folder(self.temp_dir).stamp('a.jpg') == stamp
+
+    def test_invalid_values(self):
+        """不正な判定・評価はValueErrorになるテスト"""
+        store = SessionStore()
+        with pytest.raises(ValueError):
+            store.set_decision('a.jpg', 'maybe')
+        with pytest.raises(ValueError):
+            store.set_rating('a.jpg', 6)
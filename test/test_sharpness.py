@@ -0,0 +1,112 @@
+import pytest
+import os
+import sys
+from PIL import Image, ImageFilter
+import numpy as np
+import cv2
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from sharpness import (SharpnessEngine, luminance, laplacian_variance, tenengrad, fft_energy,
+                       register_metric, split_tiles, METRICS)
+
+
+def make_image(size=(640, 480), blur=0, seed=0):
+    rng = np.random.default_rng(seed)
+    img = Image.fromarray(rng.integers(0, 256, (size[1], size[0]), dtype=np.uint8)).convert('RGB')
+    if blur:
+        img = img.filter(ImageFilter.GaussianBlur(blur))
+    return img
+
+
+class TestMetrics:
+    """評価関数のテスト"""
+
+    def test_luminance_fixed_long_edge(self):
+        """長辺が解析サイズに縮小され、float32になるテスト"""
+        lum = luminance(make_image((4000, 3000)), 1024)
+
+        assert lum.shape == (768, 1024)
+        assert lum.dtype == np.float32
+
+    def test_luminance_never_upscales(self):
+        """解析サイズより小さい画像は拡大しないテスト"""
+        assert luminance(make_image((320, 240)), 1024).shape == (240, 320)
+
+    def test_laplacian_matches_opencv(self):
+        """OpenCVのラプラシアン分散と内部領域で一致するテスト"""
+        arr = luminance(make_image((200, 100)))
+        expected = cv2.Laplacian(arr, cv2.CV_32F)[1:-1, 1:-1].var()
+
+        assert laplacian_variance(arr) == pytest.approx(expected, rel=1e-4)
+
+    @pytest.mark.parametrize('name', ['laplacian', 'tenengrad', 'fft'])
+    def test_sharp_scores_higher(self, name):
+        """どの評価関数でもシャープな画像の方が値が大きいテスト"""
+        engine = SharpnessEngine(name, size=256)
+
+        assert engine.score(make_image()) > engine.score(make_image(blur=4))
+
+    def test_metrics_are_vectorized(self):
+        """積み重ねた配列をまとめて評価できるテスト"""
+        stack = np.stack([luminance(make_image(seed=i), 128) for i in range(3)])
+        for func in (laplacian_variance, tenengrad, fft_energy):
+            values = func(stack)
+            assert values.shape == (3,)
+            assert values[1] == pytest.approx(func(stack[1]), rel=1e-4)
+
+
+class TestSharpnessEngine:
+    """SharpnessEngineクラスのテスト"""
+
+    def test_resolution_independent(self):
+        """同じ写真なら画素数が違っても近い値になるテスト"""
+        base = make_image((512, 384), blur=1)
+        engine = SharpnessEngine(size=512)
+
+        small = engine.score(base)
+        large = engine.score(base.resize((2048, 1536), Image.BICUBIC))
+
+        assert large == pytest.approx(small, rel=0.35)
+
+    def test_tiles_keep_sharp_subject(self):
+        """タイル最大値では一部だけシャープな写真もシャープと判定されるテスト"""
+        img = make_image(blur=6)
+        img.paste(make_image((120, 120), seed=1), (260, 180))
+
+        whole = SharpnessEngine(size=640, tiles=1).score(img)
+        tiled = SharpnessEngine(size=640, tiles=4).score(img)
+
+        assert tiled > whole * 3
+
+    def test_split_tiles(self):
+        """タイル分割の形状テスト"""
+        arr = np.arange(2 * 10 * 12, dtype=np.float32).reshape(2, 10, 12)
+        tiles = split_tiles(arr, 2)
+
+        assert tiles.shape == (2, 2, 2, 5, 6)
+        assert np.array_equal(tiles[0, 1, 0], arr[0, 5:10, 0:6])
+
+    def test_score_batch_matches_single(self):
+        """まとめて評価しても1枚ずつと同じ値になるテスト（大きさの違う画像を含む）"""
+        engine = SharpnessEngine(size=256, tiles=2)
+        imgs = [make_image(), make_image(blur=2), make_image((300, 400))]
+
+        batch = engine.score_batch(imgs)
+
+        assert batch == pytest.approx([engine.score(img) for img in imgs], rel=1e-4)
+
+    def test_register_metric(self):
+        """評価関数を追加できるテスト"""
+        register_metric('mean', lambda arr: arr.mean(axis=(-2, -1)))
+        try:
+            engine = SharpnessEngine('mean')
+            assert engine.score(Image.new('RGB', (10, 10), color='white')) == pytest.approx(255.0)
+            assert engine.signature == 'mean/1024/1'
+        finally:
+            del METRICS['mean']
+
+    def test_unknown_metric(self):
+        """未登録の評価関数はエラーになるテスト"""
+        with pytest.raises(ValueError):
+            SharpnessEngine('unknown')
@@ -0,0 +1,120 @@
+import pytest
+import os
+import sys
+import tempfile
+from PIL import Image, ImageFilter
+import numpy as np
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from similarity import (MultiIndexHash, dhash, phash, hamming, hash_files, group_bursts,
+                        near_duplicates, image_hash)
+
+
+def scene(seed, shift=0):
+    # 乱数から作った滑らかな画像（shiftで少しずらした連写を模擬）
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (12, 16), dtype=np.uint8)
+    img = Image.fromarray(small).resize((320, 240), Image.BICUBIC).convert('RGB')
+    return img.transform(img.size, Image.AFFINE, (1, 0, shift, 0, 1, 0))
+
+
+class TestHashes:
+    """知覚ハッシュのテスト"""
+
+    @pytest.mark.parametrize('func', [dhash, phash])
+    def test_similar_images_are_close(self, func):
+        """連写のように少しだけ違う画像は近く、別の画像は遠いテスト"""
+        base = func(scene(1))
+        burst = func(scene(1, shift=3).filter(ImageFilter.GaussianBlur(1)))
+        other = func(scene(2))
+
+        assert hamming(base, burst) <= 10
+        assert hamming(base, other) > 16
+        assert 0 <= base < 1 << 64
+
+    def test_unknown_method(self):
+        """不明なハッシュ方法はValueErrorになるテスト"""
+        with pytest.raises(ValueError):
+            image_hash(scene(1), 'ahash')
+
+    def test_hash_files(self):
+        """縮小デコードした画像からハッシュを計算し、読めないファイルはNoneを返すテスト"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'a.jpg')
+            scene(1).save(path, quality=95)
+            missing = os.path.join(temp_dir, 'missing.jpg')
+
+            results = dict(hash_files([path, missing], 'dhash'))
+
+            assert hamming(results[path], dhash(scene(1))) <= 4
+            assert results[missing] is None
+        finally:
+            import shutil
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+class TestMultiIndexHash:
+    """多重インデックスによる近傍検索のテスト"""
+
+    def test_search_matches_brute_force(self):
+        """検索結果が総当たりと一致するテスト"""
+        rng = np.random.default_rng(0)
+        values = [int(v) for v in rng.integers(0, 1 << 16, 500)]
+        index = MultiIndexHash(3, bits=16)
+        for i, v in enumerate(values):
+            index.add(v, i)
+        query = values[0] ^ 0b1000_0000_0101
+
+        found = sorted(i for _, i in index.search(query))
+        expected = sorted(i for i, v in enumerate(values) if hamming(v, query) <= 3)
+
+        assert found == expected
+        assert len(index) == 500
+
+    def test_smaller_radius(self):
+        """作成時より小さい距離でも検索できるテスト"""
+        index = MultiIndexHash(4)
+        index.add(0, 'a')
+        index.add(0b111, 'b')
+
+        assert [item for _, item in index.search(0, 2)] == ['a']
+        assert sorted(item for _, item in index.search(0)) == ['a', 'b']
+
+    def test_duplicate_hashes(self):
+        """同じハッシュの値が複数あっても全て返されるテスト"""
+        index = MultiIndexHash(2)
+        index.add(5, 'a')
+        index.add(5, 'b')
+
+        assert sorted(item for _, item in index.search(5)) == ['a', 'b']
+        assert MultiIndexHash(2).search(5) == []
+
+
+class TestGrouping:
+    """連写のグループ分けのテスト"""
+
+    def test_group_bursts(self):
+        """並び順で近く、ハッシュも近い画像がまとめられるテスト"""
+        names = ['a', 'b', 'c', 'd', 'e', 'f']
+        hashes = {'a': 0b0000, 'b': 0b0001, 'c': 0b1111_0000_0000, 'd': 0b0011, 'e': 0b1111_0000_0001}
+
+        groups = group_bursts(names, hashes, threshold=2, window=2)
+
+        assert groups == [['a', 'b', 'd'], ['c', 'e'], ['f']]
+
+    def test_far_apart_frames_are_not_grouped(self):
+        """ハッシュが同じでも並び順で離れていればまとめないテスト"""
+        names = ['a', 'b', 'c', 'd', 'e']
+        hashes = {'a': 0, 'b': 0xFFFF, 'c': 0xFF00, 'd': 0x00FF, 'e': 0}
+
+        assert group_bursts(names, hashes, threshold=1, window=3) == [['a'], ['b'], ['c'], ['d'], ['e']]
+
+    def test_near_duplicates(self):
+        """並び順に関係なく近いハッシュの画像がまとめられるテスト"""
+        hashes = {'a': 0, 'b': 0xFFFF, 'c': 0b1, 'd': 0xFFFE, 'e': 0xF0F0, 'f': None}
+
+        groups = sorted(sorted(g) for g in near_duplicates(hashes, threshold=1))
+
+        assert groups == [['a', 'c'], ['b', 'd']]
@@ -0,0 +1,27 @@
+import os
+import sys
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), '..', 'src')
+
+
+class TestStartup:
+    """起動を速くするための読み込みのテスト"""
+
+    def imported(self, modules, heavy=('tkinter', 'numpy', 'pillow_heif', 'cv2')):
+        """別プロセスでmodulesをインポートし、読み込まれた重いモジュールを返す"""
+        code = (f'import sys; sys.path.insert(0, {os.path.abspath(SRC_DIR)!r}); import {", ".join(modules)}; '
+                f'print(",".join(m for m in {heavy!r} if m in sys.modules))')
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        return [m for m in result.stdout.strip().split(',') if m]
+
+    def test_core_modules_without_tk(self):
+        """解析・デコード・セッション等のモジュールはTkや重いライブラリを読み込まないテスト"""
+        modules = ['config', 'decode', 'indexer', 'session', 'analysis_cache', 'sharpness',
+                   'similarity', 'blur_scan', 'prefetch', 'render', 'tiles', 'fileops', 'cli']
+
+        assert self.imported(modules) == []
+
+    def test_main_defers_heavy_imports(self):
+        """main.pyの読み込み時点ではnumpy・pillow-heifを読み込まないテスト"""
+        assert self.imported(['main'], heavy=('numpy', 'pillow_heif', 'cv2')) == []
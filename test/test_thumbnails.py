@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+from PIL import Image
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from thumbnails import GridLayout, load_thumbnail
+from analysis_cache import AnalysisCache, encode_image
+
+
+class TestGridLayout:
+    """一覧表示のセルの配置のテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        # 幅430に100pxのセルが4列（余りの30pxは左右に15pxずつ）、20000枚で5000行
+        self.layout = GridLayout(20000, (430, 250), 100)
+
+    def test_visible(self):
+        """見えている行のセルだけが対象になるテスト"""
+        assert self.layout.columns == 4
+        assert self.layout.rows == 5000
+        assert self.layout.visible(0) == range(0, 12)
+        assert self.layout.visible(150) == range(4, 16)
+        assert self.layout.visible(self.layout.max_offset) == range(19988, 20000)
+
+    def test_position_and_index_at(self):
+        """セルの表示位置と、表示位置からのセルの番号が対応するテスト"""
+        assert self.layout.position(5, 150) == (115, -50)
+        assert self.layout.index_at(115, 0, 150) == 5
+        assert self.layout.index_at(5, 0, 150) is None
+        assert GridLayout(6, (430, 250), 100).index_at(300, 150, 0) is None
+
+    def test_scroll(self):
+        """選択したセルが見えるようにスクロールし、範囲外には出ないテスト"""
+        assert self.layout.scroll_to(10, 0) == 50
+        assert self.layout.scroll_to(0, 50) == 0
+        assert self.layout.scroll_to(5, 50) == 50
+        assert self.layout.centered(400) == 100 * 100 - 75
+        assert self.layout.clamp(-10) == 0
+        assert self.layout.clamp(10**9) == 5000 * 100 - 250
+
+
+class TestLoadThumbnail:
+    """サムネイルの読み込みのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'a.jpg')
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', (800, 600), (128, 128, 128)).save(self.path, exif=exif)
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_decode_with_orientation(self):
+        """埋め込みサムネイルもキャッシュも無ければ縮小デコードし、向きを直すテスト"""
+        img = load_thumbnail(self.path, 100)
+
+        assert img.size == (75, 100)
+
+    def test_uses_cached_preview(self):
+        """永続キャッシュに表示用プレビューがあればそれを使うテスト"""
+        cache = AnalysisCache(os.path.join(self.temp_dir, 'cache.sqlite'))
+        try:
+            cache.store(self.path, preview=encode_image(Image.new('RGB', (300, 400), (255, 0, 0))))
+
+            img = load_thumbnail(self.path, 100, cache)
+        finally:
+            cache.close()
+
+        assert img.size == (75, 100)
+        r, g, b = img.getpixel((37, 50))
+        assert r > 200 and g < 50
@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+from PIL import Image
+import numpy as np
+from unittest.mock import patch
+
+# テスト対象のモジュールをインポート
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import tiles
+from tiles import TileCache
+
+
+class TestTileCache:
+    """元解像度タイルキャッシュのテスト"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される初期化処理"""
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.arr = rng.integers(0, 256, (600, 800, 3), dtype=np.uint8)
+        self.path = os.path.join(self.temp_dir, 'test.png')
+        Image.fromarray(self.arr).save(self.path)
+        self.size = (800, 600)
+
+    def teardown_method(self):
+        """各テストメソッドの後に実行される後処理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_region_matches_full_decode(self):
+        """タイルから組み立てた範囲が元画像の切り出しと一致するテスト"""
+        cache = TileCache(64 * 1024 * 1024, tile_size=128)
+        region = cache.region(self.path, (100, 150, 390, 300), self.size)
+
+        assert np.array_equal(np.asarray(region), self.arr[150:300, 100:390])
+
+    def test_region_at_edge(self):
+        """画像の端に掛かる範囲も切り出せるテスト"""
+        cache = TileCache(64 * 1024 * 1024, tile_size=128)
+        region = cache.region(self.path, (700, 500, 800, 600), self.size)
+
+        assert np.array_equal(np.asarray(region), self.arr[500:600, 700:800])
+
+    def test_only_band_is_decoded(self):
+        """範囲の行（上下halo行を含む）のタイルだけがデコードされるテスト"""
+        cache = TileCache(64 * 1024 * 1024, tile_size=100, halo=1)
+        cache.region(self.path, (10, 10, 50, 50), self.size)
+
+        rows = {key[2] for key in cache.cache.keys()}
+        assert rows == {0, 1}
+        assert len(cache.cache) == 8 * 2
+
+    def test_cached_tiles_are_not_decoded_again(self):
+        """キャッシュ済みのタイルだけで足りる場合はデコードしないテスト"""
+        cache = TileCache(64 * 1024 * 1024, tile_size=100)
+        cache.region(self.path, (10, 10, 50, 50), self.size)
+        with patch.object(tiles, 'load_regions') as mock_load:
+            region = cache.region(self.path, (600, 20, 700, 90), self.size)
+
+        mock_load.assert_not_called()
+        assert np.array_equal(np.asarray(region), self.arr[20:90, 600:700])
+
+    def test_lru_eviction(self):
+        """メモリ上限を超えたタイルは古いものから破棄されるテスト"""
+        cache = TileCache(100 * 100 * 3 * 4, tile_size=100, halo=0)
+        region = cache.region(self.path, (0, 500, 800, 600), self.size)
+
+        assert len(cache.cache) == 4
+        assert np.array_equal(np.asarray(region), self.arr[500:600])
+
+    def test_discard(self):
+        """ファイルを指定してタイルを破棄できるテスト"""
+        cache = TileCache(64 * 1024 * 1024, tile_size=200)
+        cache.region(self.path, (0, 0, 10, 10), self.size)
+        cache.discard(self.path)
+
+        assert len(cache.cache) == 0